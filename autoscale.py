@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''评测线程(进程)数自动调整
+
+check_thread每秒调用Autoscaler.decide,在autoscale_min_workers和autoscale_max_workers之间调整目标数:
+    队列积压(每个评测线程多于autoscale_queue_per_worker个任务或最早的任务等待超过autoscale_wait_up秒)
+        持续autoscale_up_delay秒,增加autoscale_step个
+    队列为空且忙碌的线程不到autoscale_idle_ratio,持续autoscale_down_delay秒,减少autoscale_step个
+    主机负载(每核loadavg)超过autoscale_max_load或可用内存少于autoscale_min_memory,
+        持续autoscale_up_delay秒,减少autoscale_step个,积压时也不增加
+每次调整后至少autoscale_cooldown秒不再调整.多出的评测线程在空闲时退出,不中断正在评测的任务
+'''
+import os
+import time
+import logging
+import config
+
+def host_load():
+    '''每个核的1分钟平均负载'''
+    try:
+        return os.getloadavg()[0] / (os.sysconf('SC_NPROCESSORS_ONLN') or 1)
+    except OSError:
+        return 0
+
+def mem_available():
+    '''可用内存(KB),无法读取时为None'''
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])
+    except (IOError, ValueError):
+        pass
+    return None
+
+class Autoscaler(object):
+    '''根据队列和主机负载决定评测线程(进程)数'''
+    def __init__(self, minimum, maximum, initial=None):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.target = max(self.minimum, min(self.maximum, initial or self.minimum))
+        self.want = 0           #当前的趋势: 1增加, -1减少, 0保持
+        self.since = time.time()  #趋势开始的时间
+        self.last_change = 0
+        self.reason = ""
+
+    def pressure(self):
+        '''主机负载过高或内存不足的原因,没有时为None'''
+        load = host_load()
+        if load > config.autoscale_max_load:
+            return "load %.2f"%load
+        mem = mem_available()
+        if mem is not None and mem < config.autoscale_min_memory:
+            return "memory %sKB"%mem
+        return None
+
+    def decide(self, depth, oldest_wait, busy, now=None):
+        '''返回新的目标数'''
+        now = now or time.time()
+        pressure = self.pressure()
+        if pressure is not None:
+            want, delay, reason = -1, config.autoscale_up_delay, pressure
+        elif depth > self.target * config.autoscale_queue_per_worker or oldest_wait > config.autoscale_wait_up:
+            want, delay, reason = 1, config.autoscale_up_delay, "queue %s, oldest %.1fs"%(depth, oldest_wait)
+        elif depth == 0 and busy < self.target * config.autoscale_idle_ratio:
+            want, delay, reason = -1, config.autoscale_down_delay, "idle, %s busy"%busy
+        else:
+            want, delay, reason = 0, 0, ""
+        if want != self.want:
+            self.want, self.since = want, now
+        if want == 0 or now - self.since < delay or now - self.last_change < config.autoscale_cooldown:
+            return self.target
+        target = max(self.minimum, min(self.maximum, self.target + want * config.autoscale_step))
+        if target != self.target:
+            logging.info("workers %s -> %s (%s)"%(self.target, target, reason))
+            self.target, self.reason = target, reason
+            self.last_change = now
+        self.since = now #继续调整需要再持续delay秒
+        return self.target
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''评测吞吐量测试
+
+用生成的题目和各种语言,各种结果的提交驱动protect的完整流程(获取任务,编译,运行,比较,写结果),
+报告每秒评测数,从提交到出结果的延迟p50/p99,以及各阶段的耗时.
+默认使用进程内的sqlite代替数据库,--dsn指定一个空的PostgreSQL测试库时使用该库(会建表并写入数据).
+需要root运行(protect会切换到nobody),所有文件放在临时目录中
+
+Usage: sudo python bench.py [-n 提交数] [--cases 每题数据组数] [--mode thread|process] [--dsn DSN]
+'''
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import config
+
+SCHEMA = [
+    "create table solution (id integer primary key, problem_id integer, user_id integer, contest_id integer, program_language varchar(20), result integer, take_time integer, take_memory integer)",
+    "create table code (solution_id integer, content text)",
+    "create table problem (id integer primary key, time_limit integer, memory_limit integer)",
+    "create table user_statistics (id integer primary key, accepts_count integer, solutions_count integer)",
+    "create table problem_statistics (id integer primary key, accepts_count integer, solutions_count integer)",
+    "create table compile_info (code_id integer, content text)",
+]
+
+#题目: 每行两个整数,输出和
+PROGRAMS = {
+    "gcc": {
+        "Accepted": '#include <stdio.h>\nint main(){long long a,b;while(scanf("%lld %lld",&a,&b)==2)printf("%lld\\n",a+b);return 0;}\n',
+        "Wrong Answer": '#include <stdio.h>\nint main(){long long a,b;while(scanf("%lld %lld",&a,&b)==2)printf("%lld\\n",a-b);return 0;}\n',
+        "Presentation Error": '#include <stdio.h>\nint main(){long long a,b;while(scanf("%lld %lld",&a,&b)==2)printf("%lld \\n\\n",a+b);return 0;}\n',
+        "Time Limit Exceeded": 'int main(){volatile unsigned long long i=0;for(;;)i++;return 0;}\n',
+        "Runtime Error": '#include <stdio.h>\nint main(){int *p=0;*p=1;printf("%d",*p);return 0;}\n',
+        "Compile Error": 'int main(){return undefined_name;}\n',
+    },
+    "g++": {
+        "Accepted": '#include <iostream>\nint main(){long long a,b;while(std::cin>>a>>b)std::cout<<a+b<<"\\n";return 0;}\n',
+    },
+    "java": {
+        "Accepted": 'import java.util.*;\npublic class Main{public static void main(String[] x){Scanner s=new Scanner(System.in);StringBuilder o=new StringBuilder();while(s.hasNextLong()){long a=s.nextLong(),b=s.nextLong();o.append(a+b).append("\\n");}System.out.print(o);}}\n',
+    },
+    "python2": {
+        "Accepted": 'import sys\nfor line in sys.stdin:\n    a, b = map(int, line.split())\n    print a + b\n',
+        "Wrong Answer": 'import sys\nfor line in sys.stdin:\n    print 0\n',
+    },
+    "python3": {
+        "Accepted": 'import sys\nfor line in sys.stdin:\n    a, b = map(int, line.split())\n    print(a + b)\n',
+    },
+    "ruby": {
+        "Accepted": 'STDIN.each_line{|l| a,b=l.split.map(&:to_i); puts a+b}\n',
+    },
+    "perl": {
+        "Accepted": 'while(<STDIN>){my($a,$b)=split;print $a+$b,"\\n";}\n',
+    },
+}
+
+#编译器 -> 语言,没有安装的语言不生成提交
+COMPILERS = {"gcc":"gcc", "g++":"g++", "java":"javac", "python2":"python2", "python3":"python3", "ruby":"ruby", "perl":"perl"}
+
+#各结果的提交比例
+VERDICT_WEIGHTS = {
+    "Accepted": 60, "Wrong Answer": 20, "Presentation Error": 4,
+    "Time Limit Exceeded": 4, "Runtime Error": 6, "Compile Error": 6,
+}
+
+VERDICT_CODE = {
+    "Accepted":1, "Time Limit Exceeded":2, "Memory Limit Exceeded":3, "Wrong Answer":4,
+    "Runtime Error":5, "Output limit":6, "Compile Error":7, "Presentation Error":8, "System Error":11,
+}
+
+def available_languages():
+    null = open(os.devnull, 'w')
+    langs = []
+    for lang, exe in sorted(COMPILERS.items()):
+        if subprocess.call("which %s"%exe, shell=True, stdout=null, stderr=null) == 0:
+            langs.append(lang)
+    return langs
+
+def make_problems(data_dir, problems, cases, lines):
+    '''生成problems道题目,每题cases组数据,每组lines行'''
+    rnd = random.Random(1)
+    for pid in range(1, problems + 1):
+        path = os.path.join(data_dir, str(pid))
+        os.makedirs(path)
+        for num in range(1, cases + 1):
+            pairs = [(rnd.randint(-10**9, 10**9), rnd.randint(-10**9, 10**9)) for i in range(lines)]
+            with open(os.path.join(path, 'data%s.in'%num), 'w') as f:
+                f.write(''.join('%s %s\n'%p for p in pairs))
+            with open(os.path.join(path, 'data%s.out'%num), 'w') as f:
+                f.write(''.join('%s\n'%(a + b) for a, b in pairs))
+
+def make_submissions(count, problems, langs, seed):
+    '''生成(solution_id,problem_id,user_id,contest_id,语言,预期结果,代码)'''
+    rnd = random.Random(seed)
+    choices = []
+    for lang in langs:
+        for verdict, code in PROGRAMS[lang].items():
+            choices.append((VERDICT_WEIGHTS.get(verdict, 1) * (3 if lang == "gcc" else 1), lang, verdict, code))
+    total = sum(c[0] for c in choices)
+    subs = []
+    for sid in range(1, count + 1):
+        r = rnd.uniform(0, total)
+        for weight, lang, verdict, code in choices:
+            r -= weight
+            if r <= 0:
+                break
+        subs.append((sid, rnd.randint(1, problems), rnd.randint(1, 50), rnd.choice([0, 0, 0, 1]), lang, verdict, code))
+    return subs
+
+def connect_factory(args, root):
+    '''返回打开数据库连接的函数和sql参数占位符'''
+    if args.dsn:
+        import psycopg2
+        return (lambda: psycopg2.connect(args.dsn)), '%s'
+    import sqlite3
+    path = os.path.join(root, 'bench.db')
+    return (lambda: sqlite3.connect(path, check_same_thread=False, timeout=30)), '?'
+
+def setup_db(connect, problems, time_limit, mem_limit):
+    con = connect()
+    cur = con.cursor()
+    for sql in SCHEMA:
+        cur.execute(sql)
+    for pid in range(1, problems + 1):
+        cur.execute("insert into problem values (%s,%s,%s)"%(pid, time_limit, mem_limit))
+        cur.execute("insert into problem_statistics values (%s,0,0)"%pid)
+    for uid in range(1, 51):
+        cur.execute("insert into user_statistics values (%s,0,0)"%uid)
+    con.commit()
+    return con
+
+def submit(con, mark, subs):
+    '''写入提交,返回提交时间'''
+    cur = con.cursor()
+    sql = "insert into code values (%s,%s)"%(mark, mark)
+    for sid, pid, uid, cid, lang, verdict, code in subs:
+        cur.execute(sql, (sid, code))
+        cur.execute("insert into solution values (%s,%s,%s,%s,'%s',0,0,0)"%(sid, pid, uid, cid, lang))
+    con.commit()
+    return time.time()
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def phase_report(registry):
+    '''从metrics中读取各阶段的次数和耗时'''
+    rows = []
+    for (name, labels), hist in sorted(registry.histograms.items()):
+        if name != 'oj_phase_seconds':
+            continue
+        count, total = hist[-1], hist[-2]
+        rows.append((dict(labels)['phase'], count, total, total / count if count else 0))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="judge throughput benchmark")
+    parser.add_argument('-n', '--count', type=int, default=200, help="提交数")
+    parser.add_argument('--problems', type=int, default=5)
+    parser.add_argument('--cases', type=int, default=10, help="每题数据组数")
+    parser.add_argument('--lines', type=int, default=1000, help="每组数据行数")
+    parser.add_argument('--batches', type=int, default=1, help="分几批提交")
+    parser.add_argument('--interval', type=float, default=0, help="每批间隔(秒)")
+    parser.add_argument('--mode', choices=['thread', 'process', 'pipeline'], default=config.worker_mode)
+    parser.add_argument('--threads', type=int, default=config.count_thread)
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--dsn', help="空的PostgreSQL测试库,不指定时使用sqlite")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help="保留临时目录")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='oj_bench_')
+    os.chmod(root, 0777)
+    for name in ('work', 'data', 'shm', 'cache'):
+        os.mkdir(os.path.join(root, name))
+        os.chmod(os.path.join(root, name), 0777)
+    config.work_dir = os.path.join(root, 'work/')
+    config.data_dir = os.path.join(root, 'data/')
+    config.work_tmpfs_dir = os.path.join(root, 'shm/')
+    config.compile_cache_dir = os.path.join(root, 'cache/')
+    config.case_stats_path = os.path.join(root, 'case_stats.json')
+    config.runtime_calib_path = os.path.join(root, 'runtime_calib.json')
+    config.worker_mode = "thread" if args.mode == "pipeline" else args.mode
+    config.count_thread = args.threads
+    config.pipeline = args.mode == "pipeline"
+    config.pipeline_run_workers = args.threads
+    config.intake_mode = "poll"
+    config.stats_reconcile_interval = 0
+    config.metrics_port = 0
+    config.manifest_inotify = False
+    config.runtime_calibrate = False
+
+    make_problems(config.data_dir, args.problems, args.cases, args.lines)
+    langs = available_languages()
+    subs = make_submissions(args.count, args.problems, langs, args.seed)
+    connect, mark = connect_factory(args, root)
+    con = setup_db(connect, args.problems, 1000, 65536)
+    if not args.dsn:
+        os.chmod(os.path.join(root, 'bench.db'), 0666)
+
+    import db
+    db.connect = connect #评测进程fork后重建连接池时也使用该函数
+    import protect #切换到nobody
+    from metrics import registry
+
+    print "languages: %s"%' '.join(langs)
+    print "%s submissions, %s problems x %s cases, %s %s workers"%(args.count, args.problems, args.cases, args.threads, args.mode)
+    if args.mode == "process":
+        protect.start_work_process()
+    protect.start_get_task()
+    if args.mode == "pipeline":
+        protect.start_pipeline()
+    elif args.mode != "process":
+        protect.start_work_thread()
+
+    expected = dict((s[0], s[5]) for s in subs)
+    submitted = {}
+    finished = {}
+    start = time.time()
+    size = (len(subs) + args.batches - 1) / args.batches
+    batches = [subs[i:i + size] for i in range(0, len(subs), size)]
+    next_batch = start
+    cur = con.cursor()
+    while len(finished) < len(subs) and time.time() - start < args.timeout:
+        if batches and time.time() >= next_batch:
+            batch = batches.pop(0)
+            now = submit(con, mark, batch)
+            for s in batch:
+                submitted[s[0]] = now
+            next_batch = now + args.interval
+        cur.execute("select id,result from solution where result not in (0,12)")
+        now = time.time()
+        for sid, result in cur.fetchall():
+            if sid not in finished:
+                finished[sid] = (now, result)
+        con.commit()
+        time.sleep(0.02)
+    elapsed = time.time() - start
+
+    latencies = [finished[sid][0] - submitted[sid] for sid in finished]
+    wrong = [(sid, expected[sid], finished[sid][1]) for sid in finished
+             if VERDICT_CODE.get(expected[sid]) != finished[sid][1]]
+    print
+    print "judged      %s / %s in %.2fs"%(len(finished), len(subs), elapsed)
+    print "throughput  %.2f submissions/s"%(len(finished) / elapsed if elapsed else 0)
+    print "latency     p50 %.3fs  p99 %.3fs  max %.3fs"%(
+        percentile(latencies, 0.5), percentile(latencies, 0.99), max(latencies or [0]))
+    print "unexpected  %s"%len(wrong)
+    for sid, want, got in wrong[:10]:
+        print "    solution %s expected %s got %s"%(sid, want, got)
+    print
+    print "%-10s %8s %10s %10s"%("phase", "count", "total s", "avg ms")
+    for name, count, total, avg in phase_report(registry):
+        print "%-10s %8s %10.3f %10.2f"%(name, count, total, avg * 1000)
+    if not args.keep:
+        shutil.rmtree(root, ignore_errors=True)
+    else:
+        print "files kept in %s"%root
+    sys.stdout.flush()
+    os._exit(0 if len(finished) == len(subs) else 1)
+
+if __name__ == '__main__':
+    main()
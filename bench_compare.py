@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''比较原来整个文件读入内存的比较方式和compare.py流式比较的速度和内存
+
+Usage: python bench_compare.py [输出大小MB]
+每种情况在单独的子进程中运行,内存为子进程的最大常驻内存
+'''
+import os
+import sys
+import time
+import shutil
+import tempfile
+import compare
+
+def legacy_compare(currect_result,user_result):
+    '''原来的judge_result比较方式'''
+    curr = file(currect_result).read().replace('\r','').rstrip()
+    user = file(user_result).read().replace('\r','').rstrip()
+    if curr == user:
+        return "Accepted"
+    if curr.split() == user.split():
+        return "Presentation Error"
+    if curr in user:
+        return "Output limit"
+    return "Wrong Answer"
+
+def write_lines(path, lines, sep='\n'):
+    f = open(path, 'wb')
+    for line in lines:
+        f.write(line + sep)
+    f.close()
+
+def make_cases(work, size_mb):
+    '''生成各种结果的标准输出和用户输出'''
+    count = size_mb * 1024 * 1024 / 16
+    line = lambda i: '%07d %07d'%(i, i * 7 % 9999991)
+    expected = os.path.join(work, 'expected')
+    write_lines(expected, (line(i) for i in xrange(count)))
+    cases = [
+        ('Accepted', lambda i: line(i), '\n'),
+        ('Presentation Error', lambda i: line(i).replace(' ', '  '), '\r\n'),
+        ('Wrong Answer (first line)', lambda i: line(i) if i else 'x', '\n'),
+        ('Wrong Answer (last line)', lambda i: line(i) if i < count - 1 else 'x', '\n'),
+    ]
+    for name, gen, sep in cases:
+        path = os.path.join(work, name.split()[0] + str(len(name)))
+        write_lines(path, (gen(i) for i in xrange(count)), sep)
+        yield name, expected, path
+    path = os.path.join(work, 'output_limit')
+    write_lines(path, (line(i) for i in xrange(count + 1000)))
+    yield 'Output limit', expected, path
+
+def measure(func, expected, user):
+    '''在子进程中执行比较,返回(结果,耗时,最大内存KB)'''
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        start = time.time()
+        result = func(expected, user)
+        os.write(w, '%s\t%f'%(result, time.time() - start))
+        os._exit(0)
+    os.close(w)
+    data = os.read(r, 1024)
+    os.close(r)
+    _, _, usage = os.wait4(pid, 0)
+    result, used = data.split('\t')
+    return result, float(used), usage.ru_maxrss
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    work = tempfile.mkdtemp()
+    try:
+        print '%-28s %-20s %10s %10s %10s %10s'%('case', 'result', 'old s', 'new s', 'old MB', 'new MB')
+        for name, expected, user in make_cases(work, size_mb):
+            old = measure(legacy_compare, expected, user)
+            new = measure(compare.compare_output, expected, user)
+            if old[0] != new[0]:
+                print '%s: result mismatch %s != %s'%(name, old[0], new[0])
+            print '%-28s %-20s %10.3f %10.3f %10.1f %10.1f'%(
+                name, new[0], old[1], new[1], old[2] / 1024.0, new[2] / 1024.0)
+    finally:
+        shutil.rmtree(work)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''运行一次提交的多组测试数据
+
+run_cases按编号顺序产生每组数据的结果,可以用多个线程同时运行,也可以按指定顺序运行.
+某组数据失败(failed返回True)后不再启动编号更大的数据,编号更小的数据都会运行,
+所以按编号顺序处理结果时,最先遇到的失败与顺序评测完全相同
+'''
+import os
+import sys
+import errno
+import select
+import signal
+import struct
+import cPickle
+import threading
+
+#正在fork_call中等待的线程 {线程ident: 子进程pid},取消时据此结束正在运行的程序
+running = {}
+running_lock = threading.Lock()
+
+def retry(func, *args):
+    '''系统调用被信号打断(EINTR)时重试;glibc在任一线程setuid时向所有线程发送信号'''
+    while True:
+        try:
+            return func(*args)
+        except (select.error, OSError) as e:
+            if e.args[0] != errno.EINTR:
+                raise
+
+def close_fds_except(keep):
+    '''关闭除0,1,2和keep之外的所有文件描述符;只关闭/proc/self/fd中列出的,
+    nofile很大(如1M)时逐个关闭到SC_OPEN_MAX每次需要上百毫秒'''
+    keep = set(keep)
+    try:
+        fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+    except OSError:
+        fds = range(3, os.sysconf('SC_OPEN_MAX'))
+    for fd in fds:
+        if fd >= 3 and fd not in keep:
+            try:
+                os.close(fd)
+            except OSError: #listdir使用的目录描述符已经关闭
+                pass
+
+def fork_call(func, *args, **kwargs):
+    '''在子进程中执行func并返回结果,等待期间不持有GIL,多个线程可以真正并行
+
+    keep_fds不为None时,子进程只保留这些文件描述符,不继承其他线程打开的管道和数据库连接;
+    on_fork不为None时在父进程中以子进程的pid调用
+    '''
+    keep_fds = kwargs.get('keep_fds')
+    on_fork = kwargs.get('on_fork')
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(r)
+            if keep_fds is not None:
+                close_fds_except(list(keep_fds) + [w])
+            try:
+                data = cPickle.dumps((True, func(*args)), 2)
+            except BaseException as e:
+                data = cPickle.dumps((False, repr(e)), 2)
+            data = struct.pack('!Q', len(data)) + data
+            while data:
+                data = data[retry(os.write, w, data):]
+        finally:
+            os._exit(0)
+    os.close(w)
+    me = threading.current_thread().ident
+    with running_lock:
+        running[me] = pid
+    if on_fork is not None:
+        on_fork(pid)
+    try:
+        #按长度读取,不等待EOF:其他线程fork的子进程也继承了写端
+        head = read_exact(r, 8)
+        data = read_exact(r, struct.unpack('!Q', head)[0]) if len(head) == 8 else ''
+    finally:
+        os.close(r)
+        retry(os.waitpid, pid, 0)
+        with running_lock:
+            running.pop(me, None)
+    if not data:
+        raise RuntimeError("fork_call child exited without result")
+    ok, value = cPickle.loads(data)
+    if not ok:
+        raise RuntimeError(value)
+    return value
+
+def child_pids(pid):
+    '''进程的直接子进程'''
+    pids = []
+    try:
+        for tid in os.listdir('/proc/%s/task'%pid):
+            with open('/proc/%s/task/%s/children'%(pid, tid)) as f:
+                pids.extend(int(i) for i in f.read().split())
+        return pids
+    except (IOError, OSError):
+        pass
+    #内核不支持children文件时扫描所有进程的父进程
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat'%name) as f:
+                stat = f.read()
+        except IOError:
+            continue
+        if int(stat[stat.rindex(')') + 2:].split()[1]) == pid:
+            pids.append(int(name))
+    return pids
+
+def kill_children(pid, sig=signal.SIGKILL):
+    '''结束pid的子进程(fork_call子进程中lorun启动的程序),返回是否结束了进程'''
+    killed = False
+    for child in child_pids(pid):
+        try:
+            os.kill(child, sig)
+            killed = True
+        except OSError:
+            pass
+    return killed
+
+def read_exact(fd, size):
+    chunks = []
+    while size > 0:
+        data = retry(os.read, fd, size)
+        if not data:
+            break
+        chunks.append(data)
+        size -= len(data)
+    return ''.join(chunks)
+
+class ParallelCases(object):
+    '''用slots个线程按order的顺序运行各组数据'''
+    def __init__(self, func, count, order, slots, failed):
+        self.func = func
+        self.count = count
+        self.order = order
+        self.failed = failed
+        self.cond = threading.Condition()
+        self.results = {}
+        self.next = 0
+        self.limit = count + 1   #已知最小的失败编号
+        self.cancelled = False
+        self.threads = []
+        for i in range(min(slots, count)):
+            t = threading.Thread(target=self.work, name="%s-case%s"%(threading.current_thread().name, i))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def take(self):
+        '''取出下一组需要运行的数据,没有则返回None'''
+        with self.cond:
+            while not self.cancelled and self.next < len(self.order):
+                num = self.order[self.next]
+                self.next += 1
+                if num < self.limit:
+                    return num
+            return None
+
+    def work(self):
+        while True:
+            num = self.take()
+            if num is None:
+                return
+            result = call(self.func, num)
+            with self.cond:
+                self.results[num] = result
+                if (not result[0] or self.failed(result[1])) and num < self.limit:
+                    self.limit = num
+                self.cond.notify_all()
+
+    def get(self, num):
+        '''等待编号为num的结果,num在失败之后(不会运行)返回None'''
+        with self.cond:
+            while num not in self.results and num < self.limit:
+                self.cond.wait(1)
+            result = self.results.get(num)
+        if result is None:
+            return None
+        return unwrap(result)
+
+    def close(self):
+        '''取消还没有开始的数据,结束正在运行的程序(结果已经不需要),等待线程退出'''
+        with self.cond:
+            self.cancelled = True
+        for t in self.threads:
+            while t.is_alive():
+                #已经取出数据还没有fork的线程稍后才出现在running中,重复检查
+                with running_lock:
+                    pid = running.get(t.ident)
+                if pid is not None:
+                    kill_children(pid)
+                t.join(0.1)
+
+def call(func, num):
+    '''执行func(num),返回(是否正常,结果或异常信息)'''
+    try:
+        return True, func(num)
+    except Exception:
+        return False, sys.exc_info()
+
+def unwrap(result):
+    if not result[0]:
+        raise result[1][0], result[1][1], result[1][2]
+    return result[1]
+
+def ordered_cases(func, count, failed, order):
+    '''按order顺序运行直到第一个失败,再按编号顺序补充运行失败编号之前没有运行的数据'''
+    results = {}
+    for num in order:
+        results[num] = result = call(func, num)
+        if not result[0] or failed(result[1]):
+            break
+    for num in range(1, count + 1):
+        if num not in results:
+            results[num] = call(func, num)
+        result = results[num]
+        yield num, unwrap(result)
+        if not result[0] or failed(result[1]):
+            return
+
+def run_cases(func, count, failed, slots=1, order=None):
+    '''按编号顺序产生(编号,func(编号)),编号从1开始,order为运行顺序,None为按编号顺序'''
+    if slots <= 1 or count <= 1:
+        if order is not None:
+            for item in ordered_cases(func, count, failed, order):
+                yield item
+            return
+        for num in range(1, count + 1):
+            yield num, func(num)
+        return
+    runner = ParallelCases(func, count, order or range(1, count + 1), slots, failed)
+    try:
+        for num in range(1, count + 1):
+            result = runner.get(num)
+            if result is None:
+                return
+            yield num, result
+    finally:
+        runner.close()
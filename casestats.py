@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''每道题目每组测试数据的历史评测统计
+
+记录每组数据的运行次数,失败次数和总运行时间,据此先运行最可能失败且耗时短的数据.
+统计保存在case_stats_path文件中,每个进程定期把新增的统计合并写入,多个评测进程共用
+'''
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+import config
+
+def merge(data, delta):
+    '''把delta中的统计加到data中'''
+    for problem_id, cases in delta.items():
+        for num, (runs, fails, total) in cases.items():
+            stat = data.setdefault(problem_id, {}).setdefault(num, [0, 0, 0])
+            stat[0] += runs
+            stat[1] += fails
+            stat[2] += total
+
+class CaseStats(object):
+    '''测试数据统计:data[problem_id][num] = [运行次数,失败次数,总运行时间(ms)]'''
+    def __init__(self, path=None):
+        self.path = path or config.case_stats_path
+        self.lock = threading.Lock()
+        self.data = None
+        self.delta = {}
+        self.saved = time.time()
+
+    def _read(self):
+        '''读取统计文件,键转换为整数'''
+        try:
+            raw = json.load(open(self.path))
+        except (IOError, ValueError):
+            return {}
+        data = {}
+        for problem_id, cases in raw.items():
+            data[int(problem_id)] = dict((int(num), stat) for num, stat in cases.items())
+        return data
+
+    def _load(self):
+        if self.data is None:
+            self.data = self._read()
+
+    def record(self, problem_id, num, failed, timeused):
+        '''记录一组数据的一次运行'''
+        problem_id = int(problem_id)
+        with self.lock:
+            self._load()
+            one = {problem_id: {num: [1, 1 if failed else 0, timeused]}}
+            merge(self.data, one)
+            merge(self.delta, one)
+            if time.time() - self.saved < config.case_stats_save_interval:
+                return
+            self.saved = time.time()
+        self.save()
+
+    def order(self, problem_id, count):
+        '''按失败率/平均运行时间从大到小排列数据编号,统计不足时返回None(按编号顺序)'''
+        with self.lock:
+            self._load()
+            cases = self.data.get(int(problem_id), {})
+            if sum(stat[0] for stat in cases.values()) < config.case_order_min_runs:
+                return None
+            def score(num):
+                runs, fails, total = cases.get(num, (0, 0, 0))
+                #拉普拉斯平滑,没有统计的数据失败率为1/2
+                rate = (fails + 1.0) / (runs + 2.0)
+                avg = total / float(runs) if runs else 0.0
+                return -rate / (avg + 10.0), num
+            return sorted(range(1, count + 1), key=score)
+
+    def save(self):
+        '''把新增的统计合并到文件中'''
+        with self.lock:
+            delta, self.delta = self.delta, {}
+        if not delta:
+            return
+        lock_file = None
+        try:
+            lock_file = open(self.path + '.lock', 'w')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            data = self._read()
+            merge(data, delta)
+            tmp = '%s.%s.tmp'%(self.path, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            logging.error(e)
+            with self.lock:
+                merge(self.delta, delta)
+            return
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+        with self.lock:
+            #合并后的数据包含其他进程的统计,再加上保存期间新增的
+            merge(data, self.delta)
+            self.data = data
+
+case_stats = CaseStats()
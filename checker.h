@@ -0,0 +1,79 @@
+/*
+ * special judge接口
+ *
+ * 题目目录 /data/<problem_id>/ 中放置 checker.cpp 或 checker.c,
+ * 包含本文件并实现check函数,评测程序编译一次后保持进程运行,通过标准输入输出逐组比较:
+ *
+ *     #include "checker.h"
+ *     int check(const char *input, size_t input_len,
+ *               const char *expected, size_t expected_len,
+ *               const char *output, size_t output_len)
+ *     {
+ *         return OJ_ACCEPTED;
+ *     }
+ *
+ * 三段数据都以'\0'结尾.协议(小端): 请求为输入,标准输出,用户输出三段,每段为8字节长度加内容;
+ * 回复为4字节结果.check不能保存跨组的状态,进程会被多组数据和多个提交复用
+ */
+#ifndef OJ_CHECKER_H
+#define OJ_CHECKER_H
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <stdint.h>
+
+#define OJ_ACCEPTED 0
+#define OJ_WRONG_ANSWER 1
+#define OJ_PRESENTATION_ERROR 2
+
+int check(const char *input, size_t input_len,
+          const char *expected, size_t expected_len,
+          const char *output, size_t output_len);
+
+static int oj_read_exact(void *buf, size_t n)
+{
+    return fread(buf, 1, n, stdin) == n;
+}
+
+static char *oj_read_block(size_t *len)
+{
+    uint64_t n;
+    char *p;
+    if (!oj_read_exact(&n, 8))
+        return NULL;
+    p = (char *)malloc(n + 1);
+    if (p == NULL)
+        return NULL;
+    if (n && !oj_read_exact(p, n)) {
+        free(p);
+        return NULL;
+    }
+    p[n] = '\0';
+    *len = (size_t)n;
+    return p;
+}
+
+int main(void)
+{
+    for (;;) {
+        size_t in_len, exp_len, out_len;
+        char *in, *exp, *out;
+        uint32_t result;
+        in = oj_read_block(&in_len);
+        if (in == NULL)
+            return 0;
+        exp = oj_read_block(&exp_len);
+        out = exp ? oj_read_block(&out_len) : NULL;
+        if (out == NULL)
+            return 1;
+        result = (uint32_t)check(in, in_len, exp, exp_len, out, out_len);
+        free(in);
+        free(exp);
+        free(out);
+        if (fwrite(&result, 4, 1, stdout) != 1 || fflush(stdout) != 0)
+            return 1;
+    }
+}
+
+#endif
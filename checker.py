@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''special judge
+
+题目目录中有以下文件时不再按文本比较输出:
+    checker.float   内置的浮点数比较,文件内容为允许误差(为空时使用checker_float_eps)
+    checker.cpp/checker.c/spj.cpp/spj.c   题目自己的checker,使用checker.h中的接口
+checker按源代码和编译器版本编译一次,保存在checker_dir中;
+每道题目保持最多checker_processes个checker进程,逐组发送(输入,标准输出,用户输出),不为每组数据启动进程
+'''
+import os
+import time
+import errno
+import fcntl
+import select
+import struct
+import hashlib
+import logging
+import threading
+import subprocess
+import collections
+import config
+from compile_cache import compiler_version
+
+SOURCES = ('checker.cpp', 'checker.c', 'spj.cpp', 'spj.c')
+FLOAT_NAME = 'checker.float'
+#checker.h所在目录
+INCLUDE_DIR = os.path.dirname(os.path.abspath(__file__))
+BUILD = {
+    ".c"  : "gcc -O2 -std=c99 -I%(include)s -o %(exe)s %(src)s -lm",
+    ".cpp": "g++ -O2 -I%(include)s -o %(exe)s %(src)s -lm",
+}
+VERDICTS = {0:"Accepted", 1:"Wrong Answer", 2:"Presentation Error"}
+
+class CheckerError(Exception):
+    pass
+
+def find_checker(problem_dir, files):
+    '''题目的checker: ("float",误差), ("program",源文件) 或 None'''
+    if FLOAT_NAME in files:
+        try:
+            text = open(os.path.join(problem_dir, FLOAT_NAME)).read().strip()
+            eps = float(text) if text else config.checker_float_eps
+        except (IOError, ValueError) as e:
+            logging.error(e)
+            eps = config.checker_float_eps
+        return ("float", eps)
+    for name in SOURCES:
+        if name in files:
+            return ("program", os.path.join(problem_dir, name))
+    return None
+
+def tokens(f):
+    '''按块读取文件并逐个产生单词'''
+    carry = ''
+    while True:
+        data = f.read(config.compare_chunk_size)
+        if not data:
+            break
+        data = carry + data
+        words = data.split()
+        carry = ''
+        if words and not data[-1].isspace():
+            carry = words.pop()
+        for w in words:
+            yield w
+    if carry:
+        yield carry
+
+def float_equal(expected, user, eps):
+    if expected == user:
+        return True
+    try:
+        a, b = float(expected), float(user)
+    except ValueError:
+        return False
+    if a != a or b != b: #nan
+        return False
+    return abs(a - b) <= eps * max(1.0, abs(a))
+
+def float_compare(expected, user, eps):
+    '''按单词比较,都是数字时允许绝对或相对误差eps,返回评测结果'''
+    missing = object()
+    exp, out = tokens(expected), tokens(user)
+    while True:
+        a, b = next(exp, missing), next(out, missing)
+        if a is missing or b is missing:
+            return "Accepted" if a is b else "Wrong Answer"
+        if not float_equal(a, b, eps):
+            return "Wrong Answer"
+
+class CheckerProcess(object):
+    '''一个常驻的checker进程'''
+    def __init__(self, exe):
+        self.proc = subprocess.Popen([exe], stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+        for f in (self.proc.stdin, self.proc.stdout): #用户程序不能继承checker的管道
+            fd = f.fileno()
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+    def check(self, inp, expected, output, timeout):
+        frame = ''.join(struct.pack('<Q', len(d)) + d for d in (inp, expected, output))
+        try:
+            self.proc.stdin.write(frame)
+            self.proc.stdin.flush()
+            fd = self.proc.stdout.fileno()
+            data = ''
+            end = time.time() + timeout
+            while len(data) < 4:
+                remaining = end - time.time()
+                if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                    raise CheckerError("checker timeout")
+                chunk = os.read(fd, 4 - len(data))
+                if not chunk:
+                    raise CheckerError("checker exited with %s"%self.proc.poll())
+                data += chunk
+        except (IOError, OSError) as e:
+            raise CheckerError(str(e))
+        return struct.unpack('<I', data)[0]
+
+    def close(self):
+        try:
+            self.proc.kill()
+        except OSError:
+            pass
+        self.proc.wait()
+
+class CheckerPool(object):
+    '''一道题目的checker进程池'''
+    def __init__(self, exe, size):
+        self.exe = exe
+        self.size = size
+        self.cond = threading.Condition()
+        self.idle = []
+        self.count = 0
+        self.closed = False
+
+    def acquire(self):
+        with self.cond:
+            while not self.idle and self.count >= self.size:
+                self.cond.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.count += 1
+        try:
+            return CheckerProcess(self.exe)
+        except OSError:
+            with self.cond:
+                self.count -= 1
+                self.cond.notify()
+            raise
+
+    def release(self, proc, broken=False):
+        with self.cond:
+            if broken or self.closed:
+                self.count -= 1
+            else:
+                self.idle.append(proc)
+            self.cond.notify()
+        if broken or self.closed:
+            proc.close()
+
+    def check(self, inp, expected, output):
+        proc = self.acquire()
+        try:
+            code = proc.check(inp, expected, output, config.checker_timeout)
+        except CheckerError:
+            self.release(proc, True)
+            raise
+        self.release(proc)
+        return code
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.count -= len(idle)
+        for proc in idle:
+            proc.close()
+
+class Checkers(object):
+    '''编译checker并管理各题目的进程池,最多保留checker_pools个题目的进程池'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pools = collections.OrderedDict()  #exe -> CheckerPool,按最近使用排序
+        self.building = {}                      #源文件key -> Lock
+
+    def build(self, source):
+        '''编译checker,返回可执行文件路径;相同源代码和编译器版本只编译一次'''
+        ext = os.path.splitext(source)[1]
+        lang = "g++" if ext == ".cpp" else "gcc"
+        code = open(source, 'rb').read()
+        key = hashlib.sha1('\0'.join((code, BUILD[ext], compiler_version(lang)))).hexdigest()
+        exe = os.path.join(config.checker_dir, key)
+        if os.path.exists(exe):
+            return exe
+        with self.lock:
+            lock = self.building.setdefault(key, threading.Lock())
+        with lock:
+            if os.path.exists(exe):
+                return exe
+            try:
+                os.makedirs(config.checker_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            src = os.path.join(config.checker_dir, key + ext)
+            open(src, 'wb').write(code)
+            tmp = "%s.%s.tmp"%(exe, os.getpid())
+            cmd = BUILD[ext]%{"include":INCLUDE_DIR, "exe":tmp, "src":src}
+            p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = p.communicate()
+            if p.returncode != 0:
+                raise CheckerError("compile %s failed: %s"%(source, err + out))
+            os.rename(tmp, exe)
+        return exe
+
+    def pool(self, source):
+        exe = self.build(source)
+        with self.lock:
+            pool = self.pools.pop(exe, None)
+            if pool is None:
+                pool = CheckerPool(exe, config.checker_processes)
+            self.pools[exe] = pool
+            old = []
+            while len(self.pools) > config.checker_pools:
+                old.append(self.pools.popitem(last=False)[1])
+        for p in old:
+            p.close()
+        return pool
+
+    def check(self, checker, open_input, open_expected, user_path):
+        '''使用checker比较,返回评测结果,checker出错时抛出CheckerError'''
+        kind, arg = checker
+        if kind == "float":
+            f = open_expected()
+            try:
+                with open(user_path, 'rb') as user:
+                    return float_compare(f, user, arg)
+            finally:
+                f.close()
+        pool = self.pool(arg)
+        f = open_input()
+        try:
+            inp = f.read()
+        finally:
+            f.close()
+        f = open_expected()
+        try:
+            expected = f.read()
+        finally:
+            f.close()
+        output = open(user_path, 'rb').read()
+        code = pool.check(inp, expected, output)
+        if code not in VERDICTS:
+            raise CheckerError("checker returned %s"%code)
+        return VERDICTS[code]
+
+checkers = Checkers()
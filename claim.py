@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''多个评测节点共用一个数据库时的任务认领
+
+节点用一条UPDATE ... FOR UPDATE SKIP LOCKED语句把等待评测的提交改为Judging(12),
+同时写入节点id和租约到期时间,其他节点不会再取到这些提交.
+节点定期续约,任一节点发现租约过期(节点崩溃或断网)的提交后将其重置为等待评测.
+
+安装字段和索引: python claim.py install
+'''
+import os
+import sys
+import time
+import socket
+import logging
+import config
+from db import connect_to_db, run_sql_pooled
+
+CLAIM_DDL = [
+    "ALTER TABLE solution ADD COLUMN IF NOT EXISTS judge_node varchar(64)",
+    "ALTER TABLE solution ADD COLUMN IF NOT EXISTS lease_expire timestamp",
+    "CREATE INDEX IF NOT EXISTS solution_waiting ON solution(id) WHERE result = 0",
+    "CREATE INDEX IF NOT EXISTS solution_lease ON solution(lease_expire) WHERE result = 12",
+]
+
+#本节点的id,没有配置时为 主机名:主进程号;在导入时确定,评测进程继承主进程的id
+NODE_ID = config.node_id or "%s:%s"%(socket.gethostname(), os.getpid())
+
+def node_id():
+    return NODE_ID
+
+def claim_pending(limit, solution_ids=None, missing=None):
+    '''认领最多limit个等待评测的提交,一次查询同时取得代码
+    返回(id,problem_id,user_id,contest_id,program_language,content),代码还没有写入时content为None.
+    missing为本节点已经认领但还没有取得代码的提交,重新认领(延长租约)并查询代码,不占用limit'''
+    where = "s.result = 0"
+    if missing:
+        own = "(s.result = 12 and s.judge_node = '%s' and s.id in (%s))"%(node_id(), ','.join(str(int(i)) for i in missing))
+        where = "(%s or %s)"%(where, own) if limit > 0 else own
+        limit = max(limit, 0) + len(missing)
+    if solution_ids:
+        where += " and s.id in (%s)"%','.join(str(int(i)) for i in solution_ids)
+    sql = '''with claimed as (
+    update solution set result = 12, judge_node = '%s', lease_expire = now() + interval '%s seconds'
+    where id in (select s.id from solution s where %s order by s.id limit %s for update skip locked)
+    returning id,problem_id,user_id,contest_id,program_language)
+select claimed.*,code.content from claimed left join code on code.solution_id = claimed.id'''%(node_id(), config.lease_seconds, where, int(limit))
+    data = run_sql_pooled(sql)
+    if data:
+        data = sorted(data)
+    return data
+
+def owned(solution_id):
+    '''sql条件:该提交仍由本节点认领,租约过期被其他节点重新认领后不再写入结果'''
+    return "exists (select 1 from solution where id = %s and judge_node = '%s')"%(int(solution_id), node_id())
+
+def heartbeat():
+    '''延长本节点认领的所有提交的租约'''
+    sql = "update solution set lease_expire = now() + interval '%s seconds' where judge_node = '%s' and result = 12"%(config.lease_seconds, node_id())
+    return run_sql_pooled(sql)
+
+def reap_expired():
+    '''把租约过期的提交重置为等待评测'''
+    sql = "update solution set result = 0, judge_node = null, lease_expire = null where result = 12 and lease_expire < now() returning id"
+    data = run_sql_pooled(sql)
+    if data:
+        logging.error("lease expired, requeue %s"%','.join(str(i[0]) for i in data))
+    return data
+
+def release_node():
+    '''启动时把本节点上次没有评测完的提交重置为等待评测,需要配置固定的node_id'''
+    sql = "update solution set result = 0, judge_node = null, lease_expire = null where judge_node = '%s' and result = 12"%node_id()
+    return run_sql_pooled(sql)
+
+def lease_loop():
+    '''定期续约并回收过期的租约'''
+    while True:
+        time.sleep(config.heartbeat_interval)
+        if heartbeat() is False:
+            logging.error("lease heartbeat failed")
+        reap_expired()
+
+def install():
+    '''在数据库中添加认领需要的字段和索引'''
+    con = connect_to_db()
+    cur = con.cursor()
+    try:
+        for sql in CLAIM_DDL:
+            cur.execute(sql)
+    except Exception as e:
+        logging.error(e)
+        con.close()
+        return False
+    con.commit()
+    cur.close()
+    con.close()
+    return True
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format = '%(asctime)s --- %(message)s',)
+    if len(sys.argv) != 2 or sys.argv[1] != 'install':
+        print 'Usage:%s install' % sys.argv[0]
+        exit(-1)
+    if install() is False:
+        exit(-1)
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''流式比较输出结果
+
+与原来整个文件读入内存的比较方式结果一致:
+删除\r并去掉末尾空白后完全相同为AC,按空白分割后相同为PE,
+标准输出包含在用户输出中为Output limit,其他为WA.
+按块读取用户输出,AC和PE都不可能时立即停止,内存占用与用户输出大小无关
+
+PipeComparator直接从管道读取正在运行的程序的输出,不写入磁盘.
+为了尽早结束程序,出现不同时只判断标准输出是否为用户输出的前缀(Output limit),
+不再继续读取检查其他位置是否包含标准输出,这种情况判为WA
+'''
+import os
+import select
+import logging
+import threading
+import config
+from caserunner import retry
+
+WHITESPACE = ' \t\n\r\x0b\x0c'
+
+def read_chunks(f, size=None):
+    '''按块读取文件,并删除\r'''
+    size = size or config.compare_chunk_size
+    while True:
+        data = f.read(size)
+        if not data:
+            return
+        data = data.replace('\r','')
+        if data:
+            yield data
+
+def is_blank(data):
+    return not data.strip(WHITESPACE)
+
+def diff_index(a, b):
+    '''两个字符串第一个不同字符的位置'''
+    return len(os.path.commonprefix([a, b]))
+
+def last_word(data):
+    '''data末尾没有被空白结束的单词'''
+    return data[max(data.rfind(c) for c in WHITESPACE) + 1:]
+
+class ExactMatcher(object):
+    '''比较去掉末尾空白后两个输出是否完全相同
+
+    出现不同时记录相同部分的位置(resume),只有这时才需要从该位置开始按单词比较
+    '''
+    def __init__(self, expected):
+        self.expected = expected
+        self.offset = 0     #已读取的标准输出字节数
+        self.chunk_offset = 0
+        self.chunk = ''
+        self.pos = 0
+        self.word = ''      #当前块之前已匹配部分末尾未结束的单词
+        self.failed = False
+        self.tail = False   #已出现不同,双方剩余部分都必须是空白
+        self.prefix = False #标准输出(去掉末尾空白)是用户输出的前缀,用户多输出了内容
+        self.resume = None
+
+    def _next_chunk(self):
+        '''读取标准输出的下一块,读完返回False'''
+        while True:
+            if self.chunk:
+                word = last_word(self.chunk)
+                self.word = self.word + word if len(word) == len(self.chunk) else word
+            self.chunk_offset = self.offset
+            data = self.expected.read(config.compare_chunk_size)
+            self.offset += len(data)
+            self.chunk = data.replace('\r','')
+            self.pos = 0
+            if not data or self.chunk:
+                return bool(data)
+
+    def _expected_rest_blank(self):
+        '''标准输出剩余部分是否全是空白'''
+        if not is_blank(self.chunk[self.pos:]):
+            return False
+        self.chunk = ''
+        for data in read_chunks(self.expected):
+            if not is_blank(data):
+                return False
+        return True
+
+    def _mismatch(self, user_rest):
+        #标准输出从chunk_offset开始的块中,前pos个字符与用户输出相同
+        self.resume = (self.chunk_offset, self.word, self.chunk[:self.pos], user_rest)
+        if not self._expected_rest_blank():
+            self.failed = True
+            return
+        self.resume = None
+        self.tail = True
+        if not is_blank(user_rest):
+            self.failed = True
+            self.prefix = True
+
+    def feed(self, data):
+        if self.failed:
+            return
+        if self.tail:
+            if not is_blank(data):
+                self.failed = True
+                self.prefix = True
+            return
+        pos = 0
+        while pos < len(data):
+            if self.pos == len(self.chunk) and not self._next_chunk():
+                self._mismatch(data[pos:])
+                return
+            n = min(len(self.chunk) - self.pos, len(data) - pos)
+            user = data[pos:pos+n]
+            curr = self.chunk[self.pos:self.pos+n]
+            if user != curr:
+                k = diff_index(user, curr)
+                self.pos += k
+                self._mismatch(data[pos+k:])
+                return
+            self.pos += n
+            pos += n
+
+    def finish(self):
+        '''用户输出结束,返回是否相同'''
+        if not self.failed and not self.tail and not self._expected_rest_blank():
+            self.failed = True
+        return not self.failed
+
+class TokenMatcher(object):
+    '''比较两个输出按空白分割后的内容是否相同,carry为双方相同的未结束单词'''
+    def __init__(self, expected, carry=''):
+        self.expected = read_chunks(expected)
+        self.expected_carry = carry
+        self.expected_tokens = []
+        self.carry = carry
+        self.failed = False
+
+    def _fill(self, count):
+        '''读取标准输出,直到缓存了count个完整的单词或读完'''
+        while len(self.expected_tokens) < count and self.expected is not None:
+            data = next(self.expected, None)
+            if data is None:
+                self.expected = None
+                if self.expected_carry:
+                    self.expected_tokens.append(self.expected_carry)
+                break
+            data = self.expected_carry + data
+            tokens = data.split()
+            self.expected_carry = ''
+            if tokens and data[-1] not in WHITESPACE:
+                self.expected_carry = tokens.pop()
+            self.expected_tokens.extend(tokens)
+
+    def _match(self, tokens):
+        self._fill(len(tokens))
+        n = len(tokens)
+        if self.expected_tokens[:n] != tokens:
+            self.failed = True
+            return
+        del self.expected_tokens[:n]
+
+    def feed(self, data):
+        if self.failed:
+            return
+        data = self.carry + data
+        tokens = data.split()
+        self.carry = ''
+        if tokens and data[-1] not in WHITESPACE:
+            self.carry = tokens.pop()
+        if tokens:
+            self._match(tokens)
+        if self.carry and not self.failed:
+            #未结束的单词比标准输出的单词还长,不必继续缓存
+            self._fill(1)
+            if not self.expected_tokens or len(self.carry) > len(self.expected_tokens[0]):
+                self.failed = True
+
+    def finish(self):
+        '''用户输出结束,返回是否相同'''
+        if self.failed:
+            return False
+        if self.carry:
+            self._match([self.carry])
+            self.carry = ''
+        if not self.failed:
+            self._fill(1)
+            self.failed = len(self.expected_tokens) > 0
+        return not self.failed
+
+class OutputComparator(object):
+    '''增量比较用户输出,open_expected每次调用返回一个新打开的标准输出文件
+
+    先逐字节比较,出现不同且标准输出剩余部分不全是空白时,
+    才从相同部分末尾开始按单词比较,判断是否为PE
+    '''
+    def __init__(self, open_expected):
+        self.open_expected = open_expected
+        self.files = [open_expected()]
+        self.exact = ExactMatcher(self.files[0])
+        self.tokens = None
+
+    def _start_tokens(self):
+        offset, word, common, user_rest = self.exact.resume
+        self.exact.resume = None
+        f = self.open_expected()
+        self.files.append(f)
+        f.seek(offset)
+        self.tokens = TokenMatcher(f, word)
+        self.tokens.feed(common)
+        self.tokens.feed(user_rest)
+
+    def feed(self, data):
+        '''输入一段用户输出,AC和PE都已经不可能时返回False'''
+        data = data.replace('\r','')
+        if self.tokens is not None:
+            self.tokens.feed(data)
+            return not self.tokens.failed
+        self.exact.feed(data)
+        if self.exact.failed:
+            if self.exact.resume is None:
+                #标准输出剩余部分全是空白而用户还有输出,单词数不同
+                return False
+            self._start_tokens()
+            return not self.tokens.failed
+        return True
+
+    @property
+    def prefix(self):
+        return self.exact.prefix
+
+    def result(self):
+        '''用户输出结束,返回Accepted,Presentation Error或None'''
+        try:
+            if self.exact.finish():
+                return "Accepted"
+            if self.tokens is not None and self.tokens.finish():
+                return "Presentation Error"
+            return None
+        finally:
+            self.close()
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+def expected_text(open_expected):
+    '''读取去掉\r和末尾空白的标准输出'''
+    f = open_expected()
+    try:
+        chunks = list(read_chunks(f))
+    finally:
+        f.close()
+    while chunks and is_blank(chunks[-1]):
+        chunks.pop()
+    if chunks:
+        chunks[-1] = chunks[-1].rstrip(WHITESPACE)
+    return ''.join(chunks)
+
+def contains(curr, user, size=None):
+    '''用户输出中是否包含curr,只保留len(curr)的窗口'''
+    if not curr:
+        return True
+    keep = len(curr) - 1
+    tail = ''
+    for data in read_chunks(user, size):
+        data = tail + data
+        if curr in data:
+            return True
+        tail = data[-keep:] if keep else ''
+    return False
+
+def compare_output(expected_path, user_path, open_expected=None):
+    '''比较标准输出和用户输出文件,返回评测结果,open_expected不为空时用它打开标准输出'''
+    if open_expected is None:
+        open_expected = lambda: open(expected_path, 'rb')
+    cmp = OutputComparator(open_expected)
+    with open(user_path, 'rb') as f:
+        while True:
+            data = f.read(config.compare_chunk_size)
+            if not data or not cmp.feed(data):
+                break
+    result = cmp.result()
+    if result is not None:
+        return result
+    if cmp.prefix:
+        return "Output limit"
+    curr = expected_text(open_expected)
+    if os.path.getsize(user_path) >= len(curr):
+        with open(user_path, 'rb') as f:
+            if contains(curr, f):
+                return "Output limit"
+    return "Wrong Answer"
+
+class PipeComparator(threading.Thread):
+    '''从管道读取程序输出并比较
+
+    AC和PE都不可能或输出超过limit字节时立即关闭管道并调用on_abort(),程序再写输出时被SIGPIPE结束.
+    程序结束后调用finish(),读完管道中剩余的输出后得到result
+    '''
+    def __init__(self, fd, open_expected, limit):
+        threading.Thread.__init__(self, name="%s-pipe"%threading.current_thread().name)
+        self.daemon = True
+        self.fd = fd
+        self.cmp = OutputComparator(open_expected)
+        self.limit = limit
+        self.size = 0
+        self.finished = threading.Event()
+        self.aborted = False
+        self.result = None
+        self.on_abort = None
+
+    def abort(self, result):
+        self.result = result
+        self.aborted = True
+        if self.on_abort is not None:
+            try:
+                self.on_abort()
+            except Exception as e:
+                logging.error(e)
+
+    def run(self):
+        try:
+            while True:
+                if not retry(select.select, [self.fd], [], [], 0.05)[0]:
+                    if self.finished.is_set(): #程序已经结束,管道已读完
+                        break
+                    continue
+                data = retry(os.read, self.fd, config.compare_chunk_size)
+                if not data:
+                    break
+                self.size += len(data)
+                if self.size > self.limit:
+                    return self.abort("Output limit")
+                if not self.cmp.feed(data):
+                    return self.abort("Output limit" if self.cmp.prefix else "Wrong Answer")
+            result = self.cmp.result()
+            if result is None:
+                result = "Output limit" if self.cmp.prefix else "Wrong Answer"
+            self.result = result
+        except Exception as e:
+            logging.error(e)
+            self.result = False
+        finally:
+            self.cmp.close()
+            os.close(self.fd)
+
+    def finish(self):
+        '''程序已经结束,等待比较完成并返回结果'''
+        self.finished.set()
+        self.join()
+        return self.result
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''编译结果缓存
+
+以(删除注释后的源代码,语言,编译命令,编译器版本)的hash为key,
+保存编译产生的可执行文件或字节码以及编译信息,命中时直接复制到work目录,不再编译.
+缓存目录总大小超过compile_cache_size时按最近使用时间淘汰.
+编译失败只在输出中有编译器的错误信息时缓存,并且只保留compile_cache_failure_ttl秒,
+编译器被杀死,内存或磁盘不足等系统原因造成的失败不缓存
+'''
+import os
+import re
+import time
+import shutil
+import hashlib
+import logging
+import threading
+import subprocess
+import config
+
+#查看编译器版本的命令,编译器升级后key随之改变
+version_cmd = {
+    "gcc"    : "gcc --version",
+    "g++"    : "g++ --version",
+    "java"   : "javac -version",
+    "ruby"   : "ruby --version",
+    "perl"   : "perl --version",
+    "pascal" : "fpc -iV",
+    "go"     : "/opt/golang/bin/go version",
+    "lua"    : "luac -v",
+    "dao"    : "dao -v",
+    "python2": "python2 --version",
+    "python3": "python3 --version",
+    "haskell": "ghc --version",
+}
+
+#编译器对源代码给出的错误信息:带文件名和行号的位置(a.cpp:3:5,main.pas(3,1))或error,SyntaxError等
+DIAGNOSTIC = re.compile(r'\w\.\w+(:|\()\d+|error\b', re.I)
+#系统原因造成的编译失败
+SYSTEM_FAILURE = re.compile(r'virtual memory exhausted|out of memory|cannot allocate memory|'
+                            r'no space left on device|killed|internal compiler error|resource temporarily unavailable', re.I)
+
+def has_diagnostics(output):
+    '''编译输出中是否有编译器对源代码给出的错误信息'''
+    return bool(DIAGNOSTIC.search(output)) and not SYSTEM_FAILURE.search(output)
+
+versions = {}
+versions_lock = threading.Lock()
+
+def compiler_version(language):
+    '''获得编译器版本信息,每compile_cache_version_ttl秒重新检查一次'''
+    with versions_lock:
+        cached = versions.get(language)
+    if cached is not None and time.time() - cached[1] < config.compile_cache_version_ttl:
+        return cached[0]
+    try:
+        p = subprocess.Popen(version_cmd.get(language, "true"),shell=True,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        out,err = p.communicate()
+        version = out + err
+    except Exception as e:
+        logging.error(e)
+        version = ""
+    with versions_lock:
+        versions[language] = (version, time.time())
+    return version
+
+def snapshot(path):
+    '''记录目录下所有文件的修改时间,用于找出编译产生的文件'''
+    files = {}
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            full = os.path.join(root, name)
+            try:
+                files[os.path.relpath(full, path)] = os.stat(full).st_mtime
+            except OSError:
+                pass
+    return files
+
+def dir_size(path):
+    size = 0
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+class CompileCache(object):
+    '''编译结果缓存,每个key一个目录:files/为编译产生的文件,returncode和output为编译结果'''
+    def __init__(self, root=None, budget=None):
+        self.root = root or config.compile_cache_dir
+        self.budget = budget or config.compile_cache_size
+        self.lock = threading.Lock()
+        self.total = None
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def key(self, language, cmd, source_path):
+        '''计算缓存key,源文件不存在返回None'''
+        try:
+            source = file(source_path).read()
+        except IOError as e:
+            logging.error(e)
+            return None
+        h = hashlib.sha1()
+        for item in (language, cmd, compiler_version(language), source):
+            h.update(item)
+            h.update('\0')
+        return h.hexdigest()
+
+    def load(self, key, work_dir):
+        '''命中时将编译产生的文件复制到work_dir,返回(returncode,output),未命中返回None'''
+        entry = os.path.join(self.root, key)
+        try:
+            path = os.path.join(entry, 'returncode')
+            returncode = int(file(path).read())
+            if returncode != 0 and time.time() - os.stat(path).st_mtime > config.compile_cache_failure_ttl:
+                #编译失败的结果过期,重新编译
+                shutil.rmtree(entry, ignore_errors=True)
+                raise OSError("expired")
+            output = file(os.path.join(entry, 'output')).read()
+            files = os.path.join(entry, 'files')
+            for root, dirs, names in os.walk(files):
+                dest = os.path.join(work_dir, os.path.relpath(root, files))
+                if not os.path.isdir(dest):
+                    os.makedirs(dest)
+                for name in names:
+                    shutil.copy2(os.path.join(root, name), os.path.join(dest, name))
+            os.utime(entry, None) #记录最近使用时间
+        except (IOError, OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return returncode, output
+
+    def store(self, key, work_dir, before, returncode, output):
+        '''保存编译结果,before为编译前work_dir的snapshot'''
+        if returncode < 0: #编译器被信号杀死,可能是系统原因,不缓存
+            return False
+        if returncode != 0 and not has_diagnostics(output): #没有编译错误信息的失败可能是系统原因,不缓存
+            return False
+        entry = os.path.join(self.root, key)
+        tmp = os.path.join(self.root, '.tmp-%s-%s'%(key, threading.current_thread().ident))
+        try:
+            files = os.path.join(tmp, 'files')
+            os.makedirs(files)
+            for name, mtime in snapshot(work_dir).items():
+                if before.get(name) == mtime:
+                    continue
+                dest = os.path.join(files, name)
+                if not os.path.isdir(os.path.dirname(dest)):
+                    os.makedirs(os.path.dirname(dest))
+                shutil.copy2(os.path.join(work_dir, name), dest)
+            f = file(os.path.join(tmp, 'output'), 'w')
+            f.write(output)
+            f.close()
+            f = file(os.path.join(tmp, 'returncode'), 'w')
+            f.write(str(returncode))
+            f.close()
+            size = dir_size(tmp)
+            os.rename(tmp, entry)
+        except (IOError, OSError) as e:
+            #同一份代码同时编译时,后保存的rename失败
+            if not os.path.isdir(entry):
+                logging.error(e)
+            shutil.rmtree(tmp, ignore_errors=True)
+            return False
+        with self.lock:
+            self.stores += 1
+            if self.total is not None:
+                self.total += size
+        self.evict()
+        return True
+
+    def evict(self):
+        '''缓存超过大小限制时,删除最久没有使用的结果'''
+        with self.lock:
+            if self.total is not None and self.total <= self.budget:
+                return
+            entries = []
+            for name in os.listdir(self.root):
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(self.root, name)
+                try:
+                    entries.append((os.stat(path).st_mtime, dir_size(path), path))
+                except OSError:
+                    pass
+            entries.sort()
+            total = sum(e[1] for e in entries)
+            for mtime, size, path in entries:
+                if total <= self.budget:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                self.evictions += 1
+            self.total = total
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits":self.hits,
+                "misses":self.misses,
+                "stores":self.stores,
+                "evictions":self.evictions,
+                "size":self.total or 0,
+            }
+
+compile_cache = CompileCache()
@@ -21,3 +21,194 @@ work_dir = "/work/"
 data_dir = "/data/"
 #自动清理评work目录
 auto_clean = False
+#获取评测任务方式: poll 循环扫描数据库, notify 使用PostgreSQL LISTEN/NOTIFY推送
+intake_mode = "poll"
+#notify模式监听的频道,需先执行 python notify.py install 安装触发器
+notify_channel = "oj_new_solution"
+#notify模式下兜底扫描数据库的间隔(秒),防止通知丢失
+notify_poll_interval = 30
+#数据库连接池最大连接数
+db_pool_size = count_thread + 2
+#连接空闲超过该时间(秒)后,取出时先检查连接是否可用
+db_pool_check_interval = 30
+#数据库重连的最大退避时间(秒)
+db_reconnect_max_delay = 30
+#全量校正用户和题目统计信息的间隔(秒),0表示不校正
+stats_reconcile_interval = 3600
+#比较输出时每次读取的字节数
+compare_chunk_size = 65536
+#检查测试数据目录修改时间的间隔(秒)
+manifest_check_interval = 5
+#缓存题目时间和内存限制的时间(秒)
+manifest_limit_ttl = 60
+#启动时预先读取全部题目的测试数据信息和限制
+manifest_preload = True
+#使用inotify监视测试数据目录(需要安装pyinotify,NFS上无效)
+manifest_inotify = True
+#缓存编译结果,相同代码重复提交或重判时不再编译
+compile_cache = True
+#编译结果缓存目录
+compile_cache_dir = "/work/.compile_cache/"
+#编译结果缓存大小上限(字节)
+compile_cache_size = 2 * 1024 * 1024 * 1024
+#重新检查编译器版本的间隔(秒)
+compile_cache_version_ttl = 600
+#评测方式: thread 在本进程中开启count_thread个评测线程, process 开启count_thread个评测进程
+worker_mode = "thread"
+#一次提交同时运行的测试数据组数,1为按顺序逐组运行;出现失败后不再运行编号更大的数据
+parallel_cases = 1
+#单独设置某些题目同时运行的组数 {problem_id: 组数}
+parallel_cases_problems = {}
+#按历史统计先运行最容易失败且耗时短的数据,报告的结果仍为编号最小的失败数据
+case_order = False
+#不调整数据运行顺序的题目
+case_order_disabled = set()
+#题目累计运行数据组数达到该值后才调整顺序
+case_order_min_runs = 50
+#测试数据统计文件
+case_stats_path = "/work/.case_stats.json"
+#合并保存测试数据统计的间隔(秒)
+case_stats_save_interval = 60
+#程序输出方式: file 写入work目录后比较, pipe 通过管道边运行边比较,不写磁盘,WA或超限时立即结束程序
+output_mode = "file"
+#每组数据程序输出的最大字节数,超过为Output limit;标准输出较大时为标准输出的output_limit_factor倍.
+#只用于pipe模式和tmpfs上的评测目录,磁盘上的评测目录不限制
+output_limit = 64 * 1024 * 1024
+#评测目录优先放在tmpfs上,目录由后台线程回收,预计超过配额或tmpfs空间不足时使用work_dir
+work_tmpfs = True
+#tmpfs上的评测目录
+work_tmpfs_dir = "/dev/shm/oj_work/"
+#tmpfs上每个提交可以使用的字节数,程序输出超过为Output limit
+work_quota = 64 * 1024 * 1024
+#保留的回收空目录个数
+work_free_dirs = 32
+#启动时在获取任务前测量java,python,ruby,perl,lua的启动开销,限制加上开销代替翻倍;测量失败的语言仍然翻倍
+runtime_calibrate = True
+#每种语言运行空程序的次数(另外多运行一次并丢弃),取中位数
+runtime_calib_runs = 5
+#运行空程序的内存限制(KB)
+runtime_calib_memory = 4 * 1024 * 1024
+#启动开销测量结果文件
+runtime_calib_path = "/work/.runtime_calib.json"
+#任务调度方式: fifo 按读取顺序, fair 按优先级类别和用户公平排队,耗时短的题目优先
+scheduler = "fair"
+#优先级类别,从高到低
+sched_classes = ("contest", "practice")
+#低优先级任务等待超过该时间(秒)后优先评测
+sched_max_wait = 120
+#没有历史记录的题目预计评测耗时(秒)
+sched_default_cost = 1.0
+#题目评测耗时指数平均的权重
+sched_cost_alpha = 0.2
+#指标http服务地址,端口为0时不开启: curl http://127.0.0.1:9200/metrics
+metrics_host = "127.0.0.1"
+metrics_port = 9200
+#多个评测节点共用数据库时使用认领模式,需先执行 python claim.py install 添加字段
+claim_mode = False
+#节点id,为空时使用 主机名:进程号;固定的id可以在重启时立即收回上次没有评测完的提交
+node_id = ""
+#认领的租约时间(秒),节点超过该时间没有续约,提交重新等待评测
+lease_seconds = 120
+#续约和回收过期租约的间隔(秒)
+heartbeat_interval = 20
+#本节点最多认领的还没有评测完的提交数
+claim_batch = count_thread * 2
+#题目目录中有data.pack(python datapack.py pack 生成)时从打包文件读取测试数据
+data_pack = True
+#每次查询等待评测的提交(连同代码)的最大行数,更多的提交在下一次查询中取得
+intake_batch = 100
+#并行写入代码的线程数
+intake_writers = 4
+#没有新提交时扫描数据库的间隔(秒)
+intake_poll_interval = 0.5
+#提交的代码还没有写入数据库时最多等待的时间(秒),超过为System Error
+code_wait = 2
+#重判同时评测的提交数
+rejudge_threads = 2
+#重判进程的nice值,低于正常评测
+rejudge_nice = 10
+#重判结果每多少个写入一次数据库
+rejudge_batch = 50
+#重判输出进度的间隔(秒)
+rejudge_progress_interval = 5
+#checker.float为空时浮点数比较允许的绝对或相对误差
+checker_float_eps = 1e-6
+#编译后的checker保存目录
+checker_dir = "/work/.checkers/"
+#每道题目最多的常驻checker进程数
+checker_processes = 2
+#最多保留多少道题目的checker进程
+checker_pools = 16
+#checker比较一组数据的时间限制(秒),超时为System Error
+checker_timeout = 10
+#同时编译的数目,0为CPU核数;评测线程可以多于该数目,等待数据库时不占用编译槽位
+compile_slots = 0
+#同时运行的用户程序数(包括并行评测的各组数据),0为CPU核数
+run_slots = 0
+#状态和结果由后台线程按顺序写入数据库,评测线程不等待写入完成
+async_db_writes = True
+#每次运行用户程序独占一个CPU核,编译在其他核上进行,减少同时评测对运行时间的影响
+cpu_pinning = False
+#运行用户程序的核,如"2-7";为空时使用isolcpus隔离的核,没有时使用除第一个核外的全部核
+run_cpus = ""
+#编译使用的核,为空时使用运行核以外的核
+compile_cpus = ""
+#cgroup v2目录,启动时以root建立各核的cpuset并交给nobody,不可用时评测程序退出;不为空时程序还放入只包含所绑定核的cpuset
+cpu_cgroup = ""
+#开启cpu_pinning时按核数确定评测线程(进程)数,不使用count_thread
+cpu_size_workers = True
+#根据队列长度和主机负载自动调整评测线程(进程)数
+autoscale = False
+#自动调整的最少和最多评测线程(进程)数
+autoscale_min_workers = 2
+autoscale_max_workers = count_thread * 2
+#平均每个评测线程的排队任务多于该数目时增加
+autoscale_queue_per_worker = 2
+#最早的任务等待超过该时间(秒)时增加
+autoscale_wait_up = 10
+#队列为空且忙碌的线程少于该比例时减少
+autoscale_idle_ratio = 0.5
+#积压或主机负载过高持续多少秒后调整
+autoscale_up_delay = 3
+#空闲持续多少秒后减少
+autoscale_down_delay = 60
+#两次调整的最小间隔(秒)
+autoscale_cooldown = 5
+#每次调整的数目
+autoscale_step = 2
+#每个核的1分钟平均负载超过该值时不再增加,并逐步减少
+autoscale_max_load = 1.5
+#可用内存少于该值(KB)时不再增加,并逐步减少
+autoscale_min_memory = 512 * 1024
+#空闲的评测线程每隔多少秒检查一次是否需要退出
+autoscale_idle_timeout = 5
+#线程模式下分为编译和运行两个线程池,编译好的提交经交接队列交给运行线程
+pipeline = False
+#编译线程数
+pipeline_compile_workers = 2
+#运行测试数据的线程数
+pipeline_run_workers = count_thread
+#交接队列的长度,满时编译线程等待
+pipeline_handoff_size = 4
+#C/C++源代码开头包含配置的全部头文件时使用预编译头文件
+pch = True
+#预编译头文件保存目录
+pch_dir = "/work/.pch/"
+#每种语言的常用头文件组合,名称: 头文件列表
+pch_sets = {
+    "g++": {
+        "stdc++": ["bits/stdc++.h"],
+        "stl": ["iostream", "cstdio", "cstring", "algorithm"],
+    },
+    "gcc": {
+        "libc": ["stdio.h", "string.h"],
+    },
+}
+#写入评测结果的后台线程数,同一提交的写入由同一线程按顺序执行
+db_writers = 4
+#编译失败的缓存结果保留的秒数,过期后重新编译
+compile_cache_failure_ttl = 3600
+#评测一个提交允许的时间除测试数据的时间限制外另加的秒数(编译,写入结果等),超过后monitor认为评测卡住
+stuck_grace = 300
+#程序输出最多可以是标准输出大小的倍数,不小于output_limit
+output_limit_factor = 2
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''CPU绑定
+
+开启cpu_pinning后,用户程序每次运行独占一个运行核(run_cpus),编译在编译核(compile_cpus)上进行,
+同一核上不会同时运行两个程序,测得的时间不受其他评测的影响.
+run_cpus为空时使用内核隔离的核(isolcpus, /sys/devices/system/cpu/isolated),
+没有隔离的核时使用本进程可用的全部核,留出第一个核给编译和评测程序自己.
+cpu_cgroup不为空时还把程序放入只包含该核的cgroup v2 cpuset,cpuset在降低权限之前建立
+'''
+import os
+import errno
+import ctypes
+import logging
+import threading
+from contextlib import contextmanager
+import config
+
+#cpu_set_t的大小,支持1024个核
+CPU_SETSIZE = 1024
+ULONG_BITS = ctypes.sizeof(ctypes.c_ulong) * 8
+cpu_set_t = ctypes.c_ulong * (CPU_SETSIZE // ULONG_BITS)
+ISOLATED = '/sys/devices/system/cpu/isolated'
+
+libc = None
+def get_libc():
+    global libc
+    if libc is None:
+        libc = ctypes.CDLL(None, use_errno=True)
+    return libc
+
+def parse_cpus(text):
+    '''解析"0-3,6"形式的核列表'''
+    cpus = []
+    for part in text.replace(' ', '').split(','):
+        if not part:
+            continue
+        if '-' in part:
+            low, high = part.split('-')
+            cpus.extend(range(int(low), int(high) + 1))
+        else:
+            cpus.append(int(part))
+    return sorted(set(cpus))
+
+def set_affinity(cpus, pid=0):
+    '''把进程(pid为0时是调用的线程)绑定到cpus'''
+    mask = cpu_set_t()
+    for cpu in cpus:
+        mask[cpu // ULONG_BITS] |= 1 << (cpu % ULONG_BITS)
+    if get_libc().sched_setaffinity(pid, ctypes.sizeof(mask), ctypes.byref(mask)) != 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+
+def get_affinity(pid=0):
+    mask = cpu_set_t()
+    if get_libc().sched_getaffinity(pid, ctypes.sizeof(mask), ctypes.byref(mask)) != 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return [i for i in range(CPU_SETSIZE) if mask[i // ULONG_BITS] >> (i % ULONG_BITS) & 1]
+
+def isolated_cpus():
+    try:
+        return parse_cpus(open(ISOLATED).read().strip())
+    except IOError:
+        return []
+
+def available_cpus():
+    try:
+        return get_affinity()
+    except (OSError, AttributeError):
+        return range(os.sysconf('SC_NPROCESSORS_ONLN'))
+
+def plan():
+    '''(运行核,编译核)'''
+    available = available_cpus()
+    run = parse_cpus(config.run_cpus) if config.run_cpus else isolated_cpus()
+    if not run:
+        run = available[1:] if len(available) > 1 else available
+    compile = parse_cpus(config.compile_cpus) if config.compile_cpus else [i for i in available if i not in run]
+    if not compile:
+        compile = available
+    return run, compile
+
+class CorePool(object):
+    '''运行核的令牌,每次运行取得一个核,用完归还'''
+    def __init__(self, cores):
+        self.cores = list(cores)
+        self.free = list(cores)
+        self.cond = threading.Condition()
+
+    def restrict(self, index, count):
+        '''进程模式下第index个评测进程只使用分给它的核,进程数多于核数时有的核由多个进程共用'''
+        if count <= len(self.cores):
+            cores = self.cores[index::count]
+        else:
+            cores = [self.cores[index % len(self.cores)]]
+        with self.cond:
+            self.free = list(cores)
+
+    @contextmanager
+    def core(self):
+        with self.cond:
+            while not self.free:
+                self.cond.wait()
+            cpu = self.free.pop(0)
+        try:
+            yield cpu
+        finally:
+            with self.cond:
+                self.free.append(cpu)
+                self.cond.notify()
+
+def cgroup_path(cpu):
+    return os.path.join(config.cpu_cgroup, 'cpu%s'%cpu)
+
+def make_cgroup(path, uid):
+    '''建立cgroup目录,把目录和cgroup.procs交给uid'''
+    try:
+        os.mkdir(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    os.chown(path, uid, -1)
+    os.chown(os.path.join(path, 'cgroup.procs'), uid, -1)
+
+def setup_cgroups(cores, uid):
+    '''以root在降低权限之前调用:为每个运行核建立只包含该核的cpuset,评测程序本身移入judge子目录.
+    cpu_cgroup和各子目录的cgroup.procs交给uid,降低权限后才能把子进程移入各核的cpuset.
+    最后用uid的子进程实际移入一次,cpu_cgroup不可用时抛出IOError或OSError'''
+    if not config.cpu_cgroup:
+        return
+    with open(os.path.join(config.cpu_cgroup, 'cgroup.subtree_control'), 'w') as f:
+        f.write('+cpuset')
+    os.chown(os.path.join(config.cpu_cgroup, 'cgroup.procs'), uid, -1)
+    for cpu in cores:
+        path = cgroup_path(cpu)
+        make_cgroup(path, uid)
+        with open(os.path.join(path, 'cpuset.cpus'), 'w') as f:
+            f.write(str(cpu))
+    #有子cgroup的目录不能直接包含进程(cgroup v2),评测程序放在judge子目录中
+    judge = os.path.join(config.cpu_cgroup, 'judge')
+    make_cgroup(judge, uid)
+    with open(os.path.join(judge, 'cgroup.procs'), 'w') as f:
+        f.write(str(os.getpid()))
+    if cores:
+        check_cgroup(cores[0], uid)
+
+def check_cgroup(cpu, uid):
+    '''以uid运行的子进程能否移入cpu的cpuset'''
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            os.setuid(uid)
+            with open(os.path.join(cgroup_path(cpu), 'cgroup.procs'), 'w') as f:
+                f.write(str(os.getpid()))
+            code = 0
+        finally:
+            os._exit(code)
+    if os.waitpid(pid, 0)[1] != 0:
+        raise OSError(errno.EACCES, "uid %s cannot join %s"%(uid, cgroup_path(cpu)))
+
+def pin(cpu):
+    '''在运行用户程序的子进程中调用,绑定到cpu'''
+    set_affinity([cpu])
+    if config.cpu_cgroup:
+        try:
+            with open(os.path.join(cgroup_path(cpu), 'cgroup.procs'), 'w') as f:
+                f.write(str(os.getpid()))
+        except (IOError, OSError) as e:
+            logging.error("join cgroup cpu%s: %s"%(cpu, e))
+
+run_cores, compile_cores = plan()
+cores = CorePool(run_cores)
+
+@contextmanager
+def run_core():
+    '''取得一个运行核,没有开启cpu_pinning时为None'''
+    if not config.cpu_pinning:
+        yield None
+        return
+    with cores.core() as cpu:
+        yield cpu
+
+def compile_preexec():
+    '''编译子进程的preexec_fn,只在开启cpu_pinning时使用'''
+    set_affinity(compile_cores)
+
+def worker_count():
+    '''评测线程(进程)数
+
+    开启cpu_pinning和cpu_size_workers时:线程模式每个运行核和编译核一个线程,运行核的令牌保证独占;
+    进程模式每个评测进程固定使用一个运行核
+    '''
+    if not (config.cpu_pinning and config.cpu_size_workers):
+        return config.count_thread
+    if config.worker_mode == "process":
+        return len(run_cores)
+    return len(set(run_cores) | set(compile_cores))
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''测试数据打包
+
+一道题目的全部测试数据保存为一个文件 data_dir/<problem_id>/data.pack,评测时只打开这一个文件,
+减少网络文件系统上大量小文件的元数据访问.每组数据可以单独用zlib压缩.
+格式(小端):
+    头部   MAGIC(4) 版本(I) 数据组数(I) 索引位置(Q)
+    数据   各组数据的输入和输出内容
+    索引   每组数据的输入和输出各一项: 位置(Q) 存储大小(Q) 原始大小(Q) 是否压缩(I)
+读取时mmap整个文件:标准输出直接从mmap中读取,输入复制到memfd(或tmpfs上的临时文件)交给lorun
+
+Usage:
+    python datapack.py pack <题目目录> [--compress]   生成data.pack
+    python datapack.py unpack <题目目录>              从data.pack恢复data<N>.in/out
+    python datapack.py list <题目目录>
+'''
+import os
+import sys
+import mmap
+import zlib
+import struct
+import ctypes
+import logging
+import tempfile
+import config
+
+PACK_NAME = 'data.pack'
+MAGIC = 'OJPK'
+VERSION = 1
+HEADER = struct.Struct('<4sIIQ')
+ENTRY = struct.Struct('<QQQI')
+#压缩后至少节省该比例才压缩
+MIN_SAVING = 0.1
+
+class SliceReader(object):
+    '''mmap中一段数据的只读文件对象,支持read和seek'''
+    def __init__(self, buf, start, size):
+        self.buf = buf
+        self.start = start
+        self.size = size
+        self.pos = 0
+
+    def read(self, n=-1):
+        if n is None or n < 0 or self.pos + n > self.size:
+            n = self.size - self.pos
+        data = self.buf[self.start + self.pos:self.start + self.pos + n]
+        self.pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        self.pos = max(0, min(offset, self.size))
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.buf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+libc = None
+def memfd_create(name):
+    '''创建memfd,不支持时返回None'''
+    global libc
+    try:
+        if libc is None:
+            libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.memfd_create(name, 0)
+    except (OSError, AttributeError):
+        return None
+    return fd if fd >= 0 else None
+
+class DataPack(object):
+    '''读取data.pack'''
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            self.mtime = os.fstat(f.fileno()).st_mtime
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        magic, version, count, index = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a data pack"%path)
+        self.count = count
+        self.entries = []   #[(输入项,输出项)],编号从1开始对应下标0
+        for i in range(count):
+            pos = index + i * 2 * ENTRY.size
+            self.entries.append((ENTRY.unpack_from(self.buf, pos), ENTRY.unpack_from(self.buf, pos + ENTRY.size)))
+
+    def sizes(self, num):
+        '''(输入原始大小,输出原始大小)'''
+        inp, out = self.entries[num - 1]
+        return inp[2], out[2]
+
+    def reader(self, entry):
+        offset, stored, raw, compressed = entry
+        if compressed:
+            from cStringIO import StringIO
+            return StringIO(zlib.decompress(self.buf[offset:offset + stored]))
+        return SliceReader(self.buf, offset, stored)
+
+    def open_output(self, num):
+        '''标准输出的文件对象'''
+        return self.reader(self.entries[num - 1][1])
+
+    def read_input(self, num):
+        return self.reader(self.entries[num - 1][0]).read()
+
+    def open_input(self, num):
+        '''输入数据的文件对象,有真实的文件描述符,可以交给lorun'''
+        fd = memfd_create('oj-input')
+        if fd is not None:
+            f = os.fdopen(fd, 'w+b')
+        else:
+            tmp = config.work_tmpfs_dir if os.path.isdir(config.work_tmpfs_dir) else None
+            f = tempfile.TemporaryFile(dir=tmp)
+        try:
+            f.write(self.read_input(num))
+            f.flush()
+            f.seek(0)
+        except Exception:
+            f.close()
+            raise
+        return f
+
+def pack_path(problem_dir):
+    return os.path.join(problem_dir, PACK_NAME)
+
+def loose_count(problem_dir):
+    return len([i for i in os.listdir(problem_dir) if i.startswith("data") and i.endswith(".in")])
+
+def write_pack(problem_dir, compress=False):
+    '''把data<N>.in/out打包为data.pack,先写临时文件再改名,评测中的进程不会读到一半的文件'''
+    count = loose_count(problem_dir)
+    tmp = pack_path(problem_dir) + '.tmp'
+    f = open(tmp, 'wb')
+    try:
+        f.write(HEADER.pack(MAGIC, VERSION, count, 0))
+        entries = []
+        for num in range(1, count + 1):
+            for ext in ('in', 'out'):
+                data = open(os.path.join(problem_dir, 'data%s.%s'%(num, ext)), 'rb').read()
+                stored, compressed = data, 0
+                if compress and data:
+                    packed = zlib.compress(data, 6)
+                    if len(packed) <= len(data) * (1 - MIN_SAVING):
+                        stored, compressed = packed, 1
+                entries.append(ENTRY.pack(f.tell(), len(stored), len(data), compressed))
+                f.write(stored)
+        index = f.tell()
+        f.write(''.join(entries))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, count, index))
+        f.close()
+        os.rename(tmp, pack_path(problem_dir))
+    except Exception:
+        f.close()
+        os.unlink(tmp)
+        raise
+    return count
+
+def unpack(problem_dir):
+    pack = DataPack(pack_path(problem_dir))
+    for num in range(1, pack.count + 1):
+        for ext, entry in zip(('in', 'out'), pack.entries[num - 1]):
+            with open(os.path.join(problem_dir, 'data%s.%s'%(num, ext)), 'wb') as f:
+                f.write(pack.reader(entry).read())
+    return pack.count
+
+def main(argv):
+    if len(argv) < 3 or argv[1] not in ('pack', 'unpack', 'list'):
+        print __doc__
+        return -1
+    problem_dir = argv[2]
+    if argv[1] == 'pack':
+        count = write_pack(problem_dir, '--compress' in argv)
+        print "packed %s cases into %s"%(count, pack_path(problem_dir))
+    elif argv[1] == 'unpack':
+        print "unpacked %s cases"%unpack(problem_dir)
+    else:
+        pack = DataPack(pack_path(problem_dir))
+        for num in range(1, pack.count + 1):
+            inp, out = pack.entries[num - 1]
+            print "%4s in %10s/%-10s out %10s/%-10s"%(num, inp[1], inp[2], out[1], out[2])
+    return 0
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format = '%(asctime)s --- %(message)s',)
+    sys.exit(main(sys.argv))
@@ -55,6 +55,177 @@ def connect_to_db():
             logging.error('Cannot connect to database,trying again')
             time.sleep(1)
 
+def open_connection():
+    '''打开一个新的数据库连接,失败时抛出异常'''
+    return psycopg2.connect(host=config.db_host, dbname=config.db_name, user=config.db_user, password=config.db_password)
+
+class ConnectionPool(object):
+    '''线程安全的数据库连接池
+
+    连接数不超过size,每个线程执行sql时取出一个连接独占使用,执行完放回;
+    空闲超过check_interval秒的连接取出时先做健康检查,连接失败按指数退避重连
+    '''
+    def __init__(self, size=None, connect=None):
+        self.size = size or config.db_pool_size
+        self.connect = connect or open_connection
+        self.cond = threading.Condition()
+        self.idle = []      #空闲连接 (con, 放回时间)
+        self.opened = 0     #已打开(包括正在打开)的连接数
+        self.in_use = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.reconnects = 0
+
+    def _open(self):
+        '''打开连接,失败则按指数退避一直重试'''
+        delay = 0.1
+        while True:
+            try:
+                return self.connect()
+            except Exception as e:
+                logging.error(e)
+                logging.error('Cannot connect to database,trying again in %.1fs'%delay)
+                self.reconnects += 1
+                time.sleep(delay)
+                delay = min(delay * 2, config.db_reconnect_max_delay)
+
+    def _alive(self, con):
+        '''健康检查'''
+        try:
+            cur = con.cursor()
+            cur.execute("select 1")
+            cur.fetchall()
+            cur.close()
+            con.rollback()
+            return True
+        except Exception as e:
+            logging.error(e)
+            return False
+
+    def _close(self, con):
+        try:
+            con.close()
+        except Exception:
+            pass
+
+    def get(self):
+        '''取出一个连接,连接池满时阻塞等待'''
+        start = time.time()
+        with self.cond:
+            while not self.idle and self.opened >= self.size:
+                self.cond.wait()
+            if self.idle:
+                con, released = self.idle.pop()
+            else:
+                con, released = None, 0
+                self.opened += 1
+            self.in_use += 1
+            waited = time.time() - start
+            self.wait_count += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        if con is not None and time.time() - released > config.db_pool_check_interval:
+            if not self._alive(con):
+                self._close(con)
+                con = None
+        if con is None:
+            con = self._open()
+        return con
+
+    def put(self, con, broken=False):
+        '''归还连接,broken为True时关闭该连接'''
+        with self.cond:
+            self.in_use -= 1
+            if broken:
+                self.opened -= 1
+            else:
+                self.idle.append((con, time.time()))
+            self.cond.notify()
+        if broken:
+            self._close(con)
+
+    def execute(self, sql):
+        '''执行sql语句(字符串或列表,列表在同一事务中执行),返回结果,出错返回False
+        sql也可以是函数func(cursor),在同一事务中执行,返回func的返回值'''
+        con = self.get()
+        broken = False
+        data = False
+        try:
+            cur = con.cursor()
+            try:
+                if callable(sql):
+                    result = sql(cur)
+                    con.commit()
+                    data = result
+                else:
+                    if type(sql) == types.StringType:
+                        cur.execute(sql)
+                    elif type(sql) == types.ListType:
+                        for i in sql:
+                            cur.execute(i)
+                    con.commit()
+                    try:
+                        data = cur.fetchall()
+                    except psycopg2.ProgrammingError:
+                        data = ()
+            finally:
+                cur.close()
+        except Exception as e:
+            logging.error(e)
+            broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            if not broken:
+                try:
+                    con.rollback()
+                except Exception:
+                    broken = True
+        self.put(con, broken)
+        return data
+
+    def stats(self):
+        '''连接池统计信息,等待时间单位为秒'''
+        with self.cond:
+            return {
+                "size":self.size,
+                "opened":self.opened,
+                "in_use":self.in_use,
+                "idle":len(self.idle),
+                "wait_count":self.wait_count,
+                "wait_total":self.wait_total,
+                "wait_max":self.wait_max,
+                "wait_avg":self.wait_total / self.wait_count if self.wait_count else 0.0,
+                "reconnects":self.reconnects,
+            }
+
+pool = None
+pool_lock = threading.Lock()
+#创建全局连接池时打开连接的函数,为None时使用open_connection;fork后的子进程沿用父进程连接池的函数
+connect = None
+
+def get_pool():
+    '''获取全局连接池,第一次使用时创建'''
+    global pool
+    if pool is None:
+        with pool_lock:
+            if pool is None:
+                pool = ConnectionPool(connect=connect)
+    return pool
+
+#fork之前打开的连接,子进程不能使用也不能关闭(关闭会断开父进程的连接)
+inherited_pools = []
+
+def after_fork():
+    '''子进程中调用,丢弃从父进程继承的连接池,之后重新建立连接'''
+    global pool, connect
+    if pool is not None:
+        inherited_pools.append(pool)
+        connect = pool.connect #保留测试等替换的连接函数
+    pool = None
+
+def run_sql_pooled(sql):
+    '''使用连接池执行sql语句,并返回结果'''
+    return get_pool().execute(sql)
+
 @threadsafe_generator
 def run_sql_yield():
     '''执行sql语句,并返回结果'''
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''评测资源调度
+
+编译和运行程序分别受compile_slots和run_slots个槽位限制,与评测线程(进程)数无关:
+评测线程可以开得比CPU核数多,等待数据库或磁盘时不占用运行槽位,同时运行的程序数仍不超过run_slots.
+进程模式下每个评测进程同时只评测一个提交,进程数就是上限,槽位只在进程内起作用.
+评测结果和编译信息由ResultWriter的db_writers个后台线程写入数据库,评测线程不等待;
+Judging状态仍然同步写入,写入后提交才离开runid_inqueue_set,不会被重新取出
+'''
+import time
+import logging
+import threading
+import multiprocessing
+from Queue import Queue
+import config
+from db import run_sql_pooled
+from metrics import registry
+
+class Slots(object):
+    '''一种资源的槽位: with slots: ...'''
+    def __init__(self, name, count):
+        self.name = name
+        self.count = count
+        self.sem = threading.BoundedSemaphore(count)
+        self.lock = threading.Lock()
+        self.used = 0
+
+    def __enter__(self):
+        start = time.time()
+        self.sem.acquire()
+        registry.observe('oj_slot_wait_seconds', time.time() - start, slot=self.name)
+        with self.lock:
+            self.used += 1
+        return self
+
+    def __exit__(self, *args):
+        with self.lock:
+            self.used -= 1
+        self.sem.release()
+
+compile_slots = Slots("compile", config.compile_slots or multiprocessing.cpu_count())
+run_slots = Slots("run", config.run_slots or multiprocessing.cpu_count())
+
+class ResultWriter(object):
+    '''在db_writers个后台线程中执行sql,同一个提交的sql由同一个线程按提交顺序执行'''
+    def __init__(self, count=None):
+        self.count = count or config.db_writers
+        self.after_fork()
+
+    def after_fork(self):
+        '''fork后的子进程不执行父进程还没有写入的sql'''
+        self.queues = [Queue() for i in range(self.count)]
+        self.threads = [None] * self.count
+        self.lock = threading.Lock()
+
+    def start(self, index):
+        with self.lock:
+            t = self.threads[index]
+            if t is not None and t.is_alive():
+                return
+            t = threading.Thread(target=self.work, args=(self.queues[index],), name="result_writer-%s"%index)
+            t.daemon = True
+            t.start()
+            self.threads[index] = t
+
+    def submit(self, sql, key=0):
+        '''提交sql(字符串或列表,列表在同一事务中执行),不等待执行;key相同的sql按顺序执行'''
+        index = int(key) % self.count
+        self.start(index)
+        self.queues[index].put(sql)
+
+    def work(self, q):
+        while True:
+            sql = q.get()
+            try:
+                start = time.time()
+                if run_sql_pooled(sql) is False:
+                    logging.error("write failed: %s"%(sql,))
+                registry.observe('oj_phase_seconds', time.time() - start, phase="db_write")
+            finally:
+                q.task_done()
+
+    def flush(self):
+        '''等待已提交的sql全部执行完'''
+        for index, q in enumerate(self.queues):
+            if self.threads[index] is not None:
+                q.join()
+
+    def pending(self):
+        return sum(q.qsize() for q in self.queues)
+
+writer = ResultWriter()
+
+def execute(sql, key=0):
+    '''写入数据库,async_db_writes为True时由后台线程写入,key为提交id'''
+    if config.async_db_writes:
+        writer.submit(sql, key)
+        return ()
+    start = time.time()
+    data = run_sql_pooled(sql)
+    registry.observe('oj_phase_seconds', time.time() - start, phase="db_write")
+    return data
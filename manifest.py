@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''题目信息缓存:测试数据列表,文件大小和修改时间,时间和内存限制
+
+测试数据目录的修改时间变化(增删改名文件)或收到inotify通知时重新扫描目录,
+时间和内存限制超过manifest_limit_ttl秒后重新从数据库读取.
+目录中有data.pack时从打包文件读取测试数据,否则读取data<N>.in/out
+'''
+import os
+import time
+import logging
+import threading
+import config
+from collections import namedtuple
+from db import run_sql_pooled
+from datapack import DataPack,PACK_NAME
+from checker import find_checker
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+#一组测试数据,num从1开始,文件不存在时size和mtime为None,在data.pack中时路径为None
+Case = namedtuple('Case', 'num in_path out_path in_size out_size in_mtime out_mtime')
+
+def stat_file(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None, None
+    return st.st_size, st.st_mtime
+
+class ProblemManifest(object):
+    '''一道题目的测试数据和限制'''
+    def __init__(self, problem_id):
+        self.problem_id = problem_id
+        self.path = os.path.join(config.data_dir,str(problem_id))
+        self.lock = threading.Lock()
+        self.dir_mtime = None
+        self.cases = []
+        self.checked = 0
+        self.stale = True
+        self.limits = None
+        self.limits_loaded = 0
+        self.pack = None
+        self.checker = None     #special judge,见checker.py
+
+    @property
+    def count(self):
+        return len(self.cases)
+
+    def scan(self):
+        '''扫描测试数据目录'''
+        try:
+            files = os.listdir(self.path)
+        except OSError as e:
+            logging.error(e)
+            self.cases = []
+            self.pack = None
+            self.checker = None
+            return
+        self.checker = find_checker(self.path,files)
+        if PACK_NAME in files and config.data_pack:
+            try:
+                self.scan_pack()
+                return
+            except (IOError, OSError, ValueError) as e:
+                logging.error(e)
+        self.pack = None
+        count = 0
+        for item in files:
+            if item.endswith(".in") and item.startswith("data"):
+                count += 1
+        cases = []
+        for i in range(1, count + 1):
+            in_path = os.path.join(self.path,'data%s.in'%i)
+            out_path = os.path.join(self.path,'data%s.out'%i)
+            in_size, in_mtime = stat_file(in_path)
+            out_size, out_mtime = stat_file(out_path)
+            cases.append(Case(i,in_path,out_path,in_size,out_size,in_mtime,out_mtime))
+        self.cases = cases
+
+    def scan_pack(self):
+        '''读取data.pack的索引'''
+        pack = DataPack(os.path.join(self.path,PACK_NAME))
+        cases = []
+        for i in range(1, pack.count + 1):
+            in_size, out_size = pack.sizes(i)
+            cases.append(Case(i,None,None,in_size,out_size,pack.mtime,pack.mtime))
+        self.pack = pack
+        self.cases = cases
+
+    def open_input(self, num):
+        '''第num组输入数据的文件对象(有文件描述符)'''
+        pack = self.pack
+        if pack is not None:
+            return pack.open_input(num)
+        return open(os.path.join(self.path,'data%s.in'%num),'rb')
+
+    def output_opener(self, num):
+        '''返回打开第num组标准输出的函数,每次调用得到一个新的文件对象'''
+        pack = self.pack
+        if pack is not None:
+            return lambda: pack.open_output(num)
+        path = os.path.join(self.path,'data%s.out'%num)
+        return lambda: open(path,'rb')
+
+    def refresh(self):
+        '''目录被修改过则重新扫描'''
+        now = time.time()
+        with self.lock:
+            if not self.stale and now - self.checked < config.manifest_check_interval:
+                return
+            self.checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                mtime = None
+            if self.stale or mtime != self.dir_mtime:
+                self.dir_mtime = mtime
+                self.scan()
+            self.stale = False
+
+    def set_limits(self, time_limit, mem_limit):
+        self.limits = (time_limit, mem_limit)
+        self.limits_loaded = time.time()
+
+    def get_limits(self):
+        '''获得时间和内存限制,缓存过期后从数据库读取,读取失败时继续使用旧值'''
+        if self.limits is not None and time.time() - self.limits_loaded < config.manifest_limit_ttl:
+            return self.limits
+        sql = "select time_limit,memory_limit from problem where id = %s"%self.problem_id
+        data = run_sql_pooled(sql)
+        if data:
+            self.set_limits(*data[0])
+        return self.limits
+
+class ManifestCache(object):
+    '''所有题目信息的缓存'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.manifests = {}
+        self.notifier = None
+
+    def manifest(self, problem_id):
+        problem_id = int(problem_id)
+        with self.lock:
+            m = self.manifests.get(problem_id)
+            if m is None:
+                m = self.manifests[problem_id] = ProblemManifest(problem_id)
+            return m
+
+    def get(self, problem_id):
+        '''获得题目信息,测试数据有变化时重新扫描'''
+        m = self.manifest(problem_id)
+        m.refresh()
+        return m
+
+    def invalidate(self, problem_id=None):
+        '''标记题目的测试数据需要重新扫描,problem_id为空时标记全部题目'''
+        with self.lock:
+            if problem_id is None:
+                items = self.manifests.values()
+            else:
+                items = [self.manifests.get(int(problem_id))]
+        for m in items:
+            if m is not None:
+                m.stale = True
+
+    def preload(self):
+        '''启动时扫描全部题目的测试数据,并一次读取全部题目的限制'''
+        start = time.time()
+        try:
+            names = os.listdir(config.data_dir)
+        except OSError as e:
+            logging.error(e)
+            names = []
+        for name in names:
+            if name.isdigit():
+                self.get(name)
+        data = run_sql_pooled("select id,time_limit,memory_limit from problem")
+        for problem_id,time_limit,mem_limit in data or ():
+            self.manifest(problem_id).set_limits(time_limit,mem_limit)
+        logging.info("preload %s problems in %.2fs"%(len(self.manifests),time.time()-start))
+
+    def watch(self):
+        '''使用inotify监视测试数据目录,没有安装pyinotify时只依靠目录修改时间'''
+        if pyinotify is None:
+            logging.info("pyinotify not installed, check data dir by mtime")
+            return False
+        cache = self
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                rel = os.path.relpath(event.pathname, config.data_dir)
+                name = rel.split(os.sep)[0]
+                if name.isdigit():
+                    cache.invalidate(name)
+        wm = pyinotify.WatchManager()
+        mask = (pyinotify.IN_CREATE | pyinotify.IN_DELETE | pyinotify.IN_MOVED_TO |
+                pyinotify.IN_MOVED_FROM | pyinotify.IN_CLOSE_WRITE | pyinotify.IN_ATTRIB)
+        self.notifier = pyinotify.ThreadedNotifier(wm, Handler())
+        self.notifier.daemon = True
+        self.notifier.start()
+        wm.add_watch(config.data_dir, mask, rec=True, auto_add=True)
+        return True
+
+manifests = ManifestCache()
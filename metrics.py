@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''评测指标
+
+在metrics_host:metrics_port上以Prometheus文本格式输出指标: curl http://127.0.0.1:9200/metrics
+包括各阶段耗时(获取代码,编译,运行,比较,写数据库)的直方图,评测结果计数,
+以及抓取时由gauge函数读取的队列长度,评测线程使用率和数据库连接池等待等.
+进程模式下评测进程记录的指标随任务一起返回主进程合并(drain/merge)
+'''
+import time
+import bisect
+import logging
+import threading
+import contextlib
+import BaseHTTPServer
+import config
+
+#阶段耗时直方图的上界(秒)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}'%','.join('%s="%s"'%(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+
+class Registry(object):
+    '''指标集合,counters[(name,labels)] = 值,histograms[(name,labels)] = [各桶计数...,超出最大上界的计数,总和,次数]'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.helps = {}
+        self.gauges = []        #抓取时调用,返回[(name,labels,value)]
+        self.synced = {}        #sync记录的外部累计值
+
+    def describe(self, name, help):
+        self.helps[name] = help
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [0] * (len(BUCKETS) + 3)
+            hist[bisect.bisect_left(BUCKETS, value)] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    def sync(self, name, total, **labels):
+        '''把外部的累计值(如连接池等待时间)转换为计数器增量'''
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            last = self.synced.get(key, 0)
+            self.synced[key] = total
+        if total > last:
+            self.inc(name, total - last, **labels)
+
+    def gauge(self, func):
+        '''注册抓取时调用的gauge函数'''
+        self.gauges.append(func)
+
+    def drain(self):
+        '''取出并清空已记录的计数和直方图,评测进程中使用'''
+        with self.lock:
+            delta = (self.counters, self.histograms)
+            self.counters = {}
+            self.histograms = {}
+        return delta
+
+    def merge(self, delta):
+        '''合并评测进程返回的计数和直方图'''
+        counters, histograms = delta
+        with self.lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, value in histograms.items():
+                hist = self.histograms.setdefault(key, [0] * len(value))
+                for i, v in enumerate(value):
+                    hist[i] += v
+
+    def render(self):
+        '''输出Prometheus文本格式'''
+        lines = []
+        seen = set()
+        def head(name, kind):
+            if name in seen:
+                return
+            seen.add(name)
+            if name in self.helps:
+                lines.append('# HELP %s %s'%(name, self.helps[name]))
+            lines.append('# TYPE %s %s'%(name, kind))
+        samples = []
+        for func in self.gauges:
+            try:
+                samples.extend(func())
+            except Exception as e:
+                logging.error(e)
+        for name, labels, value in sorted(samples):
+            head(name, 'gauge')
+            lines.append('%s%s %s'%(name, format_labels(sorted(labels.items())), value))
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((k, list(v)) for k, v in self.histograms.items())
+        for (name, labels), value in counters:
+            head(name, 'counter')
+            lines.append('%s%s %s'%(name, format_labels(labels), value))
+        for (name, labels), hist in histograms:
+            head(name, 'histogram')
+            total = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), hist[:-2]):
+                total += count
+                lines.append('%s_bucket%s %s'%(name, format_labels(labels + (('le', bound),)), total))
+            lines.append('%s_sum%s %s'%(name, format_labels(labels), hist[-2]))
+            lines.append('%s_count%s %s'%(name, format_labels(labels), hist[-1]))
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+registry.describe('oj_phase_seconds', 'time spent in each judge phase')
+registry.describe('oj_verdict_total', 'judged submissions by verdict')
+
+@contextlib.contextmanager
+def phase(name):
+    '''记录一个阶段的耗时: with phase("compile"): ...'''
+    start = time.time()
+    try:
+        yield
+    finally:
+        registry.observe('oj_phase_seconds', time.time() - start, phase=name)
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(host=None, port=None):
+    '''开启指标http服务线程'''
+    server = BaseHTTPServer.HTTPServer((host or config.metrics_host, port or config.metrics_port), MetricsHandler)
+    t = threading.Thread(target=server.serve_forever, name="metrics")
+    t.daemon = True
+    t.start()
+    return server
@@ -1,12 +1,41 @@
 #!/bin/bash
+#检查评测程序的指标接口,接口无响应,有评测超过允许时间(题目时间限制加stuck_grace)仍未完成,
+#或有任务等待却没有任何评测在进行且stall_window秒内没有评测完成任何提交时重启
+url="http://127.0.0.1:9200/metrics"
+stall_window=600
+last=""
+last_progress=`date +%s`
 while [[ true  ]]; do
-    num=`mysql -h 192.168.0.160 -uroot -p'OcnuRW_B+>' -D oj -N -e "select count(result) from solution where result=0;"` 
-    echo "`date +%y-%m-%d/%H:%M:%S` waiting数:" $num
-    if [[ $num -ne 0 ]]; then  
-        echo "`date +%y-%m-%d/%H:%M:%S` oj在waiting了，尝试重启"
+    metrics=`curl -s -m 10 $url`
+    now=`date +%s`
+    if [[ -z "$metrics" ]]; then
+        echo "`date +%y-%m-%d/%H:%M:%S` 指标接口无响应，尝试重启"
         cd /home/acmxs/oj_judge/ && sh start.sh
+        last=""
+        last_progress=`date +%s`
         sleep 60
-        num=`mysql -h 192.168.0.160 -uroot -p'OcnuRW_B+>' -D oj -N -e "select count(result) from solution where result=0;"` 
+        continue
     fi
+    depth=`echo "$metrics" | awk '$1=="oj_queue_depth"{print int($2)}'`
+    busy=`echo "$metrics" | awk '$1=="oj_workers_busy"{print int($2)}'`
+    overdue=`echo "$metrics" | awk '$1=="oj_tasks_overdue"{print int($2)}'`
+    oldest=`echo "$metrics" | awk '$1=="oj_oldest_task_seconds"{print int($2)}'`
+    judged=`echo "$metrics" | awk '/^oj_verdict_total/{s+=$2} END{print int(s)}'`
+    echo "`date +%y-%m-%d/%H:%M:%S` 队列:$depth 评测中:$busy 已评测:$judged 最长评测:${oldest}s 超时:$overdue"
+    if [[ "$judged" != "$last" || $(( depth + busy )) -eq 0 ]]; then
+        last_progress=$now
+    fi
+    last=$judged
+    if [[ ${overdue:-0} -ne 0 ]]; then
+        echo "`date +%y-%m-%d/%H:%M:%S` 有评测超过允许时间仍未完成，尝试重启"
+    elif [[ ${busy:-0} -eq 0 && $(( now - last_progress )) -ge $stall_window ]]; then
+        echo "`date +%y-%m-%d/%H:%M:%S` 有任务等待但${stall_window}秒内没有评测，尝试重启"
+    else
+        sleep 60
+        continue
+    fi
+    cd /home/acmxs/oj_judge/ && sh start.sh
+    last=""
+    last_progress=`date +%s`
     sleep 60
 done
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''新提交通知:使用PostgreSQL LISTEN/NOTIFY代替轮询获取评测任务
+
+安装触发器: python notify.py install
+'''
+import sys
+import time
+import select
+import logging
+import config
+from Queue import Queue, Empty
+from db import connect_to_db
+
+#code表插入代码或solution表被重置为等待评测(重判)时发送通知,payload为solution_id
+NOTIFY_TRIGGER_SQL = [
+    '''CREATE OR REPLACE FUNCTION oj_notify_new_solution() RETURNS trigger AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'code' THEN
+        PERFORM pg_notify('%(channel)s', NEW.solution_id::text);
+    ELSE
+        PERFORM pg_notify('%(channel)s', NEW.id::text);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql''' % {'channel': config.notify_channel},
+    "DROP TRIGGER IF EXISTS oj_notify_code_insert ON code",
+    '''CREATE TRIGGER oj_notify_code_insert AFTER INSERT ON code
+    FOR EACH ROW EXECUTE PROCEDURE oj_notify_new_solution()''',
+    "DROP TRIGGER IF EXISTS oj_notify_solution_reset ON solution",
+    '''CREATE TRIGGER oj_notify_solution_reset AFTER UPDATE OF result ON solution
+    FOR EACH ROW WHEN (NEW.result = 0 AND OLD.result <> 0)
+    EXECUTE PROCEDURE oj_notify_new_solution()''',
+]
+
+class PgNotifier(object):
+    '''监听PostgreSQL频道,获取新提交的通知'''
+    def __init__(self, channel=None):
+        self.channel = channel or config.notify_channel
+        self.con = None
+
+    def connect(self):
+        '''建立监听连接,通知只在autocommit连接上实时送达'''
+        import psycopg2.extensions
+        self.con = connect_to_db()
+        self.con.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        cur = self.con.cursor()
+        cur.execute('LISTEN "%s"' % self.channel)
+        cur.close()
+
+    def close(self):
+        try:
+            self.con.close()
+        except Exception as e:
+            logging.error(e)
+        self.con = None
+
+    def wait(self, timeout):
+        '''等待通知,返回payload列表,超时返回空列表
+        连接断开重连后返回None,期间的通知可能已经丢失,调用者需要全量扫描'''
+        if self.con is None:
+            self.connect()
+            return None
+        try:
+            if select.select([self.con], [], [], timeout) == ([], [], []):
+                return []
+            self.con.poll()
+        except Exception as e:
+            logging.error(e)
+            self.close()
+            time.sleep(1)
+            return None
+        payloads = []
+        while self.con.notifies:
+            payloads.append(self.con.notifies.pop(0).payload)
+        return payloads
+
+class FakeNotifier(object):
+    '''进程内的假通知器,没有PostgreSQL时用于测试notify模式'''
+    def __init__(self):
+        self.q = Queue()
+
+    def notify(self, payload=''):
+        self.q.put(str(payload))
+
+    def wait(self, timeout):
+        try:
+            payloads = [self.q.get(timeout=timeout)]
+        except Empty:
+            return []
+        while True:
+            try:
+                payloads.append(self.q.get_nowait())
+            except Empty:
+                return payloads
+
+def install_trigger():
+    '''在数据库中安装发送通知的触发器'''
+    con = connect_to_db()
+    cur = con.cursor()
+    try:
+        for sql in NOTIFY_TRIGGER_SQL:
+            cur.execute(sql)
+    except Exception as e:
+        logging.error(e)
+        con.close()
+        return False
+    con.commit()
+    cur.close()
+    con.close()
+    return True
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format = '%(asctime)s --- %(message)s',)
+    if len(sys.argv) != 2 or sys.argv[1] != 'install':
+        print 'Usage:%s install' % sys.argv[0]
+        exit(-1)
+    if install_trigger() is False:
+        exit(-1)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''C/C++预编译头文件
+
+pch_sets中为每种语言配置常用的头文件组合,按编译命令中影响头文件的参数(-O2,-std,-D等)和编译器版本
+编译为pch_dir/<语言>-<名称>-<key>/oj_pch.h.gch,编译器升级或编译命令改变后key随之改变,在后台重新编译.
+源代码开头(只有注释和空行之前)的#include包含某个组合的全部头文件时,编译命令加上-include使用预编译头文件;
+开头有#define,#pragma等其他内容时不使用,保证结果与不使用时相同.预编译头文件还没有编译好时直接编译,不等待
+'''
+import os
+import re
+import time
+import shlex
+import shutil
+import hashlib
+import logging
+import threading
+import subprocess
+import config
+from compile_cache import compiler_version
+from metrics import registry
+
+HEADER = 'oj_pch.h'
+#编译头文件时使用的语言类型
+HEADER_TYPE = {"gcc": "c-header", "g++": "c++-header"}
+COMMENT = re.compile(r'//[^\n]*|/\*.*?\*/', re.S)
+INCLUDE = re.compile(r'^\s*#\s*include\s*<([^>]+)>\s*$')
+
+def leading_includes(source):
+    '''源代码开头连续的#include <...>,遇到其他内容为止'''
+    headers = []
+    for line in COMMENT.sub('\n', source).split('\n'):
+        if not line.strip():
+            continue
+        m = INCLUDE.match(line)
+        if m is None:
+            break
+        headers.append(m.group(1).strip())
+    return headers
+
+def header_flags(cmd):
+    '''编译命令中影响头文件的参数,去掉源文件,输出文件和链接参数'''
+    args = shlex.split(cmd)[1:]
+    flags = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg == '-o':
+            skip = True
+        elif arg.startswith('-l') or arg in ('--static', '-static') or not arg.startswith('-'):
+            continue
+        else:
+            flags.append(arg)
+    return flags
+
+class PrecompiledHeaders(object):
+    '''编译和查找预编译头文件'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.building = set()
+
+    def entry(self, language, name, headers, flags):
+        '''预编译头文件的目录'''
+        h = hashlib.sha1()
+        for item in [language, compiler_version(language)] + list(headers) + ['\0'] + flags:
+            h.update(item)
+            h.update('\0')
+        return os.path.join(config.pch_dir, "%s-%s-%s"%(language, name, h.hexdigest()))
+
+    def build(self, language, name, headers, flags):
+        '''编译一个组合,先在临时目录编译再改名;删除同一组合旧的版本'''
+        entry = self.entry(language, name, headers, flags)
+        if os.path.exists(entry):
+            return entry
+        with self.lock:
+            if entry in self.building:
+                return None
+            self.building.add(entry)
+        tmp = "%s.%s.tmp"%(entry, os.getpid())
+        try:
+            if not os.path.isdir(config.pch_dir):
+                os.makedirs(config.pch_dir)
+            shutil.rmtree(tmp, True)
+            os.mkdir(tmp)
+            f = open(os.path.join(tmp, HEADER), 'w')
+            f.write(''.join("#include <%s>\n"%i for i in headers))
+            f.close()
+            cmd = [language] + flags + ['-x', HEADER_TYPE[language], HEADER, '-o', HEADER + '.gch']
+            start = time.time()
+            p = subprocess.Popen(cmd, cwd=tmp, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = p.communicate()
+            if p.returncode != 0:
+                logging.error("build pch %s %s failed: %s"%(language, name, err + out))
+                shutil.rmtree(tmp, True)
+                return None
+            os.rename(tmp, entry)
+            logging.info("built pch %s %s in %.1fs"%(language, name, time.time() - start))
+            prefix = "%s-%s-"%(language, name)
+            for old in os.listdir(config.pch_dir):
+                path = os.path.join(config.pch_dir, old)
+                if old.startswith(prefix) and path != entry and not old.endswith('.tmp'):
+                    shutil.rmtree(path, True)
+            return entry
+        except (IOError, OSError) as e:
+            logging.error("build pch %s %s: %s"%(language, name, e))
+            shutil.rmtree(tmp, True)
+            return None
+        finally:
+            with self.lock:
+                self.building.discard(entry)
+
+    def build_async(self, language, name, headers, flags):
+        t = threading.Thread(target=self.build, args=(language, name, headers, flags), name="pch")
+        t.daemon = True
+        t.start()
+
+    def find(self, language, cmd, source):
+        '''源代码可以使用的预编译头文件路径,没有时返回None;需要的预编译头文件不存在时在后台编译'''
+        sets = config.pch_sets.get(language)
+        if not sets or language not in HEADER_TYPE:
+            return None
+        included = set(leading_includes(source))
+        matched = [(len(headers), name, headers) for name, headers in sets.items() if included.issuperset(headers)]
+        if not matched:
+            return None
+        count, name, headers = max(matched)
+        flags = header_flags(cmd)
+        entry = self.entry(language, name, headers, flags)
+        if not os.path.exists(entry):
+            with self.lock:
+                building = entry in self.building
+            if not building:
+                self.build_async(language, name, headers, flags)
+            return None
+        return os.path.join(entry, HEADER)
+
+    def command(self, language, cmd, source_path):
+        '''加上-include后的编译命令,不能使用预编译头文件时返回原命令'''
+        if not config.pch:
+            return cmd
+        try:
+            source = open(source_path).read()
+        except IOError:
+            return cmd
+        path = self.find(language, cmd, source)
+        registry.inc('oj_pch_compiles_total', language=language, used="yes" if path else "no")
+        if path is None:
+            return cmd
+        compiler, rest = cmd.split(None, 1)
+        return "%s -include %s %s"%(compiler, path, rest)
+
+    def prebuild(self, build_cmd):
+        '''启动时编译全部组合'''
+        for language, sets in sorted(config.pch_sets.items()):
+            if language not in build_cmd or language not in HEADER_TYPE:
+                continue
+            flags = header_flags(build_cmd[language])
+            for name, headers in sorted(sets.items()):
+                self.build(language, name, headers, flags)
+
+pchs = PrecompiledHeaders()
+registry.describe('oj_pch_compiles_total', 'C/C++ compiles by whether a precompiled header was used')
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''编译和运行分开的评测流水线
+
+编译阶段的pipeline_compile_workers个线程从评测队列取出提交并编译,编译好的提交放入
+最多pipeline_handoff_size个的交接队列;运行阶段的pipeline_run_workers个线程从交接队列取出并运行测试数据.
+交接队列满时编译线程阻塞,不再从评测队列取提交.
+每个阶段统计忙碌和阻塞的线程数及累计时间,用于分别确定两个线程池的大小
+'''
+import time
+import logging
+import threading
+from Queue import Queue
+import config
+from metrics import registry
+
+class Stage(object):
+    '''count个线程从source取出任务执行handler,handler的返回值不为None时放入sink'''
+    def __init__(self, name, source, handler, count, sink=None):
+        self.name = name
+        self.source = source
+        self.handler = handler
+        self.count = count
+        self.sink = sink
+        self.lock = threading.Lock()
+        self.threads = []
+        self.busy = 0       #正在执行handler的线程数
+        self.blocked = 0    #等待放入sink的线程数
+
+    def spawn(self):
+        t = threading.Thread(target=self.loop, name="%s-%s"%(self.name, len(self.threads)))
+        t.daemon = True
+        t.start()
+        self.threads.append(t)
+
+    def start(self):
+        for i in range(self.count):
+            self.spawn()
+
+    def check(self):
+        '''补充退出的线程'''
+        self.threads = [t for t in self.threads if t.is_alive()]
+        for i in range(self.count - len(self.threads)):
+            logging.info("start new %s thread"%self.name)
+            self.spawn()
+
+    def loop(self):
+        while True:
+            item = self.source.get()
+            out = None
+            with self.lock:
+                self.busy += 1
+            start = time.time()
+            try:
+                out = self.handler(item)
+            except Exception as e:
+                logging.exception(e)
+            finally:
+                with self.lock:
+                    self.busy -= 1
+                registry.inc('oj_stage_busy_seconds_total', time.time() - start, stage=self.name)
+            if out is not None and self.sink is not None:
+                with self.lock:
+                    self.blocked += 1
+                start = time.time()
+                self.sink.put(out) #下一阶段积压时阻塞
+                with self.lock:
+                    self.blocked -= 1
+                registry.inc('oj_stage_blocked_seconds_total', time.time() - start, stage=self.name)
+            self.source.task_done()
+
+    def stats(self):
+        with self.lock:
+            return {"workers": len([t for t in self.threads if t.is_alive()]), "busy": self.busy, "blocked": self.blocked}
+
+class Pipeline(object):
+    '''compile(task)返回需要运行的任务或None,run(task)运行并写入结果'''
+    def __init__(self, source, compile, run):
+        self.handoff = Queue(config.pipeline_handoff_size)
+        self.stages = [
+            Stage("compile", source, compile, config.pipeline_compile_workers, self.handoff),
+            Stage("run", self.handoff, run, config.pipeline_run_workers),
+        ]
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def check(self):
+        for stage in self.stages:
+            stage.check()
+
+    def stats(self):
+        return dict((stage.name, stage.stats()) for stage in self.stages)
+
+registry.describe('oj_stage_busy_seconds_total', 'time pipeline stage threads spent working')
+registry.describe('oj_stage_blocked_seconds_total', 'time pipeline stage threads waited for the next stage')
@@ -3,155 +3,414 @@
 import os
 import re
 import sys
-import shutil
 import subprocess
 import codecs
 import logging
 import shlex
+import fcntl
+import signal
 import time
 import config
 import lorun
 import threading
 import MySQLdb
-from db import run_sql,run_sql_yield
-from Queue import Queue
+from db import run_sql_pooled
+from notify import PgNotifier
+from reconcile import reconcile_loop
+from compare import compare_output,PipeComparator
+from checker import checkers,CheckerError
+from manifest import manifests
+from compile_cache import compile_cache,snapshot
+from supervisor import WorkerSupervisor
+from caserunner import run_cases,fork_call,kill_children
+from casestats import case_stats
+from workarea import workarea
+from runtime import runtimes,hello
+from scheduler import FairScheduler
+from claim import claim_pending,node_id,lease_loop,release_node
+from dispatcher import compile_slots,run_slots,writer,execute
+import cpuset
+from cpuset import run_core,compile_preexec,worker_count
+from autoscale import Autoscaler
+from pipeline import Pipeline
+from pch import pchs
+import db
+import metrics
+from metrics import registry,phase
+import resource
+from Queue import Queue,Empty
 def low_level():
+    '''降低权限;已经是nobody时不再调用setuid,多线程时每次setuid都会向所有线程发送信号,打断它们正在进行的系统调用'''
+    if os.getuid() == nobody_uid and os.geteuid() == nobody_uid:
+        return
     try:
-        os.setuid(int(os.popen("id -u %s"%"nobody").read())) 
+        os.setuid(nobody_uid)
     except Exception as e:
         logging.error(e)
+try:
+    nobody_uid = int(os.popen("id -u %s"%"nobody").read())
+except ValueError:
+    sys.exit("cannot find user nobody")
+if config.cpu_pinning:
+    #建立cgroup需要root权限,必须在降低权限之前
+    try:
+        cpuset.setup_cgroups(cpuset.run_cores,nobody_uid)
+    except (IOError, OSError, ValueError) as e:
+        sys.exit("cpu cgroup %s is not usable: %s"%(config.cpu_cgroup,e))
 try: 
     #降低程序运行权限，防止恶意代码
-    os.setuid(int(os.popen("id -u %s"%"nobody").read())) 
+    os.setuid(nobody_uid)
 except:
     logging.error("please run this program as root!")
     sys.exit(-1)
 #初始化队列
-q = Queue(config.queue_size)
+if config.scheduler == "fair":
+    q = FairScheduler(config.queue_size)
+else:
+    q = Queue(config.queue_size)
 #数据库锁，保证一个时间只能一个程序都写数据库
 #dblock = threading.Lock()
 runid_inqueue_set = set()
-sql_yield = run_sql_yield()
-sql_yield.next()
+#评测线程,check_thread据此补充退出的线程
+worker_threads = []
+#进程模式下的评测进程管理
+supervisor = None
+#线程模式下正在评测的线程数
+busy_workers = [0]
+busy_lock = threading.Lock()
+workers_lock = threading.Lock()
+#自动调整评测线程(进程)数,没有开启时为None
+scaler = None
+#流水线模式下的编译和运行线程池
+pipeline = None
+#正在评测(流水线中为正在编译或运行)的任务 {solution_id: (开始时间,允许的最长秒数)},monitor据此判断评测是否卡住
+inflight = {}
+inflight_lock = threading.Lock()
+
+#各语言源文件名
+file_name = {
+    "gcc":"main.c",
+    "g++":"main.cpp",
+    "java":"Main.java",
+    'ruby':"main.rb",
+    "perl":"main.pl",
+    "pascal":"main.pas",
+    "go":"main.go",
+    "lua":"main.lua",
+    "dao":"main.dao",
+    'python2':'main.py',
+    'python3':'main.py',
+    "haskell":"main.hs"
+}
+#各语言编译命令
+build_cmd = {
+    "gcc"    : "gcc main.c -o main -Wall -lm -O2 -std=c99 --static -DONLINE_JUDGE",
+    "g++"    : "g++ main.cpp -O2 -Wall -lm --static -DONLINE_JUDGE -o main",
+    "java"   : "javac Main.java",
+    "ruby"   : "ruby -c main.rb",
+    "perl"   : "perl -c main.pl",
+    "pascal" : 'fpc main.pas -O2 -Co -Ct -Ci',
+    "go"     : '/opt/golang/bin/go build -ldflags "-s -w"  main.go',
+    "lua"    : 'luac -o main main.lua',
+    "dao"    : "ls",
+    "python2": 'python2 -m py_compile main.py',
+    "python3": 'python3 -m py_compile main.py',
+    "haskell": "ghc -o main main.hs",
+}
+
+def judge_task(task,on_started=None):
+    '''评测一个任务并写入结果,on_started(task)在Judging状态写入后调用'''
+    start_task(task)
+    if on_started is not None:
+        on_started(task)
+    result = run_task(task) #评判
+    return finish_task(task,result)
+
+def start_task(task):
+    '''开始评测一个任务'''
+#        dblock.acquire()
+    update_solution_status(task['solution_id']) #将状态改为judging
+#        dblock.release()
+    task['data_count'] = get_data_count(task['problem_id']) #获取测试数据的个数
+    task['started'] = time.time()
+    logging.info("judging %s"%task['solution_id'])
+
+def run_task(task):
+    '''编译(流水线模式下已经编译的不再编译)并运行'''
+    return run(task['problem_id'],task['solution_id'],task['pro_lang'],task['data_count'],task['user_id'],task.get('compiled'))
+
+def finish_task(task,result):
+    '''写入评测结果'''
+    solution_id = task['solution_id']
+    #调度时估计该题目的评测耗时,不包括在流水线交接队列中等待的时间
+    task['cost'] = time.time() - task['started'] - task.get('handoff_wait',0)
+    logging.info("%s result %s"%(result['solution_id'],result['result']))
+    registry.inc('oj_verdict_total',verdict=verdict_name.get(result['result'],result['result']))
+#        dblock.acquire()
+    update_result(result) #将结果写入数据库
+#        dblock.release()
+    if config.auto_clean == True or workarea.on_tmpfs(solution_id):  #清理work目录,tmpfs上的目录总是回收
+        clean_work_dir(result['solution_id'])
+    return result
 
 def worker():
     '''工作线程，循环扫描队列，获得评判任务并执行'''
     while True:
         if q.empty() is True: #队列为空，空闲
             logging.info("%s idle"%(threading.current_thread().name))
-        task = q.get()  # 获取任务，如果队列为空则阻塞
-        solution_id = task['solution_id']
-        problem_id = task['problem_id']
-        language = task['pro_lang']
-        user_id = task['user_id']
-        runid_inqueue_set.remove(int(solution_id))
-#        dblock.acquire()
-        update_solution_status(solution_id) #将状态改为judging
-#        dblock.release()
-        data_count = get_data_count(task['problem_id']) #获取测试数据的个数
-        logging.info("judging %s"%solution_id)
-        result=run(problem_id,solution_id,language,data_count,user_id) #评判
-        logging.info("%s result %s"%(result['solution_id'],result['result']))
-#        dblock.acquire()
-        update_result(result) #将结果写入数据库
-#        dblock.release()
-        if config.auto_clean == True:  #清理work目录
-            clean_work_dir(result['solution_id'])
+        try:
+            # 获取任务，如果队列为空则阻塞;自动调整时定期检查是否需要退出
+            task = q.get(timeout=config.autoscale_idle_timeout if scaler is not None else None)
+        except Empty:
+            if retire_worker():
+                return
+            continue
+        with busy_lock:
+            busy_workers[0] += 1
+        track_task(task)
+        try:
+            judge_task(task,dequeued)
+        finally:
+            dequeued(task) #出错时也不能留在集合中
+            untrack_task(task)
+            with busy_lock:
+                busy_workers[0] -= 1
+        record_cost(task)
         q.task_done()   #一个任务完成
+        if retire_worker():
+            return
 
-def clean_work_dir(solution_id):
-    '''清理word目录，删除临时文件'''
-    dir_name = os.path.join(config.work_dir,str(solution_id))
+def track_task(task):
+    '''记录开始评测的任务,允许的时间为stuck_grace加上每组数据两倍的时间限制和1秒'''
     try:
-        shutil.rmtree(dir_name)
-    except:
+        time_limit = get_problem_limit(task['problem_id'])[0]
+        data_count = get_data_count(task['problem_id'])
+    except Exception as e:
+        logging.error(e)
+        time_limit,data_count = 0,0
+    budget = config.stuck_grace + data_count*(time_limit*2/1000.0+1)
+    with inflight_lock:
+        inflight[int(task['solution_id'])] = (time.time(),budget)
+
+def untrack_task(task):
+    with inflight_lock:
+        inflight.pop(int(task['solution_id']),None)
+
+def inflight_stats():
+    '''(超过允许时间的任务数,最早开始的任务已经评测的秒数)'''
+    now = time.time()
+    with inflight_lock:
+        items = inflight.values()
+    overdue = len([i for i in items if now - i[0] > i[1]])
+    return overdue,max([now - i[0] for i in items] or [0])
+
+def dequeued(task):
+    '''Judging状态已经写入数据库,提交不会再被取出,可以离开runid_inqueue_set'''
+    runid_inqueue_set.discard(int(task['solution_id']))
+
+def compile_stage(task):
+    '''流水线的编译阶段,返回需要运行的任务;编译错误等不需要运行的直接写入结果'''
+    track_task(task)
+    try:
+        try:
+            start_task(task)
+        finally:
+            dequeued(task)
+        with phase("compile"):
+            task['compiled'] = compile(task['solution_id'],task['pro_lang'])
+        if task['compiled'] and task['data_count']:
+            task['handoff_at'] = time.time()
+            return task
+        finish_task(task,run_task(task))
+    finally:
+        untrack_task(task) #在交接队列中等待的时间不计入
+    record_cost(task)
+    return None
+
+def run_stage(task):
+    '''流水线的运行阶段'''
+    task['handoff_wait'] = time.time() - task['handoff_at']
+    track_task(task)
+    try:
+        finish_task(task,run_task(task))
+    finally:
+        untrack_task(task)
+    record_cost(task)
+
+def start_pipeline():
+    '''开启流水线的编译和运行线程'''
+    global pipeline
+    pipeline = Pipeline(q,compile_stage,run_stage)
+    pipeline.start()
+
+def target_workers():
+    '''评测线程(进程)的目标数'''
+    if scaler is not None:
+        return scaler.target
+    return worker_count()
+
+def retire_worker():
+    '''评测线程多于目标数时退出当前线程'''
+    if scaler is None:
+        return False
+    me = threading.current_thread()
+    with workers_lock:
+        if len(worker_threads) <= scaler.target or me not in worker_threads:
+            return False
+        worker_threads.remove(me)
+    logging.info("%s retired"%me.name)
+    return True
+
+def dispatch_task():
+    '''进程模式下,将队列中的任务转交给评测进程'''
+    while True:
+        supervisor.wait_idle()
+        task = q.get()
+        track_task(task)
+        supervisor.submit(task)
+        q.task_done()
+
+def task_done(task):
+    '''评测进程完成任务,此时结果已经写入数据库'''
+    runid_inqueue_set.discard(int(task['solution_id']))
+    untrack_task(task)
+    record_cost(task)
+    if 'metrics' in task:
+        registry.merge(task['metrics'])
+
+def judge_task_process(task):
+    '''在评测进程中评测任务,记录的指标随任务返回主进程'''
+    try:
+        judge_task(task)
+    finally:
+        writer.flush() #主进程收到任务完成时结果已经写入数据库
+        sync_counters()
+        task['metrics'] = registry.drain()
+
+def record_cost(task):
+    '''记录任务的评测耗时'''
+    if 'cost' in task and hasattr(q,'record_cost'):
+        q.record_cost(task['problem_id'],task['cost'])
+
+def task_lost(task):
+    '''评测进程崩溃时正在评测的任务,重试一次,仍然失败则为System Error'''
+    solution_id = task['solution_id']
+    untrack_task(task)
+    if task.get('retries',0) < 1:
+        logging.error("judge process lost %s, retry"%solution_id)
+        task['retries'] = task.get('retries',0) + 1
+        q.put(task)
+        return
+    logging.error("judge process lost %s again, system error"%solution_id)
+    update_solution_status(solution_id,11)
+    runid_inqueue_set.discard(int(solution_id))
+
+def clean_work_dir(solution_id):
+    '''清理word目录，删除临时文件,由后台线程删除,不等待'''
+    if not workarea.release(solution_id):
         logging.error("rm error")
 
+def start_worker():
+    t = threading.Thread(target=worker)
+    t.deamon = True
+    with workers_lock: #check_thread不会把还没有启动的线程当作已经退出
+        worker_threads.append(t)
+        t.start()
+
 def start_work_thread():
     '''开启工作线程'''
-    for i in range(config.count_thread):
-        t = threading.Thread(target=worker)
-        t.deamon = True
-        t.start()
+    for i in range(target_workers()):
+        start_worker()
+
+def start_work_process():
+    '''开启评测进程和转交任务的线程'''
+    global supervisor
+    supervisor = WorkerSupervisor(judge_task_process,target_workers(),on_done=task_done,on_lost=task_lost,
+                                  on_start=pin_worker,capacity=scaler.maximum if scaler is not None else None)
+    supervisor.start()
+    t = threading.Thread(target=dispatch_task, name="dispatch")
+    t.deamon = True
+    t.start()
+
+def pin_worker(index):
+    '''评测进程只使用分给它的运行核'''
+    if config.cpu_pinning:
+        cpuset.cores.restrict(index,supervisor.capacity)
 
 def start_get_task():
     '''开启获取任务线程'''
-    t = threading.Thread(target=put_task_into_queue, name="get_task")
+    if config.intake_mode == "notify":
+        target = listen_task_into_queue
+    else:
+        target = put_task_into_queue
+    t = threading.Thread(target=target, name="get_task")
     t.deamon = True
     t.start()
 
 def get_data_count(problem_id):
     '''获得测试数据的个数信息'''
-    full_path = os.path.join(config.data_dir,str(problem_id))
-    try:
-        files = os.listdir(full_path)
-    except OSError,e:
-        logging.error(e)
-        return 0
-    except Exception as e:
-        logging.error(e)
-        return 0
-    count = 0
-    for item in files:
-        if item.endswith(".in") and item.startswith("data"):
-            count += 1
-    return count
+    return manifests.get(problem_id).count
 
 def update_solution_status(solution_id,result=12):
     '''实时更新评测信息'''
-    update_sql = "update solution set result = %s where id = %s"%(result,solution_id)
-    sql_yield.send(update_sql)
+    #已经有结果的提交(重试或重新认领时已经写入)不再改回
+    update_sql = "update solution set result = %s where id = %s and result in (0,12)"%(result,solution_id)
+    if config.claim_mode: #租约过期被其他节点认领后不再修改
+        update_sql += " and judge_node = '%s'"%node_id()
+    run_sql_pooled(update_sql) #同步写入,调用者据此判断提交不会再被取出
 #    run_sql(update_sql)
     return 0
 
 def update_result(result):
     '''更新评测结果'''
-    #更新solution信息
-    sql = "update solution set take_time = %s , take_memory = %s, result = %s where id = %s"%(result['take_time'],result['take_memory'],result['result'],result['solution_id'])
-    #更新用户解题数和做题数信息
-    update_ac_sql = "update user_statistics set accepts_count = (select count(distinct problem_id) from solution where result = 1 and user_id = %s) where id = %s;"%(result['user_id'],result['user_id'])
-    update_sub_sql = "update user_statistics set solutions_count = (select count(problem_id) from solution where user_id = %s) where id = %s;"%(result['user_id'],result['user_id'])
-    #更新题目AC数和提交数信息
-    update_problem_ac="UPDATE problem_statistics SET accepts_count=(SELECT count(*) FROM solution WHERE problem_id=%s AND result=1) WHERE id=%s"%(result['problem_id'],result['problem_id'])
-    update_problem_sub="UPDATE problem_statistics SET solutions_count=(SELECT count(*) FROM solution WHERE problem_id=%s) WHERE id=%s"%(result['problem_id'],result['problem_id'])
-#    run_sql([sql,update_ac_sql,update_sub_sql,update_problem_ac,update_problem_sub])
-    sql_yield.send([sql,update_ac_sql,update_sub_sql,update_problem_ac,update_problem_sub])
+    #更新solution信息,只有从等待评测或正在评测变为结果时才写入
+    sql = "update solution set take_time = %s , take_memory = %s, result = %s where id = %s and result in (0,12)"%(result['take_time'],result['take_memory'],result['result'],result['solution_id'])
+    if config.claim_mode: #只写入本节点仍然认领的提交
+        sql += " and judge_node = '%s'"%node_id()
+    #增量更新用户和题目的提交数,误差由reconcile定期校正
+    update_sub_sql = "update user_statistics set solutions_count = solutions_count + 1 where id = %s"%result['user_id']
+    update_problem_sub = "update problem_statistics set solutions_count = solutions_count + 1 where id = %s"%result['problem_id']
+    stats = [update_sub_sql,update_problem_sub]
+    if result['result'] == 1:
+        #用户第一次AC该题才增加解题数;上面的语句已经锁住该用户的统计行,同一用户的事务在这里串行,
+        #本语句开始时已经能看到先提交的事务写入的AC
+        update_ac_sql = "update user_statistics set accepts_count = accepts_count + 1 where id = %s and not exists (select 1 from solution where user_id = %s and problem_id = %s and result = 1 and id <> %s)"%(result['user_id'],result['user_id'],result['problem_id'],result['solution_id'])
+        update_problem_ac = "update problem_statistics set accepts_count = accepts_count + 1 where id = %s"%result['problem_id']
+        stats += [update_ac_sql,update_problem_ac]
+    def write(cur):
+        cur.execute(sql)
+        if cur.rowcount != 1: #重试,租约回收后的重复评测等已经写入过结果,不重复计数
+            return ()
+        for i in stats:
+            cur.execute(i)
+        return ()
+#    run_sql(sqls)
+    execute(write,result['solution_id'])
     return 0
 
 def update_compile_info(solution_id,info):
     '''更新数据库编译错误信息'''
-    info = MySQLdb.escape_string(info)
-    sql = "insert into compile_info(code_id,content) values (%s,'%s')"%(solution_id,info)
+    sql = compile_info_sql(solution_id,info)
    # run_sql(sql)
-    sql_yield.send(sql)
+    execute(sql,solution_id)
     return 0
 
+def compile_info_sql(solution_id,info,where=None):
+    '''插入编译信息的sql,where不为空时只在条件成立时插入'''
+    info = MySQLdb.escape_string(info)
+    if where is not None:
+        return "insert into compile_info(code_id,content) select %s,'%s' where %s"%(solution_id,info,where)
+    return "insert into compile_info(code_id,content) values (%s,'%s')"%(solution_id,info)
+
 def get_problem_limit(problem_id):
     '''获得题目的时间和内存限制'''
-    sql = "select time_limit,memory_limit from problem where id = %s"%problem_id
-   # data = run_sql(sql)
-    data = sql_yield.send(sql)
-    return data[0]
+    return manifests.get(problem_id).get_limits()
 
 def get_code(solution_id,problem_id,pro_lang):
     '''从数据库获取代码并写入work目录下对应的文件'''
-    file_name = {
-        "gcc":"main.c",
-        "g++":"main.cpp",
-        "java":"Main.java",
-        'ruby':"main.rb",
-        "perl":"main.pl",
-        "pascal":"main.pas",
-        "go":"main.go",
-        "lua":"main.lua",
-        "dao":"main.dao",
-        'python2':'main.py',
-        'python3':'main.py',
-        "haskell":"main.hs"
-    }
     select_code_sql = "select content from code where solution_id = %s"%solution_id
     #feh = run_sql(select_code_sql)
-    feh = sql_yield.send(select_code_sql)
+    feh = run_sql_pooled(select_code_sql)
     if feh is not None:
         try:
             code = feh[0][0]
@@ -161,21 +420,26 @@ def get_code(solution_id,problem_id,pro_lang):
     else:
         logging.error("2 cannot get code of runid %s"%solution_id)
         return False
+    return write_code(solution_id,problem_id,pro_lang,code)
+
+def write_code(solution_id,problem_id,pro_lang,code):
+    '''分配work目录并将代码写入对应的文件'''
     try:
-        work_path = os.path.join(config.work_dir,str(solution_id))
+        #每组数据比较后删除输出,预计大小为同时运行的各组数据最多允许的正确输出,超过配额时使用磁盘目录
+        size_hint = 0
+        if config.output_mode != "pipe":
+            out_size = max([c.out_size or 0 for c in manifests.get(problem_id).cases] or [0])
+            size_hint = int(out_size*config.output_limit_factor)*parallel_slots(problem_id)
         low_level()
-        os.mkdir(work_path)
+        workarea.allocate(solution_id,size_hint)
     except OSError,e:
-        if str(e).find("exist")>0: #文件夹已经存在
-            logging.info("dir exist")
-        else:
-            logging.error(e)
-            return False
+        logging.error(e)
+        return False
     except Exception as e:
         logging.error(e)
         return False
     try:
-        real_path = os.path.join(config.work_dir,str(solution_id),file_name[pro_lang])
+        real_path = workarea.path(solution_id,file_name[pro_lang])
     except KeyError,e:
         logging.error(e)
         return False
@@ -212,79 +476,179 @@ def del_code_note(code,pro_lang):
 #        code = re.sub(r'""".*?"""','',code,flags=re.M|re.S)
     return code
 
+def queued_ids():
+    '''已经在队列中或正在评测的提交,其他线程可能同时修改集合'''
+    while True:
+        try:
+            return list(runid_inqueue_set)
+        except RuntimeError:
+            continue
+
+def fetch_pending(solution_ids=None):
+    '''查询最多intake_batch个等待评测且不在队列中的提交和代码,solution_ids不为空时只查询这些提交
+    返回(id,problem_id,user_id,contest_id,program_language,content),代码还没有写入时content为None'''
+    if config.claim_mode: #认领后其他节点不会再取到
+        limit = config.claim_batch - len(runid_inqueue_set)
+        missing = list(code_missing) #已经认领,还在等待代码
+        if limit <= 0 and not missing:
+            return ()
+        return claim_pending(limit,solution_ids,missing)
+    where = "s.result = 0"
+    if solution_ids:
+        where += " and s.id in (%s)"%','.join(str(int(i)) for i in solution_ids)
+    queued = queued_ids()
+    if queued:
+        where += " and s.id not in (%s)"%','.join(str(int(i)) for i in queued)
+    sql = '''select s.id,s.problem_id,s.user_id,s.contest_id,s.program_language,c.content
+from solution s left join code c on c.solution_id = s.id
+where %s order by s.id limit %s'''%(where,config.intake_batch)
+    #data = run_sql(sql)
+    return run_sql_pooled(sql)
+
+def forget_missing(ids,data):
+    '''ids中不再等待评测的提交(被删除或已经处理)不再等待代码'''
+    if data is False or len(data) >= config.intake_batch: #没有查询完全部提交
+        return
+    found = set(int(i[0]) for i in data)
+    for i in ids:
+        if i not in found:
+            code_missing.pop(i,None)
+
+#代码还没有写入数据库的提交 {solution_id: 第一次发现的时间}
+code_missing = {}
+#并行写入代码的线程池
+intake_pool = None
+
+def prepare_task(row):
+    '''写入代码,返回任务;代码还没有写入数据库返回None,失败返回False'''
+    solution_id,problem_id,user_id,contest_id,pro_lang,code = row
+    if code is None:
+        first = code_missing.setdefault(int(solution_id),time.time())
+        if time.time() - first < config.code_wait: #防止因速度太快不能获取代码,下一轮再取
+            return None
+        logging.error("cannot get code of runid %s"%solution_id)
+        return False
+    if write_code(solution_id,problem_id,pro_lang,code) == False:
+        return False
+    return {
+        "solution_id":solution_id,
+        "problem_id":problem_id,
+        "contest_id":contest_id,
+        "user_id":user_id,
+        "pro_lang":pro_lang,
+        "queued_at":time.time(),
+    }
+
+def add_tasks(rows):
+    '''并行写入代码,按提交顺序将任务添加到队列'''
+    global intake_pool
+    rows = [i for i in rows if int(i[0]) not in runid_inqueue_set]
+    if not rows:
+        return 0
+    with phase("fetch"):
+        if len(rows) > 1 and config.intake_writers > 1:
+            if intake_pool is None:
+                from multiprocessing.pool import ThreadPool
+                intake_pool = ThreadPool(config.intake_writers)
+            tasks = intake_pool.map(prepare_task,rows)
+        else:
+            tasks = [prepare_task(i) for i in rows]
+    added = 0
+    for row,task in zip(rows,tasks):
+        solution_id = int(row[0])
+        if task is None:
+            continue
+        code_missing.pop(solution_id,None)
+        if task is False:
+            update_solution_status(solution_id,11)
+            clean_work_dir(solution_id)
+            continue
+        runid_inqueue_set.add(solution_id)
+        q.put(task)
+        added += 1
+    return added
+
+def add_task(row):
+    '''获取代码并将一个提交添加到队列'''
+    return add_tasks([row]) == 1
+
 def put_task_into_queue():
-    '''循环扫描数据库,将任务添加到队列'''
+    '''循环扫描数据库,每次最多添加intake_batch个任务,没有新任务时等待intake_poll_interval秒'''
     while True:
 #        q.join() #阻塞程序,直到队列里面的任务全部完成
-        sql = "select id,problem_id,user_id,contest_id,program_language from solution where result = 0"
-        #data = run_sql(sql)
-        data = sql_yield.send(sql)
-        time.sleep(0.2) #延时0.2秒,防止因速度太快不能获取代码
-        for i in data:
-            solution_id,problem_id,user_id,contest_id,pro_lang = i
-            if int(solution_id) in runid_inqueue_set:
-                time.sleep(0.3)
-                continue
-    #        dblock.acquire()
-            ret = get_code(solution_id,problem_id,pro_lang)
-    #        dblock.release()
-            if ret == False:
-                #防止因速度太快不能获取代码
-                time.sleep(1)
-     #           dblock.acquire()
-                ret = get_code(solution_id,problem_id,pro_lang)
-     #           dblock.release()
-            if ret == False:
-      #          dblock.acquire()
-                update_solution_status(solution_id,11)
-      #          dblock.release()
-                clean_work_dir(solution_id)
-                continue
-            task = {
-                "solution_id":solution_id,
-                "problem_id":problem_id,
-                "contest_id":contest_id,
-                "user_id":user_id,
-                "pro_lang":pro_lang,
-            }
-            runid_inqueue_set.add(int(solution_id))
-            q.put(task)
-        time.sleep(0.5)
+        missing = list(code_missing)
+        data = fetch_pending()
+        forget_missing(missing,data)
+        if not data or add_tasks(data) == 0:
+            time.sleep(config.intake_poll_interval)
+
+def listen_task_into_queue(notifier=None):
+    '''监听新提交通知,收到通知立即将任务添加到队列,并低频扫描数据库兜底'''
+    if notifier is None:
+        notifier = PgNotifier()
+    last_poll = 0
+    while True:
+        timeout = max(0, last_poll + config.notify_poll_interval - time.time())
+        if code_missing: #还没有代码的提交稍后重新查询
+            timeout = min(timeout, config.intake_poll_interval)
+        payloads = notifier.wait(timeout)
+        if payloads is None or time.time() - last_poll >= config.notify_poll_interval:
+            #重连后或到达兜底时间,全量扫描
+            last_poll = time.time()
+            data = fetch_pending()
+        elif payloads:
+            ids = [p for p in payloads if p.isdigit()]
+            if len(ids) == len(payloads):
+                data = fetch_pending(ids + list(code_missing))
+            else:
+                data = fetch_pending()
+        elif code_missing:
+            missing = list(code_missing)
+            data = fetch_pending(missing)
+            forget_missing(missing,data)
+        else:
+            continue
+        if not data:
+            continue
+        add_tasks(data)
 
-def compile(solution_id,language):
+def compile(solution_id,language,save_info=True):
     low_level()
-    '''将程序编译成可执行文件'''
+    '''将程序编译成可执行文件,save_info为False时不写入编译错误信息(重判时随结果一起写入)'''
     language = language.lower()
-    dir_work = os.path.join(config.work_dir,str(solution_id))
+    dir_work = workarea.path(solution_id)
 #    if language == "ruby":
 #        return True
-    build_cmd = {
-        "gcc"    : "gcc main.c -o main -Wall -lm -O2 -std=c99 --static -DONLINE_JUDGE",
-        "g++"    : "g++ main.cpp -O2 -Wall -lm --static -DONLINE_JUDGE -o main",
-        "java"   : "javac Main.java",
-        "ruby"   : "ruby -c main.rb",
-        "perl"   : "perl -c main.pl",
-        "pascal" : 'fpc main.pas -O2 -Co -Ct -Ci',
-        "go"     : '/opt/golang/bin/go build -ldflags "-s -w"  main.go',
-        "lua"    : 'luac -o main main.lua',
-		"dao"    : "ls",
-        "python2": 'python2 -m py_compile main.py',
-        "python3": 'python3 -m py_compile main.py',
-        "haskell": "ghc -o main main.hs",
-    }
     if language not in build_cmd.keys():
         return False
-    p = subprocess.Popen(build_cmd[language],shell=True,cwd=dir_work,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-    out,err =  p.communicate()#获取编译错误信息
-    err_txt_path = os.path.join(config.work_dir,str(solution_id),'error.txt')
+    cmd = build_cmd[language]
+    key = None
+    cached = None
+    if config.compile_cache:
+        key = compile_cache.key(language,cmd,os.path.join(dir_work,file_name[language]))
+    if key is not None:
+        cached = compile_cache.load(key,dir_work)
+    if cached is not None: #命中缓存,不再编译
+        returncode,output = cached
+    else:
+        before = snapshot(dir_work)
+        #缓存key使用原命令,是否使用预编译头文件不影响编译结果
+        cmd = pchs.command(language,cmd,os.path.join(dir_work,file_name[language]))
+        with compile_slots: #同时编译的数目不超过compile_slots
+            p = subprocess.Popen(cmd,shell=True,cwd=dir_work,stdout=subprocess.PIPE,stderr=subprocess.PIPE,preexec_fn=compile_preexec if config.cpu_pinning else None)
+            out,err =  p.communicate()#获取编译错误信息
+        returncode,output = p.returncode,err+out
+        if key is not None:
+            compile_cache.store(key,dir_work,before,returncode,output)
+    err_txt_path = workarea.path(solution_id,'error.txt')
     f = file(err_txt_path,'w')
-    f.write(err)
-    f.write(out)
+    f.write(output)
     f.close()
-    if p.returncode == 0: #返回值为0,编译成功
+    if returncode == 0: #返回值为0,编译成功
         return True
  #   dblock.acquire()
-    update_compile_info(solution_id,err+out) #编译失败,更新题目的编译错误信息
+    if save_info:
+        update_compile_info(solution_id,output) #编译失败,更新题目的编译错误信息
  #   dblock.release()
     return False
 
@@ -292,55 +656,78 @@ def judge_result(problem_id,solution_id,data_num):
     low_level()
     '''对输出数据进行评测'''
     logging.debug("Judging result")
-    currect_result = os.path.join(config.data_dir,str(problem_id),'data%s.out'%data_num)
-    user_result = os.path.join(config.work_dir,str(solution_id),'out%s.txt'%data_num)
+    user_result = workarea.path(solution_id,'out%s.txt'%data_num)
     try:
-        curr = file(currect_result).read().replace('\r','').rstrip()#删除\r,删除行末的空格和换行
-        user = file(user_result).read().replace('\r','').rstrip()
-    except:
-        return False
-    if curr == user:       #完全相同:AC
-        return "Accepted"
-    if curr.split() == user.split(): #除去空格,tab,换行相同:PE
-        return "Presentation Error"
-    if curr in user:  #输出多了
-        return "Output limit"
-    return "Wrong Answer"  #其他WA
-
-def judge_one_mem_time(solution_id,problem_id,data_num,time_limit,mem_limit,language):
-    rst = None
-    low_level()
-    '''评测一组数据'''
-    input_path = os.path.join(config.data_dir,str(problem_id),'data%s.in'%data_num)
-    try:
-        input_data = file(input_path)
-    except:
+        manifest = manifests.get(problem_id)
+        open_expected = manifest.output_opener(data_num) #有data.pack时从打包文件读取
+        if manifest.checker is not None: #special judge
+            with phase("compare"):
+                return checkers.check(manifest.checker,lambda: manifest.open_input(data_num),open_expected,user_result)
+        #流式比较:完全相同AC,除去空白相同PE,输出多了Output limit,其他WA
+        with phase("compare"):
+            return compare_output(None,user_result,open_expected)
+    except CheckerError as e:
+        logging.error("problem %s checker: %s"%(problem_id,e))
+        return "System Error"
+    except Exception as e:
+        logging.error(e)
         return False
-    output_path = os.path.join(config.work_dir,str(solution_id),'out%s.txt'%data_num)
-    temp_out_data = file(output_path,'w')
+
+def run_args(solution_id,language):
+    '''运行程序的命令'''
     if language == 'java':
-        cmd = 'java -cp %s Main'%(os.path.join(config.work_dir,str(solution_id)))
+        cmd = 'java -cp %s Main'%(workarea.path(solution_id))
         main_exe = shlex.split(cmd)
     elif language == 'python2':
-        cmd = 'python2 %s'%(os.path.join(config.work_dir,str(solution_id),'main.pyc'))
+        cmd = 'python2 %s'%(workarea.path(solution_id,'main.pyc'))
         main_exe = shlex.split(cmd)
     elif language == 'python3':
-        cmd = 'python3 %s'%(os.path.join(config.work_dir,str(solution_id),'__pycache__/main.cpython-33.pyc'))
+        cmd = 'python3 %s'%(workarea.path(solution_id,'__pycache__/main.cpython-33.pyc'))
         main_exe = shlex.split(cmd)
     elif language == 'lua':
-        cmd = "lua %s"%(os.path.join(config.work_dir,str(solution_id),"main"))
+        cmd = "lua %s"%(workarea.path(solution_id,"main"))
         main_exe = shlex.split(cmd)
     elif language == "ruby":
-        cmd = "ruby %s"%(os.path.join(config.work_dir,str(solution_id),"main.rb"))
+        cmd = "ruby %s"%(workarea.path(solution_id,"main.rb"))
         main_exe = shlex.split(cmd)
     elif language == "perl":
-        cmd = "perl %s"%(os.path.join(config.work_dir,str(solution_id),"main.pl"))
+        cmd = "perl %s"%(workarea.path(solution_id,"main.pl"))
         main_exe = shlex.split(cmd)
     elif language == "dao":
-        cmd = "dao %s"%(os.path.join(config.work_dir,str(solution_id),"main.dao"))
+        cmd = "dao %s"%(workarea.path(solution_id,"main.dao"))
         main_exe = shlex.split(cmd)
     else:
-        main_exe = [os.path.join(config.work_dir,str(solution_id),'main'),]
+        main_exe = [workarea.path(solution_id,'main'),]
+    return main_exe
+
+def case_output_limit(problem_id,data_num):
+    '''一组数据程序输出的最大字节数:output_limit和标准输出大小的output_limit_factor倍中较大的'''
+    cases = manifests.get(problem_id).cases
+    out_size = 0
+    if 0 < data_num <= len(cases):
+        out_size = cases[data_num-1].out_size or 0
+    return max(config.output_limit,int(out_size*config.output_limit_factor))
+
+def remove_output(solution_id,data_num):
+    '''比较完成后删除tmpfs上该组数据的输出,已经评测的数据不再占用配额'''
+    if not workarea.on_tmpfs(solution_id):
+        return
+    try:
+        os.remove(workarea.path(solution_id,'out%s.txt'%data_num))
+    except OSError:
+        pass
+
+def judge_one_mem_time(solution_id,problem_id,data_num,time_limit,mem_limit,language,forked=False):
+    rst = None
+    low_level()
+    '''评测一组数据'''
+    try:
+        input_data = manifests.get(problem_id).open_input(data_num)
+    except:
+        return False
+    output_path = workarea.path(solution_id,'out%s.txt'%data_num)
+    temp_out_data = file(output_path,'w')
+    main_exe = run_args(solution_id,language)
     runcfg = {
         'args':main_exe,
         'fd_in':input_data.fileno(),
@@ -349,15 +736,36 @@ def judge_one_mem_time(solution_id,problem_id,data_num,time_limit,mem_limit,lang
         'memorylimit':mem_limit, #in KB
     }
     low_level()
-    try:
-        rst = lorun.run(runcfg)
-    except:
-        logging.error("lorun Error")
+    quota = None
+    if workarea.on_tmpfs(solution_id): #磁盘上的评测目录不限制输出大小
+        quota = case_output_limit(problem_id,data_num)
+    with run_slots, run_core() as cpu: #同时运行的程序数不超过run_slots,等待槽位的时间不计入run
+        start = time.time()
+        try:
+            if quota or cpu is not None: #tmpfs上限制输出文件大小,超过为Output limit;绑定到取得的核
+                rst = fork_call(run_sandbox,runcfg,quota,cpu,keep_fds=(runcfg['fd_in'],runcfg['fd_out']))
+            elif forked: #并行评测时在子进程中运行,不持有GIL
+                rst = fork_call(lorun.run,runcfg,keep_fds=(runcfg['fd_in'],runcfg['fd_out']))
+            else:
+                rst = lorun.run(runcfg)
+        except:
+            logging.error("lorun Error")
+        registry.observe('oj_phase_seconds',time.time()-start,phase="run")
     input_data.close()
     temp_out_data.close()
+    if quota and rst and rst['result'] == 5 and (rst.get('re_signum') == signal.SIGXFSZ or os.path.getsize(output_path) >= quota):
+        rst['result'] = 6
     logging.debug(rst)
     return rst
 
+def run_sandbox(runcfg,quota=None,cpu=None):
+    '''限制写入文件的大小,绑定到cpu后运行程序,在fork_call的子进程中执行'''
+    if quota is not None:
+        resource.setrlimit(resource.RLIMIT_FSIZE,(quota,quota))
+    if cpu is not None:
+        cpuset.pin(cpu)
+    return lorun.run(runcfg)
+
 def check_dangerous_code(solution_id,language):
     if language in ['python2','python3']:
         code = file('/work/%s/main.py'%solution_id).readlines()
@@ -418,53 +826,214 @@ def check_dangerous_code(solution_id,language):
 
 
 
+def judge_one_piped(solution_id,problem_id,data_num,time_limit,mem_limit,language):
+    '''评测一组数据,程序输出通过管道直接比较,不写入磁盘,返回(运行结果,比较结果)'''
+    low_level()
+    manifest = manifests.get(problem_id)
+    try:
+        input_data = manifest.open_input(data_num)
+    except:
+        return False,None
+    r,w = os.pipe()
+    for fd in (r,w): #编译等其他子进程不继承管道,保证关闭读端后程序收到SIGPIPE
+        fcntl.fcntl(fd,fcntl.F_SETFD,fcntl.fcntl(fd,fcntl.F_GETFD)|fcntl.FD_CLOEXEC)
+    try:
+        reader = PipeComparator(r,manifest.output_opener(data_num),case_output_limit(problem_id,data_num))
+    except Exception as e:
+        logging.error(e)
+        os.close(r)
+        os.close(w)
+        input_data.close()
+        return False,None
+    runner = []     #fork_call子进程的pid
+    killed = []
+    def stop_program():
+        #比较已经有结果,立即结束程序,忽略SIGPIPE的程序不会一直运行到时间限制
+        if runner and kill_children(runner[0]):
+            killed.append(True)
+    reader.on_abort = stop_program
+    reader.start()
+    runcfg = {
+        'args':run_args(solution_id,language),
+        'fd_in':input_data.fileno(),
+        'fd_out':w,
+        'timelimit':time_limit, #in MS
+        'memorylimit':mem_limit, #in KB
+    }
+    rst = None
+    try:
+        #在子进程中运行,等待时不持有GIL,比较线程可以同时读取管道
+        with run_slots, run_core() as cpu, phase("run"):
+            rst = fork_call(run_sandbox,runcfg,None,cpu,keep_fds=(runcfg['fd_in'],w),on_fork=runner.append)
+    except:
+        logging.error("lorun Error")
+    os.close(w)
+    input_data.close()
+    result = reader.finish()
+    if rst and reader.aborted and ended_by_pipe(rst,killed):
+        #已经确定WA或输出超限,程序是因为管道关闭或被结束的;超时,超内存等结果与文件模式相同,保留
+        rst['result'] = 0
+    logging.debug(rst)
+    return rst,result
+
+def ended_by_pipe(rst,killed):
+    '''程序是否正常结束,或因为比较线程关闭管道(SIGPIPE)或结束程序(SIGKILL)而结束'''
+    if rst['result'] == 0:
+        return True
+    if rst['result'] != 5:
+        return False
+    signum = rst.get('re_signum')
+    return signum == signal.SIGPIPE or (killed and signum == signal.SIGKILL)
+
+def judge_case(solution_id,problem_id,data_num,time_limit,mem_limit,language,forked=False):
+    '''评测一组数据,返回(运行结果,比较结果)'''
+    if config.output_mode == "pipe" and manifests.get(problem_id).checker is None: #special judge需要完整的输出
+        return judge_one_piped(solution_id,problem_id,data_num,time_limit,mem_limit,language)
+    ret = judge_one_mem_time(solution_id,problem_id,data_num,time_limit,mem_limit,language,forked)
+    try:
+        if ret == False or ret['result'] in (2,3,5):
+            return ret,None
+        if ret['result'] == 6: #超过输出大小限制
+            return ret,"Output limit"
+        return ret,judge_result(problem_id,solution_id,data_num)
+    finally:
+        remove_output(solution_id,data_num)
+
+def case_failed(outcome):
+    '''该组数据的结果是否使评测结束'''
+    ret,result = outcome
+    if ret == False:
+        return False
+    return ret['result'] in (2,3,5) or result in ("Wrong Answer","Output limit","System Error")
+
+def parallel_slots(problem_id):
+    '''同时运行的测试数据组数'''
+    return config.parallel_cases_problems.get(int(problem_id),config.parallel_cases)
+
 def judge(solution_id,problem_id,data_count,time_limit,mem_limit,program_info,result_code,language):
     low_level()
     '''评测编译类型语言'''
     max_mem = 0
     max_time = 0
-    if language in ["java",'python2','python3','ruby','perl']:
+    offset = runtime_offset(language)
+    if offset is not None: #限制加上测量的启动开销,报告时减去
+        time_limit = time_limit + offset[0]
+        mem_limit = mem_limit + offset[1]
+        program_info['startup_time'],program_info['startup_memory'] = offset
+    elif language in ["java",'python2','python3','ruby','perl']:
         time_limit = time_limit * 2
         mem_limit = mem_limit * 2
-    for i in range(data_count):
-        ret = judge_one_mem_time(solution_id,problem_id,i+1,time_limit+10,mem_limit,language)
-        if ret == False:
-            continue
-        if ret['result'] == 5:
-            program_info['result'] =result_code["Runtime Error"]
-            return program_info
-        elif ret['result'] == 2:
-            program_info['result'] = result_code["Time Limit Exceeded"]
-            program_info['take_time'] = time_limit+10
-            return program_info
-        elif ret['result'] == 3:
-            program_info['result'] =result_code["Memory Limit Exceeded"]
-            program_info['take_memory'] = mem_limit
-            return program_info
-        if max_time < ret["timeused"]:
-            max_time = ret['timeused']
-        if max_mem < ret['memoryused']:
-            max_mem = ret['memoryused']
-        result = judge_result(problem_id,solution_id,i+1)
-        if result == False:
-            continue
-        if result == "Wrong Answer" or result == "Output limit":
-            program_info['result'] = result_code[result]
-            break
-        elif result == 'Presentation Error':
-            program_info['result'] = result_code[result]
-        elif result == 'Accepted':
-            if program_info['result'] != 'Presentation Error':
+    startup_time,startup_mem = offset or (0,0)
+    slots = parallel_slots(problem_id)
+    order = None
+    if config.case_order and int(problem_id) not in config.case_order_disabled:
+        order = case_stats.order(problem_id,data_count) #先运行容易失败且耗时短的数据
+    stopped = [] #评测已经结束,之后结束的数据可能是被取消时杀死的,不记录
+    def func(num):
+        ret,result = judge_case(solution_id,problem_id,num,time_limit+10,mem_limit,language,slots > 1)
+        if config.case_order and ret != False and not stopped:
+            #每组数据运行完就记录,包括第一组失败之后不再产生结果的数据
+            case_stats.record(problem_id,num,case_failed((ret,result)),ret.get('timeused',0))
+        return ret,result
+    cases = run_cases(func,data_count,case_failed,slots,order)
+    try:
+        for num,(ret,result) in cases:
+            if ret == False:
+                continue
+            if ret['result'] == 5:
+                program_info['result'] =result_code["Runtime Error"]
+                return program_info
+            elif ret['result'] == 2:
+                program_info['result'] = result_code["Time Limit Exceeded"]
+                program_info['take_time'] = time_limit+10-startup_time
+                return program_info
+            elif ret['result'] == 3:
+                program_info['result'] =result_code["Memory Limit Exceeded"]
+                program_info['take_memory'] = mem_limit-startup_mem
+                return program_info
+            if max_time < ret["timeused"]:
+                max_time = ret['timeused']
+            if max_mem < ret['memoryused']:
+                max_mem = ret['memoryused']
+            if result == False:
+                continue
+            if result == "Wrong Answer" or result == "Output limit" or result == "System Error":
                 program_info['result'] = result_code[result]
-        else:
-            logging.error("judge did not get result")
-    program_info['take_time'] = max_time
-    program_info['take_memory'] = max_mem
+                break
+            elif result == 'Presentation Error':
+                program_info['result'] = result_code[result]
+            elif result == 'Accepted':
+                if program_info['result'] != 'Presentation Error':
+                    program_info['result'] = result_code[result]
+            else:
+                logging.error("judge did not get result")
+    finally:
+        stopped.append(True)
+        cases.close() #取消还没有运行的数据,结束正在运行的数据
+    program_info['take_time'] = max(max_time-startup_time,0)
+    program_info['take_memory'] = max(max_mem-startup_mem,0)
     return program_info
 
-def run(problem_id,solution_id,language,data_count,user_id):
+def runtime_offset(language):
+    '''测量过的启动开销(时间,内存),不使用或没有测量返回None'''
+    if not config.runtime_calibrate or language not in hello:
+        return None
+    return runtimes.offset(language)
+
+def calibrate_runtime(language):
+    '''编译空程序并在lorun下多运行一次,丢弃第一次后记录runtime_calib_runs次的启动开销'''
+    solution_id = "calibrate-%s-%s"%(language,os.getpid())
+    try:
+        dir_work = workarea.allocate(solution_id)
+        name,code = hello[language]
+        f = file(os.path.join(dir_work,name),'w')
+        f.write(code)
+        f.close()
+        p = subprocess.Popen(build_cmd[language],shell=True,cwd=dir_work,stdout=subprocess.PIPE,stderr=subprocess.PIPE,preexec_fn=compile_preexec if config.cpu_pinning else None)
+        out,err = p.communicate()
+        if p.returncode != 0:
+            logging.error("calibrate %s compile error: %s"%(language,err+out))
+            return None
+        samples = []
+        for i in range(config.runtime_calib_runs + 1):
+            null_in = file(os.devnull)
+            null_out = file(os.devnull,'w')
+            runcfg = {
+                'args':run_args(solution_id,language),
+                'fd_in':null_in.fileno(),
+                'fd_out':null_out.fileno(),
+                'timelimit':10000, #in MS
+                'memorylimit':config.runtime_calib_memory, #in KB
+            }
+            try:
+                with run_core() as cpu: #与评测时一样绑定到运行核
+                    if cpu is not None:
+                        rst = fork_call(run_sandbox,runcfg,None,cpu,keep_fds=(runcfg['fd_in'],runcfg['fd_out']))
+                    else:
+                        rst = lorun.run(runcfg)
+            finally:
+                null_in.close()
+                null_out.close()
+            if rst['result'] != 0:
+                logging.error("calibrate %s run error: %s"%(language,rst))
+                return None
+            samples.append(rst)
+        return runtimes.record(language,samples[1:]) #第一次运行文件缓存还是冷的
+    except Exception as e:
+        logging.error(e)
+        return None
+    finally:
+        workarea.release(solution_id)
+
+def calibrate_runtimes():
+    '''测量还没有测量或编译器版本变化的语言'''
+    for language in sorted(hello):
+        if runtimes.offset(language) is None:
+            calibrate_runtime(language)
+
+def run(problem_id,solution_id,language,data_count,user_id,compiled=None,save_info=True):
     low_level()
-    '''获取程序执行时间和内存'''
+    '''获取程序执行时间和内存,compiled为已经编译的结果,save_info见compile'''
 #    dblock.acquire()
     time_limit,mem_limit=get_problem_limit(problem_id)
 #    dblock.release()
@@ -492,8 +1061,10 @@ def run(problem_id,solution_id,language,data_count,user_id):
 #    if check_dangerous_code(solution_id,language) == False:
 #        program_info['result'] = result_code["Runtime Error"]
 #        return program_info
-    compile_result = compile(solution_id,language)
-    if compile_result is False:#编译错误
+    if compiled is None:
+        with phase("compile"):
+            compiled = compile(solution_id,language,save_info)
+    if compiled is False:#编译错误
         program_info['result'] = result_code["Compile Error"]
         return program_info
     if data_count == 0:#没有测试数据
@@ -508,15 +1079,57 @@ def check_thread():
     '''检测评测程序是否存在,小于config规定数目则启动新的'''
     while True:
         try:
-            if threading.active_count() < config.count_thread + 2:
+            if pipeline is not None:
+                pipeline.check()
+                time.sleep(1)
+                continue
+            autoscale()
+            if supervisor is not None:
+                supervisor.check()
+                time.sleep(1)
+                continue
+            with workers_lock:
+                worker_threads[:] = [t for t in worker_threads if t.is_alive()]
+                missing = target_workers() - len(worker_threads)
+            for i in range(missing):
                 logging.info("start new thread")
-                t = threading.Thread(target=worker)
-                t.deamon = True
-                t.start()
+                start_worker()
             time.sleep(1)
         except Exception as e:
             logging.error(e)
 
+def oldest_wait():
+    '''队列中最早的任务已经等待的时间'''
+    if hasattr(q,'stats'):
+        return max([item['oldest_wait'] for item in q.stats().values()] or [0])
+    with q.mutex:
+        task = q.queue[0] if q.queue else None
+    if task is None or 'queued_at' not in task:
+        return 0
+    return time.time() - task['queued_at']
+
+def autoscale():
+    '''根据队列和主机负载调整评测线程(进程)数,多出的线程空闲时自己退出'''
+    if scaler is None:
+        return
+    busy = supervisor.busy() if supervisor is not None else busy_workers[0]
+    target = scaler.decide(q.qsize(),oldest_wait(),busy)
+    if supervisor is not None and target != supervisor.count:
+        supervisor.resize(target)
+
+def use_pipeline():
+    '''流水线只用于线程模式'''
+    return config.pipeline and config.worker_mode != "process"
+
+def init_autoscale():
+    global scaler
+    if not config.autoscale or use_pipeline():
+        return
+    maximum = config.autoscale_max_workers
+    if config.cpu_pinning: #每个运行核最多一个评测
+        maximum = min(maximum,worker_count())
+    scaler = Autoscaler(config.autoscale_min_workers,maximum,worker_count())
+
 def start_protect():
     '''开启守护进程'''
     low_level()
@@ -524,13 +1137,129 @@ def start_protect():
     t.deamon = True
     t.start()
 
+verdict_name = {
+    0:"Waiting",1:"Accepted",2:"Time Limit Exceeded",3:"Memory Limit Exceeded",4:"Wrong Answer",
+    5:"Runtime Error",6:"Output limit",7:"Compile Error",8:"Presentation Error",11:"System Error",12:"Judging",
+}
+
+def sync_counters():
+    '''把连接池和编译缓存的累计统计转换为计数器'''
+    if db.pool is not None:
+        stats = db.pool.stats()
+        registry.sync('oj_db_pool_wait_seconds_total',stats['wait_total'])
+        registry.sync('oj_db_pool_acquire_total',stats['wait_count'])
+        registry.sync('oj_db_reconnect_total',stats['reconnects'])
+    stats = compile_cache.stats()
+    registry.sync('oj_compile_cache_hits_total',stats['hits'])
+    registry.sync('oj_compile_cache_misses_total',stats['misses'])
+
+def gauges():
+    '''抓取指标时读取的当前状态'''
+    sync_counters()
+    samples = [('oj_queue_depth',{},q.qsize()),('oj_inqueue_tasks',{},len(runid_inqueue_set))]
+    if hasattr(q,'stats'):
+        for name,item in q.stats().items():
+            samples.append(('oj_class_queue_depth',{'class':name},item['depth']))
+            samples.append(('oj_class_oldest_wait_seconds',{'class':name},item['oldest_wait']))
+            samples.append(('oj_class_wait_seconds_avg',{'class':name},item['wait_avg']))
+    if pipeline is not None:
+        stages = pipeline.stats()
+        workers = sum(i['workers'] for i in stages.values())
+        busy = sum(i['busy'] for i in stages.values())
+        for name,item in stages.items():
+            samples.append(('oj_stage_workers',{'stage':name},item['workers']))
+            samples.append(('oj_stage_busy',{'stage':name},item['busy']))
+            samples.append(('oj_stage_blocked',{'stage':name},item['blocked']))
+            samples.append(('oj_stage_utilization',{'stage':name},float(item['busy'])/item['workers'] if item['workers'] else 0))
+        samples.append(('oj_handoff_depth',{},pipeline.handoff.qsize()))
+    elif supervisor is not None:
+        workers,busy = supervisor.count,supervisor.busy()
+    else:
+        workers,busy = len([t for t in worker_threads if t.is_alive()]),busy_workers[0]
+    samples.append(('oj_workers',{},workers))
+    samples.append(('oj_workers_target',{},target_workers()))
+    samples.append(('oj_workers_busy',{},busy))
+    overdue,oldest = inflight_stats()
+    samples.append(('oj_tasks_overdue',{},overdue))
+    samples.append(('oj_oldest_task_seconds',{},oldest))
+    samples.append(('oj_worker_utilization',{},float(busy)/workers if workers else 0))
+    if db.pool is not None:
+        stats = db.pool.stats()
+        samples.append(('oj_db_pool_in_use',{},stats['in_use']))
+        samples.append(('oj_db_pool_wait_seconds_max',{},stats['wait_max']))
+    samples.append(('oj_compile_cache_bytes',{},compile_cache.stats()['size']))
+    for slots in (compile_slots,run_slots):
+        samples.append(('oj_slots',{'slot':slots.name},slots.count))
+        samples.append(('oj_slots_in_use',{'slot':slots.name},slots.used))
+    samples.append(('oj_db_writes_pending',{},writer.pending()))
+    return samples
+
+def start_metrics():
+    '''开启指标http服务'''
+    if not config.metrics_port:
+        return
+    registry.gauge(gauges)
+    try:
+        metrics.serve()
+    except Exception as e:
+        logging.error("metrics server: %s"%e)
+
+def start_lease():
+    '''认领模式下开启续约和回收过期租约的线程'''
+    if not config.claim_mode:
+        return
+    release_node()
+    t = threading.Thread(target=lease_loop, name="lease")
+    t.deamon = True
+    t.start()
+
+def calibrate():
+    '''在获取任务之前测量启动开销,测量时没有其他程序在运行;结果写入文件后评测进程读取'''
+    if not config.runtime_calibrate:
+        return
+    calibrate_runtimes()
+
+def start_pch():
+    '''开启编译预编译头文件的线程'''
+    if not config.pch:
+        return
+    t = threading.Thread(target=pchs.prebuild, args=(build_cmd,), name="pch")
+    t.deamon = True
+    t.start()
+
+def start_reconcile():
+    '''开启统计信息校正线程'''
+    if config.stats_reconcile_interval <= 0:
+        return
+    t = threading.Thread(target=reconcile_loop, name="reconcile")
+    t.deamon = True
+    t.start()
+
 def main():
     low_level()
     logging.basicConfig(level=logging.INFO,
                         format = '%(asctime)s --- %(message)s',)
+    if config.cpu_pinning:
+        logging.info("run cpus %s, compile cpus %s"%(cpuset.run_cores,cpuset.compile_cores))
+    init_autoscale()
+    if config.worker_mode == "process":
+        #先启动评测进程,fork时主进程还没有其他线程
+        start_work_process()
+    if config.manifest_inotify:
+        manifests.watch()
+    if config.manifest_preload:
+        manifests.preload()
+    calibrate()
+    start_lease()
     start_get_task()
-    start_work_thread()
+    if use_pipeline():
+        start_pipeline()
+    elif config.worker_mode != "process":
+        start_work_thread()
     start_protect()
+    start_reconcile()
+    start_pch()
+    start_metrics()
 
 if __name__=='__main__':
     main()
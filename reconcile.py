@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''用户和题目统计信息校正
+
+评测时只对统计信息做增量更新,并发评测或重判会带来误差,
+这里定期按solution表全量重新计算,只改写有误差的行
+
+增量更新判断"第一次AC"需要以下索引,否则每次仍会扫描用户的全部提交:
+create index solution_user_problem_result on solution(user_id, problem_id, result);
+'''
+import time
+import logging
+import config
+from db import run_sql_pooled
+
+def reconcile_users(user_ids=None):
+    '''重新计算用户的解题数和提交数,user_ids为空时校正全部用户'''
+    #只统计已经有结果的提交,与评测写入结果时的增量更新一致
+    where = "where result not in (0,12)"
+    if user_ids:
+        where += " and user_id in (%s)"%','.join(str(int(i)) for i in user_ids)
+    sql = '''update user_statistics set accepts_count = s.ac, solutions_count = s.sub
+from (select user_id,count(distinct case when result = 1 then problem_id end) as ac,count(problem_id) as sub
+      from solution %s group by user_id) s
+where user_statistics.id = s.user_id
+  and (user_statistics.accepts_count <> s.ac or user_statistics.solutions_count <> s.sub)'''%where
+    return run_sql_pooled(sql)
+
+def reconcile_problems(problem_ids=None):
+    '''重新计算题目的AC数和提交数,problem_ids为空时校正全部题目'''
+    #只统计已经有结果的提交,与评测写入结果时的增量更新一致
+    where = "where result not in (0,12)"
+    if problem_ids:
+        where += " and problem_id in (%s)"%','.join(str(int(i)) for i in problem_ids)
+    sql = '''update problem_statistics set accepts_count = s.ac, solutions_count = s.sub
+from (select problem_id,sum(case when result = 1 then 1 else 0 end) as ac,count(*) as sub
+      from solution %s group by problem_id) s
+where problem_statistics.id = s.problem_id
+  and (problem_statistics.accepts_count <> s.ac or problem_statistics.solutions_count <> s.sub)'''%where
+    return run_sql_pooled(sql)
+
+def reconcile_loop():
+    '''定期校正统计信息'''
+    while True:
+        time.sleep(config.stats_reconcile_interval)
+        start = time.time()
+        if reconcile_users() is False or reconcile_problems() is False:
+            logging.error("reconcile statistics failed")
+            continue
+        logging.info("reconcile statistics in %.2fs"%(time.time()-start))
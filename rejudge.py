@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''批量重判
+
+按题目,比赛或提交id选出已经有结果的提交,在单独的低优先级进程中重新评测,不经过评测队列,不影响正常评测.
+每个提交在子进程中评测,rejudge_threads个同时进行;相同代码使用编译缓存,不重复编译.
+结果每rejudge_batch个在一个事务中写入,全部完成后校正受影响的用户和题目的统计信息,
+并输出新旧结果的变化.需要root运行(与protect.py相同,切换到nobody)
+
+Usage:
+    python rejudge.py --problem 1001
+    python rejudge.py --contest 12
+    python rejudge.py --ids 3,4,5 [--dry-run] [--threads 2]
+'''
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+from multiprocessing.pool import ThreadPool
+import config
+import db
+from db import run_sql_pooled
+from reconcile import reconcile_users, reconcile_problems
+
+def select_solutions(problem_id=None, contest_id=None, ids=None):
+    '''选出需要重判的提交,等待评测和正在评测的提交由评测程序处理,不重判'''
+    where = ["s.result not in (0,12)"]
+    if problem_id is not None:
+        where.append("s.problem_id = %s"%int(problem_id))
+    if contest_id is not None:
+        where.append("s.contest_id = %s"%int(contest_id))
+    if ids:
+        where.append("s.id in (%s)"%','.join(str(int(i)) for i in ids))
+    sql = '''select s.id,s.problem_id,s.user_id,s.contest_id,s.program_language,c.content,s.result
+from solution s join code c on c.solution_id = s.id
+where %s order by s.id'''%' and '.join(where)
+    return run_sql_pooled(sql)
+
+def judge_solution(row):
+    '''在子进程中评测一个提交,返回评测结果;编译错误时compile_info为编译信息,不在这里写入数据库'''
+    import protect
+    db.after_fork()
+    protect.writer.after_fork()
+    solution_id,problem_id,user_id,contest_id,pro_lang,code,old = row
+    if protect.write_code(solution_id,problem_id,pro_lang,code) == False:
+        return None
+    data_count = protect.get_data_count(problem_id)
+    result = protect.run(problem_id,solution_id,pro_lang,data_count,user_id,save_info=False)
+    if result['result'] == 7:
+        result['compile_info'] = open(protect.workarea.path(solution_id,'error.txt')).read()
+    return result
+
+def write_results(results):
+    '''在一个事务中写入一批结果,只有仍然不是等待评测的提交才写入;编译信息替换原有的,不重复插入'''
+    from protect import compile_info_sql
+    sqls = []
+    for r in results:
+        judged = "exists (select 1 from solution where id = %s and result not in (0,12))"%r['solution_id']
+        sqls.append("update solution set take_time = %s, take_memory = %s, result = %s where id = %s and result not in (0,12)"%(
+            r['take_time'],r['take_memory'],r['result'],r['solution_id']))
+        sqls.append("delete from compile_info where code_id = %s and %s"%(r['solution_id'],judged))
+        if 'compile_info' in r:
+            sqls.append(compile_info_sql(r['solution_id'],r['compile_info'],judged))
+    return run_sql_pooled(sqls)
+
+class Rejudge(object):
+    '''重判一批提交'''
+    def __init__(self, rows, threads=None, batch=None, dry_run=False):
+        self.rows = rows
+        self.threads = threads or config.rejudge_threads
+        self.batch = batch or config.rejudge_batch
+        self.dry_run = dry_run
+        self.lock = threading.Lock()
+        self.pending = []       #还没有写入的结果
+        self.changes = []       #(solution_id,旧结果,新结果)
+        self.failed = []
+        self.done = 0
+        self.written = 0
+        self.start = None
+
+    def judge(self, row):
+        from caserunner import fork_call
+        import protect
+        protect.get_problem_limit(row[1]) #在父进程中读取限制,子进程不必查询数据库
+        try:
+            return row, fork_call(judge_solution, row)
+        except Exception as e:
+            logging.error("rejudge %s: %s"%(row[0], e))
+            return row, None
+        finally:
+            #在父进程中回收评测目录:子进程退出时来不及由后台线程删除
+            if os.path.isdir(protect.workarea.path(row[0])):
+                protect.clean_work_dir(row[0])
+
+    def collect(self, row, result):
+        solution_id, old = row[0], row[6]
+        with self.lock:
+            self.done += 1
+            if result is None or result['result'] in (0,11):
+                self.failed.append(solution_id)
+                return
+            if result['result'] != old:
+                self.changes.append((solution_id, old, result['result']))
+            self.pending.append(result)
+            if len(self.pending) < self.batch:
+                return
+            batch, self.pending = self.pending, []
+        self.flush(batch)
+
+    def flush(self, batch):
+        if not batch or self.dry_run:
+            return
+        if write_results(batch) is False:
+            logging.error("write rejudge results failed: %s"%','.join(str(r['solution_id']) for r in batch))
+            with self.lock:
+                self.failed.extend(r['solution_id'] for r in batch)
+            return
+        with self.lock:
+            self.written += len(batch)
+
+    def progress(self):
+        elapsed = time.time() - self.start
+        rate = self.done / elapsed if elapsed else 0
+        left = (len(self.rows) - self.done) / rate if rate else 0
+        print "%s/%s judged, %s changed, %.2f/s, %ds left"%(self.done, len(self.rows), len(self.changes), rate, left)
+        sys.stdout.flush()
+
+    def run(self):
+        self.start = time.time()
+        last = 0
+        pool = ThreadPool(self.threads)
+        try:
+            for row, result in pool.imap_unordered(self.judge, self.rows):
+                self.collect(row, result)
+                if time.time() - last >= config.rejudge_progress_interval:
+                    last = time.time()
+                    self.progress()
+        finally:
+            pool.close()
+        with self.lock:
+            batch, self.pending = self.pending, []
+        self.flush(batch)
+        self.progress()
+        if self.changes and not self.dry_run:
+            #只重新计算结果变化的用户和题目
+            changed = set(c[0] for c in self.changes)
+            reconcile_users(set(r[2] for r in self.rows if r[0] in changed))
+            reconcile_problems(set(r[1] for r in self.rows if r[0] in changed))
+
+    def report(self, limit=50):
+        '''输出新旧结果的变化'''
+        from protect import verdict_name
+        name = lambda code: verdict_name.get(code, code)
+        summary = {}
+        for solution_id, old, new in self.changes:
+            summary[(old, new)] = summary.get((old, new), 0) + 1
+        print
+        print "rejudged %s, written %s, changed %s, failed %s in %.1fs%s"%(
+            self.done, self.written, len(self.changes), len(self.failed),
+            time.time() - self.start, " (dry run)" if self.dry_run else "")
+        for (old, new), count in sorted(summary.items(), key=lambda i: -i[1]):
+            print "  %-22s -> %-22s %s"%(name(old), name(new), count)
+        for solution_id, old, new in sorted(self.changes)[:limit]:
+            print "  %s: %s -> %s"%(solution_id, name(old), name(new))
+        if len(self.changes) > limit:
+            print "  ..."
+        if self.failed:
+            print "failed: %s"%','.join(str(i) for i in sorted(self.failed))
+
+def main():
+    parser = argparse.ArgumentParser(description="rejudge submissions")
+    parser.add_argument('--problem', type=int)
+    parser.add_argument('--contest', type=int)
+    parser.add_argument('--ids', help="逗号分隔的提交id")
+    parser.add_argument('--threads', type=int, default=config.rejudge_threads)
+    parser.add_argument('--batch', type=int, default=config.rejudge_batch)
+    parser.add_argument('--dry-run', action='store_true', help="只评测和输出变化,不写入数据库")
+    args = parser.parse_args()
+    ids = [int(i) for i in args.ids.split(',') if i.strip()] if args.ids else None
+    if args.problem is None and args.contest is None and not ids:
+        parser.error("need --problem, --contest or --ids")
+    logging.basicConfig(level=logging.WARNING,
+                        format = '%(asctime)s --- %(message)s',)
+    os.nice(config.rejudge_nice)
+    import protect #切换到nobody
+    rows = select_solutions(args.problem, args.contest, ids)
+    if rows is False:
+        return -1
+    print "%s solutions to rejudge"%len(rows)
+    if not rows:
+        return 0
+    rejudge = Rejudge(rows, args.threads, args.batch, args.dry_run)
+    rejudge.run()
+    rejudge.report()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
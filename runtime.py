@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''解释型语言和JVM的启动开销
+
+启动时在开始评测之前用空程序在lorun下运行若干次,丢弃第一次(冷缓存)后取中位数作为该语言的启动时间和内存,
+评测时在限制上加上启动开销,报告的时间和内存减去启动开销,代替原来的限制翻倍.
+结果按编译器版本保存在runtime_calib_path文件中,版本变化后重新测量,多个评测进程共用
+'''
+import os
+import json
+import time
+import logging
+import threading
+import config
+from compile_cache import compiler_version
+
+#测量启动开销用的空程序 {语言: (源文件名,代码)}
+hello = {
+    "java"   : ("Main.java", "public class Main{public static void main(String[] args){}}\n"),
+    "python2": ("main.py", "\n"),
+    "python3": ("main.py", "\n"),
+    "ruby"   : ("main.rb", "\n"),
+    "perl"   : ("main.pl", "\n"),
+    "lua"    : ("main.lua", "\n"),
+}
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+class RuntimeCalibration(object):
+    '''各语言的启动开销:data[language] = {"version","time"(ms),"memory"(KB),"samples","measured"}'''
+    def __init__(self, path=None):
+        self.path = path or config.runtime_calib_path
+        self.lock = threading.Lock()
+        self.data = {}
+        self.mtime = None
+
+    def _reload(self):
+        '''文件被其他进程更新后重新读取'''
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+        try:
+            data = json.load(open(self.path))
+        except (IOError, ValueError) as e:
+            logging.error(e)
+            return
+        self.data = data
+        self.mtime = mtime
+
+    def offset(self, language):
+        '''返回(时间,内存)开销,没有测量或编译器版本已变化返回None'''
+        with self.lock:
+            self._reload()
+            item = self.data.get(language)
+        if item is None or item["version"] != compiler_version(language):
+            return None
+        return item["time"], item["memory"]
+
+    def record(self, language, samples):
+        '''保存一种语言的测量结果,samples为lorun的运行结果(不包括丢弃的第一次)'''
+        item = {
+            "version": compiler_version(language),
+            "time": median(s['timeused'] for s in samples),
+            "memory": median(s['memoryused'] for s in samples),
+            "samples": len(samples),
+            "measured": time.time(),
+        }
+        with self.lock:
+            self._reload()
+            self.data[language] = item
+            tmp = '%s.%s.tmp'%(self.path, os.getpid())
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump(self.data, f)
+                os.rename(tmp, self.path)
+                self.mtime = os.stat(self.path).st_mtime
+            except (IOError, OSError) as e:
+                logging.error(e)
+        logging.info("%s startup %sms %sKB"%(language, item["time"], item["memory"]))
+        return item
+
+    def stats(self):
+        with self.lock:
+            self._reload()
+            return dict((k, (v["time"], v["memory"])) for k, v in self.data.items())
+
+runtimes = RuntimeCalibration()
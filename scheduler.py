@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''评测任务调度
+
+代替先进先出的Queue,接口相同.任务分为比赛(contest),练习(practice)两类,按优先级取出;
+批量重判不经过评测队列,由rejudge.py在单独的低优先级进程中进行;
+低优先级的任务等待超过sched_max_wait秒后优先取出,防止饿死.
+同一类中按用户公平排队:每个任务的完成标记 = max(该类虚拟时间,该用户上一个任务的完成标记) + 预计耗时,
+取完成标记最小的任务,一个用户连续提交只会排在自己的任务后面,耗时短的题目先评测.
+预计耗时为该题目最近评测耗时的指数平均
+'''
+import time
+import heapq
+import itertools
+import collections
+import threading
+import config
+from Queue import Empty, Full
+
+def task_class(task):
+    '''任务的优先级类别'''
+    if task.get('contest_id'):
+        return 'contest'
+    return 'practice'
+
+class ClassQueue(object):
+    '''一个优先级类别内的公平队列'''
+    def __init__(self, name):
+        self.name = name
+        self.heap = []          #(完成标记,序号,入队时间,开始标记,任务)
+        self.fifo = collections.deque() #(入队时间,序号),按入队顺序,取出的任务延迟删除
+        self.live = set()       #还在队列中的任务序号
+        self.vtime = 0.0        #最近取出任务的开始标记
+        self.finish = {}        #user_id -> 该用户最后一个任务的完成标记
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def put(self, task, cost, seq):
+        user = task.get('user_id')
+        start = max(self.vtime, self.finish.get(user, 0.0))
+        finish = start + cost
+        self.finish[user] = finish
+        now = time.time()
+        heapq.heappush(self.heap, (finish, seq, now, start, task))
+        self.fifo.append((now, seq))
+        self.live.add(seq)
+
+    def oldest(self):
+        '''等待最久的任务的入队时间'''
+        while self.fifo and self.fifo[0][1] not in self.live:
+            self.fifo.popleft()
+        return self.fifo[0][0] if self.fifo else None
+
+    def get(self):
+        finish, seq, queued, start, task = heapq.heappop(self.heap)
+        self.live.discard(seq)
+        self.vtime = max(self.vtime, start)
+        if not self.heap: #队列为空时清除用户记录,防止无限增长
+            self.finish.clear()
+        wait = time.time() - queued
+        self.waits += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        return task
+
+class FairScheduler(object):
+    '''优先级加用户公平排队的任务队列,maxsize<=0表示不限制'''
+    def __init__(self, maxsize=0, classes=None):
+        self.maxsize = maxsize
+        self.classes = classes or config.sched_classes
+        self.queues = dict((name, ClassQueue(name)) for name in self.classes)
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.not_full = threading.Condition(self.mutex)
+        self.all_tasks_done = threading.Condition(self.mutex)
+        self.unfinished_tasks = 0
+        self.size = 0
+        self.seq = itertools.count()
+        self.costs = {}         #problem_id -> 评测耗时(秒)的指数平均
+
+    def cost(self, problem_id):
+        return self.costs.get(int(problem_id), config.sched_default_cost)
+
+    def record_cost(self, problem_id, seconds):
+        '''记录一次评测的耗时'''
+        problem_id = int(problem_id)
+        with self.mutex:
+            old = self.costs.get(problem_id)
+            if old is None:
+                self.costs[problem_id] = seconds
+            else:
+                self.costs[problem_id] = old + config.sched_cost_alpha * (seconds - old)
+
+    def put(self, task, block=True, timeout=None):
+        with self.not_full:
+            if self.maxsize > 0:
+                if not block:
+                    if self.size >= self.maxsize:
+                        raise Full
+                elif timeout is None:
+                    while self.size >= self.maxsize:
+                        self.not_full.wait()
+                else:
+                    end = time.time() + timeout
+                    while self.size >= self.maxsize:
+                        remaining = end - time.time()
+                        if remaining <= 0:
+                            raise Full
+                        self.not_full.wait(remaining)
+            name = task_class(task)
+            queue = self.queues.get(name) or self.queues[self.classes[-1]]
+            queue.put(task, self.cost(task['problem_id']), next(self.seq))
+            self.size += 1
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def put_nowait(self, task):
+        return self.put(task, False)
+
+    def _select(self):
+        '''选择要取出任务的类别:等待超时的低优先级任务优先,否则按优先级'''
+        now = time.time()
+        for name in reversed(self.classes):
+            oldest = self.queues[name].oldest()
+            if oldest is not None and now - oldest > config.sched_max_wait:
+                return self.queues[name]
+        for name in self.classes:
+            if self.queues[name].heap:
+                return self.queues[name]
+
+    def get(self, block=True, timeout=None):
+        with self.not_empty:
+            if not block:
+                if not self.size:
+                    raise Empty
+            elif timeout is None:
+                while not self.size:
+                    self.not_empty.wait()
+            else:
+                end = time.time() + timeout
+                while not self.size:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        raise Empty
+                    self.not_empty.wait(remaining)
+            task = self._select().get()
+            self.size -= 1
+            self.not_full.notify()
+            return task
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def task_done(self):
+        with self.all_tasks_done:
+            unfinished = self.unfinished_tasks - 1
+            if unfinished < 0:
+                raise ValueError('task_done() called too many times')
+            if unfinished == 0:
+                self.all_tasks_done.notify_all()
+            self.unfinished_tasks = unfinished
+
+    def join(self):
+        with self.all_tasks_done:
+            while self.unfinished_tasks:
+                self.all_tasks_done.wait()
+
+    def qsize(self):
+        with self.mutex:
+            return self.size
+
+    def empty(self):
+        with self.mutex:
+            return not self.size
+
+    def full(self):
+        with self.mutex:
+            return 0 < self.maxsize <= self.size
+
+    def stats(self):
+        '''每个类别的队列长度,最长等待时间和已取出任务的等待时间'''
+        now = time.time()
+        result = {}
+        with self.mutex:
+            for name, queue in self.queues.items():
+                oldest = queue.oldest()
+                result[name] = {
+                    "depth": len(queue.heap),
+                    "oldest_wait": now - oldest if oldest is not None else 0,
+                    "dequeued": queue.waits,
+                    "wait_avg": queue.wait_total / queue.waits if queue.waits else 0,
+                    "wait_max": queue.wait_max,
+                }
+        return result
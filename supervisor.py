@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''评测进程管理
+
+主进程把任务交给count个评测进程,评测进程各自使用自己的数据库连接,
+比较输出等CPU工作不再受GIL限制.进程崩溃后重新启动,正在评测的任务交给on_lost处理.
+
+评测进程都由start()时创建的zygote进程fork.此时主进程还没有其他线程,
+之后主进程有了很多线程,直接fork可能复制其他线程正持有的锁(如logging的锁),子进程因此死锁
+'''
+import os
+import signal
+import logging
+import threading
+import multiprocessing
+from Queue import Empty
+from multiprocessing.queues import SimpleQueue
+import db
+from dispatcher import writer
+
+def exit_code(status):
+    '''waitpid的状态转换为与Process.exitcode相同的返回值'''
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+class WorkerSupervisor(object):
+    '''管理评测进程,handler(task)在评测进程中执行'''
+    def __init__(self, handler, count, on_done=None, on_lost=None, on_start=None, capacity=None):
+        self.handler = handler
+        self.count = count
+        self.capacity = max(capacity or count, count) #resize的上限
+        self.on_done = on_done
+        self.on_lost = on_lost
+        self.on_start = on_start #on_start(index)在评测进程启动时执行
+        self.tasks = multiprocessing.Queue()
+        #SimpleQueue直接写入管道,进程随后崩溃也不会丢失完成消息
+        self.events = SimpleQueue()
+        #zygote报告退出的评测进程 (编号,pid,返回值)
+        self.exits = SimpleQueue()
+        #每个评测进程正在评测的solution_id,0为空闲;放在共享内存中,进程崩溃时也不会丢失
+        self.current = multiprocessing.Array('l', self.capacity, lock=False)
+        #每个评测进程的退出标记,为1时评测进程完成当前任务后退出
+        self.stop = multiprocessing.Array('b', self.capacity, lock=False)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.procs = {}     #进程编号 -> pid
+        self.pending = {}   #solution_id -> 已交给评测进程但还没有完成的任务
+        self.spawn_lock = threading.Lock()
+        self.conn = None
+        self.zygote = None
+
+    def start(self):
+        self.start_zygote()
+        for i in range(self.count):
+            self.spawn(i)
+        t = threading.Thread(target=self.collect, name="supervisor")
+        t.deamon = True
+        t.start()
+
+    def start_zygote(self):
+        '''创建负责fork评测进程的zygote进程,必须在主进程启动其他线程之前调用'''
+        self.conn, child = multiprocessing.Pipe()
+        self.zygote = multiprocessing.Process(target=self.run_zygote, args=(child,), name="judge-zygote")
+        self.zygote.daemon = True
+        self.zygote.start()
+        child.close()
+
+    def run_zygote(self, conn):
+        '''zygote进程主循环:按主进程的要求fork评测进程,回收退出的评测进程并报告返回值'''
+        self.conn.close()
+        children = {}   #pid -> 进程编号
+        def stop_children(signum=None, frame=None):
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            os._exit(0)
+        signal.signal(signal.SIGTERM, stop_children)
+        while True:
+            try:
+                if conn.poll(1):
+                    index = conn.recv()
+                    pid = self.fork_worker(index, conn)
+                    children[pid] = index
+                    conn.send(pid)
+            except (EOFError, IOError): #主进程已经退出
+                stop_children()
+            while children:
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                except OSError:
+                    break
+                if pid == 0:
+                    break
+                index = children.pop(pid, None)
+                if index is not None:
+                    self.exits.put((index, pid, exit_code(status)))
+
+    def fork_worker(self, index, conn):
+        '''在zygote进程中fork编号为index的评测进程'''
+        pid = os.fork()
+        if pid:
+            return pid
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            conn.close()
+            self.work(index)
+        except BaseException as e:
+            logging.exception(e)
+            code = 1
+        finally:
+            os._exit(code)
+
+    def spawn(self, index):
+        '''启动编号为index的评测进程'''
+        self.stop[index] = 0
+        with self.spawn_lock:
+            self.conn.send(index)
+            pid = self.conn.recv()
+        with self.lock:
+            self.procs[index] = pid
+        logging.info("start judge process %s pid %s"%(index,pid))
+
+    def work(self, index):
+        '''评测进程主循环,退出标记被设置后退出'''
+        db.after_fork()
+        writer.after_fork()
+        if self.on_start is not None:
+            self.on_start(index)
+        while not self.stop[index]:
+            try:
+                task = self.tasks.get(timeout=1)
+            except Empty:
+                continue
+            self.current[index] = int(task['solution_id'])
+            try:
+                self.handler(task)
+            except Exception as e:
+                logging.exception(e)
+            self.current[index] = 0
+            self.events.put(task)
+
+    def submit(self, task):
+        with self.lock:
+            self.pending[int(task['solution_id'])] = task
+        self.tasks.put(task)
+
+    def resize(self, count):
+        '''调整评测进程数:减少时设置多出进程的退出标记,优先选择空闲的进程;
+        增加时先取消还没有退出的进程的退出标记,再启动新的进程'''
+        count = max(1, min(count, self.capacity))
+        with self.lock:
+            self.count = count
+            running = [i for i in self.procs if not self.stop[i]]
+            retiring = sorted(i for i in self.procs if self.stop[i])
+            need = count - len(running)
+            for index in retiring[:max(0, need)]:
+                self.stop[index] = 0
+            need -= len(retiring[:max(0, need)])
+            free = [i for i in range(self.capacity) if i not in self.procs][:max(0, need)]
+            #正在评测的进程排在前面,保留编号小的
+            running.sort(key=lambda i: (self.current[i] == 0, i))
+            for index in running[count:]:
+                self.stop[index] = 1
+            self.idle.notify_all()
+        for index in free:
+            self.spawn(index)
+
+    def wait_idle(self):
+        '''等待有空闲的评测进程,任务留在调度队列中直到可以立即评测'''
+        with self.idle:
+            while len(self.pending) >= self.count:
+                self.idle.wait(1)
+
+    def collect(self):
+        '''接收评测进程的完成消息'''
+        while True:
+            task = self.events.get()
+            with self.lock:
+                self.pending.pop(int(task['solution_id']), None)
+                self.idle.notify()
+            if self.on_done is not None:
+                self.on_done(task)
+
+    def check(self):
+        '''处理zygote报告的退出的评测进程,不是因为退出标记退出的重新启动'''
+        if not self.zygote.is_alive():
+            #不能再从有多个线程的主进程fork评测进程,退出后由monitor重新启动评测程序
+            logging.error("judge zygote exit with %s"%self.zygote.exitcode)
+            os._exit(1)
+        while not self.exits.empty():
+            index, pid, exitcode = self.exits.get()
+            with self.lock:
+                if self.procs.get(index) != pid:
+                    continue
+                del self.procs[index]
+                task = self.pending.pop(self.current[index], None)
+                self.current[index] = 0
+                retired = bool(self.stop[index])
+                self.stop[index] = 0
+                self.idle.notify()
+            if retired and exitcode == 0: #resize减少的进程
+                logging.info("judge process %s pid %s retired"%(index,pid))
+                continue
+            logging.error("judge process %s pid %s exit with %s"%(index,pid,exitcode))
+            if task is not None and self.on_lost is not None:
+                self.on_lost(task)
+            if not retired:
+                self.spawn(index)
+
+    def busy(self):
+        '''正在评测的进程数'''
+        return len([i for i in self.current if i])
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+#coding=utf-8
+'''评测目录管理
+
+work_tmpfs为True时,提交的评测目录优先分配在tmpfs(work_tmpfs_dir)上,
+每个目录按work_quota字节计算容量,tmpfs容量不足或预计大小超过配额的提交使用磁盘上的work_dir.
+释放目录时只是改名移到.trash-*,由后台线程删除,tmpfs上的目录清空后作为.free-*重复使用,
+评测线程不等待删除.目录是否在tmpfs上由文件系统决定,评测进程和主进程可以共用
+'''
+import os
+import shutil
+import logging
+import threading
+import itertools
+import config
+from Queue import Queue
+
+class WorkArea(object):
+    '''分配和回收每个提交的评测目录'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.trash = Queue()
+        self.reaper = None
+        self.counter = itertools.count()
+
+    def base(self, solution_id):
+        '''提交的评测目录所在的根目录'''
+        if config.work_tmpfs and os.path.isdir(os.path.join(config.work_tmpfs_dir,str(solution_id))):
+            return config.work_tmpfs_dir
+        return config.work_dir
+
+    def path(self, solution_id, *names):
+        '''提交的评测目录,或其中的文件'''
+        return os.path.join(self.base(solution_id),str(solution_id),*names)
+
+    def on_tmpfs(self, solution_id):
+        return self.base(solution_id) == config.work_tmpfs_dir
+
+    def tmpfs_available(self):
+        '''tmpfs上是否还能再分配一个配额'''
+        root = config.work_tmpfs_dir
+        try:
+            if not os.path.isdir(root):
+                os.makedirs(root)
+            st = os.statvfs(root)
+            active = len([i for i in os.listdir(root) if not i.startswith('.')])
+        except OSError as e:
+            logging.error(e)
+            return False
+        capacity = st.f_blocks * st.f_frsize
+        free = st.f_bavail * st.f_frsize
+        return (active + 1) * config.work_quota <= capacity and free >= config.work_quota
+
+    def take_free(self, dest):
+        '''把一个回收的空目录改名为dest,没有空目录返回False'''
+        root = config.work_tmpfs_dir
+        for name in os.listdir(root):
+            if not name.startswith('.free-'):
+                continue
+            try:
+                os.rename(os.path.join(root,name),dest)
+                return True
+            except OSError: #被其他进程取走
+                continue
+        return False
+
+    def allocate(self, solution_id, size_hint=0):
+        '''分配评测目录并返回路径,size_hint为预计使用的字节数'''
+        path = self.path(solution_id)
+        if os.path.isdir(path): #重判等情况目录已经存在
+            logging.info("dir exist")
+            return path
+        if config.work_tmpfs and size_hint <= config.work_quota and self.tmpfs_available():
+            path = os.path.join(config.work_tmpfs_dir,str(solution_id))
+            if not self.take_free(path):
+                os.mkdir(path)
+            return path
+        path = os.path.join(config.work_dir,str(solution_id))
+        os.mkdir(path)
+        return path
+
+    def release(self, solution_id):
+        '''释放评测目录,实际删除在后台线程中进行'''
+        base = self.base(solution_id)
+        path = os.path.join(base,str(solution_id))
+        trash = os.path.join(base,'.trash-%s-%s-%s'%(solution_id,os.getpid(),next(self.counter)))
+        try:
+            os.rename(path,trash)
+        except OSError as e:
+            logging.error(e)
+            return False
+        self.start_reaper()
+        self.trash.put(trash)
+        return True
+
+    def start_reaper(self):
+        with self.lock:
+            if self.reaper is not None and self.reaper.is_alive():
+                return
+            self.reaper = threading.Thread(target=self.reap, name="reaper")
+            self.reaper.daemon = True
+            self.reaper.start()
+
+    def free_count(self):
+        return len([i for i in os.listdir(config.work_tmpfs_dir) if i.startswith('.free-')])
+
+    def reap(self):
+        '''后台删除释放的目录,tmpfs上的目录清空后放回空闲目录'''
+        while True:
+            trash = self.trash.get()
+            try:
+                root = os.path.dirname(trash)
+                if root == os.path.dirname(os.path.join(config.work_tmpfs_dir,'')) \
+                        and config.work_tmpfs and self.free_count() < config.work_free_dirs:
+                    for name in os.listdir(trash):
+                        item = os.path.join(trash,name)
+                        if os.path.isdir(item) and not os.path.islink(item):
+                            shutil.rmtree(item)
+                        else:
+                            os.unlink(item)
+                    os.rename(trash,os.path.join(root,'.free-%s-%s'%(os.getpid(),next(self.counter))))
+                else:
+                    shutil.rmtree(trash)
+            except OSError as e:
+                logging.error(e)
+                shutil.rmtree(trash,ignore_errors=True)
+
+workarea = WorkArea()